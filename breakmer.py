@@ -5,6 +5,7 @@ import sys
 import argparse
 import breakmer.params as params
 import breakmer.processor.analysis as breakmer_analysis
+import breakmer.processor.server as sample_server
 
 __author__ = "Ryan Abo"
 __copyright__ = "Copyright 2015, Ryan Abo"
@@ -15,10 +16,14 @@ __license__ = "MIT"
 
 Main script that initiates the BreaKmer analysis or auxiliary functions to setup BreaKmer for analysis.
 
-There are three functions provided:
+There are six functions provided:
 1. run                    = perform analysis to detect structural variation.
 2. start_blat_server      = start the blat server in the background for analysis.
 3. prepare_reference_data = prepare the reference data for the target regions that are specified in the input files.
+4. build_pon              = build a panel of normals kmer database from normal sample bam files to use with run.
+5. merge                  = merge the outputs of an analysis run in shards (run --shard i/N) into the standard output files.
+6. serve                  = keep the reference data, blat server and processors loaded and run the sample jobs submitted
+                            to a UNIX socket or a spool directory (see breakmer/processor/server.py).
 
 
 The blat server provides a challenge in workflow. The best method is to:
@@ -33,30 +38,17 @@ The blat server provides a challenge in workflow. The best method is to:
 args = sys.argv
 
 PARSER = argparse.ArgumentParser(description='Program to identify structural variants within targeted locations.', usage='%(prog)s [options]', add_help=True)
-SUBPARSERS = PARSER.add_subparsers(help='Program mode (run, start_blat_server, prepare_reference_data).', dest='fncCmd')
+SUBPARSERS = PARSER.add_subparsers(help='Program mode (run, start_blat_server, prepare_reference_data, build_pon, merge, serve).', dest='fncCmd')
 
-RUN_PARSER = SUBPARSERS.add_parser('run', help='Run analysis to detect structural variants.')
+RUN_PARSER = SUBPARSERS.add_parser('run', parents=[params.ANALYSIS_PARSER], help='Run analysis to detect structural variants.')
 SERVER_PARSER = SUBPARSERS.add_parser('start_blat_server', help='Start the blat server prior to performing the analysis.')
 REF_PARSER = SUBPARSERS.add_parser('prepare_reference_data', help='Prepare the reference sequence data for target regions prior to analysis.')
+PON_PARSER = SUBPARSERS.add_parser('build_pon', help='Build a panel of normals kmer database from a set of normal sample bam files.')
+MERGE_PARSER = SUBPARSERS.add_parser('merge', help='Merge the outputs of the shards of an analysis run with run --shard.')
+SERVE_PARSER = SUBPARSERS.add_parser('serve', parents=[params.ANALYSIS_PARSER], help='Run the analysis of the sample jobs submitted to a UNIX socket or a spool directory, keeping the reference data loaded.')
 
-RUN_PARSER.add_argument('--log_level', dest='log_level', default='DEBUG', help='Log level [default: DEBUG]')
-RUN_PARSER.add_argument('--indel_size', dest='indel_size', default=15, type=int, help='Indel size filter. [default: %(default)s]')
-RUN_PARSER.add_argument('--trl_sr_thresh', dest='trl_sr_thresh', default=2, type=int, help='Split read support threshold for translocations. [default: %(default)s]')
-RUN_PARSER.add_argument('--indel_sr_thresh', dest='indel_sr_thresh', default=5, type=int, help='Split read support threshold for indels. [default: %(default)s]')
-RUN_PARSER.add_argument('--rearr_sr_thresh', dest='rearr_sr_thresh', default=2, type=int, help='Split read support threshold for rearrangements. [default: %(default)s]')
-RUN_PARSER.add_argument('--rearr_min_seg_len', dest='rearr_minseg_len', default=30, type=int, help='Threshold for minimum segment to be rearranged. [default: %(default)s]')
-RUN_PARSER.add_argument('--trl_min_seg_len', dest='trl_minseg_len', default=25, type=int, help='Threshold for minimum length of translocation segment. [default: %(default)s]')
-RUN_PARSER.add_argument('--align_thresh', dest='align_thresh', default=.90, type=int, help='Threshold for minimum read alignment for assembly. [default: %(default)s]')
-RUN_PARSER.add_argument('--no_output_header', dest='no_output_header', default=False, action='store_true', help='Suppress output headers. [default: %(default)s]')
-RUN_PARSER.add_argument('--discread_only_thresh', dest='discread_only_thresh', default=2, type=int, help='The number of discordant read pairs in a cluster to output without evidence from a split read event. [default: %(default)s]')
-RUN_PARSER.add_argument('--generate_image', dest='generate_image', default=False, action='store_true', help='Generate pileup image for events. [default: %(default)s]')
-RUN_PARSER.add_argument('--hostname', dest='blat_hostname', default='localhost', help='The hostname for the blat server. Localhost will be used if not specified. [default: %(default)s]')
-RUN_PARSER.add_argument('-g', '--gene_list', dest='gene_list', default=None, help='Gene list to consider for analysis. [default: %(default)s]')
-RUN_PARSER.add_argument('-f', '--filter_list', dest='filterList', default=None, help='Input a set of events to filter out. [default: %(default)s]')
-RUN_PARSER.add_argument('-n', '--nprocessors', dest='nprocs', default=1, type=int, help='The number of processors to use for analysis. [default: %(default)s]')
-RUN_PARSER.add_argument('-s', '--start_blat_server', dest='start_blat_server', default=False, action='store_true', help='Start the blat server. Random port number and localhost will be used if neither specified. [default: %(default)s]')
-RUN_PARSER.add_argument('-k', '--keep_blat_server', dest='keep_blat_server', default=False, action='store_true', help='Keep the blat server alive. [default: %(default)s]')
-RUN_PARSER.add_argument('-p', '--port_number', dest='blat_port', default=None, type=int, help='The port number for the blat server. A random port number (8000-9500) will be used if not specified. [default: %(default)s]')
+RUN_PARSER.add_argument('--samples', dest='samples', default=None, help='Tab-delimited samples manifest, one sample per line with the sample name, the sample bam file and, optionally, the normal bam file. The reference data of the targets is set once and the outputs of each sample are written to <analysis_dir>/samples/<sample>/output. [default: %(default)s]')
+RUN_PARSER.add_argument('--shard', dest='shard', default=None, help='Analyze only shard i of N of the targets, formatted as i/N. The shard outputs are written to <analysis_dir>/shards/shard_<i>_of_<N> and combined with the merge function. [default: %(default)s]')
 RUN_PARSER.add_argument('-c', '--config', dest='config_fn', default=None, required=True, help='The configuration filename that contains additional parameters. [default: %(default)s]')
 
 SERVER_PARSER.add_argument('-p', '--port_number', dest='blat_port', default=None, type=int, help='The port number for the blat server. A random port number (8000-9500) will be used if not specified. [default: %(default)s]')
@@ -67,5 +59,24 @@ REF_PARSER.add_argument('-g', '--gene_list', dest='gene_list', default=None, hel
 REF_PARSER.add_argument('-c', '--config', dest='config_fn', default=None, required=True, help='The configuration filename that contains additional parameters. [default: %(default)s]')
 REF_PARSER.add_argument('-n', '--nprocessors', dest='nprocs', default=1, type=int, help='The number of processors to use for analysis. [default: %(default)s]')
 
-RUN_TRACKER = breakmer_analysis.RunTracker(params.ParamManager(PARSER.parse_args()))
-RUN_TRACKER.run()
+PON_PARSER.add_argument('-g', '--gene_list', dest='gene_list', default=None, help='Gene list to consider for analysis. [default: %(default)s]')
+PON_PARSER.add_argument('-c', '--config', dest='config_fn', default=None, required=True, help='The configuration filename that contains additional parameters. [default: %(default)s]')
+PON_PARSER.add_argument('-n', '--nprocessors', dest='nprocs', default=1, type=int, help='The number of processors to use for analysis. [default: %(default)s]')
+PON_PARSER.add_argument('-b', '--bam_list', dest='pon_bam_list', default=None, help='File listing the normal sample bam files, one path per line. [default: %(default)s]')
+PON_PARSER.add_argument('--pon_min_samples', dest='pon_min_samples', default=None, type=int, help='The minimum number of samples containing a kmer to store it in the panel of normals. 2 is used if not specified. [default: %(default)s]')
+
+MERGE_PARSER.add_argument('-g', '--gene_list', dest='gene_list', default=None, help='Gene list the shards were run with. [default: %(default)s]')
+MERGE_PARSER.add_argument('--no_output_header', dest='no_output_header', default=False, action='store_true', help='Suppress output headers. [default: %(default)s]')
+MERGE_PARSER.add_argument('-c', '--config', dest='config_fn', default=None, required=True, help='The configuration filename that contains additional parameters. [default: %(default)s]')
+
+SERVE_PARSER.add_argument('--socket', dest='serve_socket', default=None, help='UNIX socket path to accept sample jobs on. [default: %(default)s]')
+SERVE_PARSER.add_argument('--spool_dir', dest='spool_dir', default=None, help='Directory polled for sample job files, <job name>.json. [default: %(default)s]')
+SERVE_PARSER.add_argument('--poll_interval', dest='poll_interval', default=5, type=float, help='Seconds between the checks of the spool directory for new jobs. [default: %(default)s]')
+SERVE_PARSER.add_argument('-c', '--config', dest='config_fn', default=None, required=True, help='The configuration filename that contains additional parameters. [default: %(default)s]')
+
+PARAMS = params.ParamManager(PARSER.parse_args())
+if PARAMS.fncCmd == 'serve':
+    sample_server.SampleServer(PARAMS).serve()
+else:
+    RUN_TRACKER = breakmer_analysis.RunTracker(PARAMS)
+    RUN_TRACKER.run()
@@ -0,0 +1,188 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""api.py module
+
+This module runs the analysis of a single target from another program, without the
+breakmer.py script, and returns the calls in memory:
+
+    import breakmer.api as api
+    params = api.load_params('breakmer.cfg', blat_port=8000)
+    result = api.analyze_target(params, 'KMT2A', '/data/S1.bam')
+    for svEvent in result.svEvents:
+        print svEvent.get_formatted_output_values()[1]
+
+The target is the name of a target of the targets bed file, or a list of intervals
+(chrom, start, end, name[, feature]) for a target that is not in the bed file. The sample
+is a bam file path or an open pysam bam file object, and the reads of the target region can
+be passed as an iterable of pysam reads instead of being fetched from the bam file, the
+bam file object then only provides the header.
+
+The reference data of the targets of the targets bed file is written to and read from the
+reference data directory as with the run function. The reference data of a target given as
+intervals is written to the directory of the analysis, in a ref_data/<hash> directory keyed
+by the intervals, and never to the shared reference data directory, where a target with the
+same name and other coordinates would be reused. The extracted reads, contigs and alignments
+of the analysis are written to a temporary directory that is removed once the results are
+returned, unless a work directory is set. The insert size threshold and read
+length of a sample bam file are estimated once per file unless they are set in the overrides.
+
+The module does not set up the logging, the messages are logged with the loggers named
+breakmer.<module> of the calling program logging configuration.
+"""
+
+import os
+import copy
+import hashlib
+import shutil
+import tempfile
+import breakmer.params as params
+import breakmer.processor.target as target
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+INSERT_SIZES = {}  # Insert size thresholds and read lengths of the sample bam files, keyed by (path, modification time).
+
+
+class TargetResult(object):
+    """Results of the analysis of a target.
+
+    Attributes:
+        name (str):                 Target name.
+        svEvents (list):            SVEvent objects of the contig-based calls, including the calls flagged
+                                    by the filters (see SVEvent.is_filtered()).
+        discReadClusters (list):    Tuples of the header and output line of the discordant read clusters
+                                    with at least discread_only_thresh read pairs.
+        contigs (int):              Number of contigs assembled.
+        stats (list):               Stage timing, resource use and count records of the analysis.
+        renderJobs (list):          Pileup image jobs of the calls if generate_image is set, only valid
+                                    if the analysis was run with a work directory.
+    """
+
+    def __init__(self, targetRegion):
+        self.name = targetRegion.name
+        self.svEvents = list(targetRegion.variation.results)
+        self.discReadClusters = list(targetRegion.variation.discReadFormatted)
+        self.contigs = len(targetRegion.variation.kmers.get('clusters', []))
+        self.stats = targetRegion.get_stage_records()
+        self.renderJobs = list(targetRegion.renderJobs)
+
+    def get_formatted_output(self):
+        """Return the (header, output line) tuples of the contig-based calls and the discordant
+        read clusters, as written to the run output files."""
+
+        return {'contigs': [svEvent.get_formatted_output_values() for svEvent in self.svEvents], 'discreads': list(self.discReadClusters)}
+
+
+def load_params(configFn, **options):
+    """Return the parameters for the target analyses, from a configuration file and the
+    analysis options of the run function.
+
+    The blat server set with the blat_port and blat_hostname options is checked, or
+    started if it is not running, and it is stopped by params.stop_blat_server() unless
+    keep_blat_server is set. The analysis_dir option sets the directory of the blat server
+    log and test files, a temporary directory is created if it is not set and removed by
+    params.stop_blat_server().
+
+    Args:
+        configFn (str):     Path to the configuration file.
+        options:            Analysis options, keyed by the parameter names (i.e. indel_sr_thresh=3, blat_port=8000).
+    Returns:
+        paramManager (ParamManager):    Parameters of the analyses.
+    """
+
+    arguments = params.ANALYSIS_PARSER.parse_args([])
+    arguments.fncCmd = 'api'
+    arguments.config_fn = configFn
+    arguments.analysis_dir = options.pop('analysis_dir', None)
+    arguments.remove_analysis_dir = arguments.analysis_dir is None
+    if arguments.remove_analysis_dir:
+        arguments.analysis_dir = tempfile.mkdtemp(prefix='breakmer_api_')
+    for key, value in options.items():
+        setattr(arguments, key, value)
+    paramManager = params.ParamManager(arguments)
+    paramManager.start_blat_server()
+    return paramManager
+
+
+def get_insert_size(paramManager, bamFn):
+    """Return the insert size threshold and read length of a sample bam file, estimated
+    from its properly mapped read pairs the first time the file is analyzed.
+
+    Args:
+        paramManager (ParamManager):    Parameters of the analyses.
+        bamFn (str):                    Path to the sample bam file.
+    Returns:
+        Dictionary with the insertsize_thresh and readLen values.
+    """
+
+    key = (bamFn, os.path.getmtime(bamFn))
+    if key not in INSERT_SIZES:
+        sampleParams = copy.copy(paramManager)
+        sampleParams.opts = dict(paramManager.opts)
+        sampleParams.set_param('sample_bam_file', bamFn)
+        sampleParams.set_insertsize_thresh()
+        INSERT_SIZES[key] = {'insertsize_thresh': sampleParams.get_param('insertsize_thresh'), 'readLen': sampleParams.get_param('readLen')}
+    return INSERT_SIZES[key]
+
+
+def analyze_target(paramManager, targetDef, bam, reads=None, overrides=None, workDir=None):
+    """Analyze a target in a sample and return the calls.
+
+    Args:
+        paramManager (ParamManager):    Parameters from load_params().
+        targetDef (str/list):           Target name in the targets bed file, or list of the target intervals
+                                        (chrom, start, end, name[, feature]).
+        bam (str/AlignmentFile):        Sample bam file path or open pysam bam file object, left open.
+        reads (iterable):               Reads of the target region to use instead of fetching them from the bam file.
+        overrides (dict):               Parameters set for this analysis, i.e. normal_bam_file, insertsize_thresh
+                                        and readLen, required if the bam file object has no file name.
+        workDir (str):                  Directory to keep the analysis files in, a temporary directory is used
+                                        and removed if it is not set.
+    Returns:
+        result (TargetResult):  Calls of the target.
+    Raises:
+        ValueError if the target is not in the targets or the insert size threshold cannot be estimated.
+    """
+
+    overrides = dict(overrides or {})
+    if isinstance(targetDef, basestring):
+        targetName = targetDef.upper()
+        if targetName not in paramManager.targets:
+            raise ValueError('Target %s is not in the targets.' % targetDef)
+        intervals = None
+    else:
+        intervals = [tuple(interval) + (None,) * (5 - len(interval)) for interval in targetDef]
+        targetName = intervals[0][3].upper()
+
+    bamFn = bam if isinstance(bam, basestring) else getattr(bam, 'filename', None)
+    if 'insertsize_thresh' not in overrides or 'readLen' not in overrides:
+        if not bamFn or not os.path.isfile(bamFn):
+            raise ValueError('The insertsize_thresh and readLen overrides must be set for a bam file object without a file name.')
+        insertSize = get_insert_size(paramManager, os.path.abspath(bamFn))
+        for key in insertSize:
+            overrides.setdefault(key, insertSize[key])
+
+    analysisDir = workDir or tempfile.mkdtemp(prefix='breakmer_%s_' % targetName)
+    try:
+        sampleParams = paramManager.get_sample_params(targetName, bamFn, analysisDir, overrides)
+        if intervals is not None:
+            sampleParams.targets = dict(paramManager.targets)
+            sampleParams.targets[targetName] = intervals
+            intervalsKey = hashlib.sha1(repr(sorted([tuple(interval[:3]) for interval in intervals]))).hexdigest()
+            sampleParams.paths['ref_data'] = os.path.join(analysisDir, 'ref_data', intervalsKey)
+        targetRegion = target.TargetManager(targetName, sampleParams)
+        targetRegion.set_ref_data()
+        if sampleParams.get_param('normal_bam_file'):
+            targetRegion.start_normal_task(True)
+        targetRegion.extract_bam_reads('sv', bam, reads)
+        if targetRegion.clean_sv_reads():
+            targetRegion.compare_kmers()
+            targetRegion.resolve_sv()
+        return TargetResult(targetRegion)
+    finally:
+        if workDir is None:
+            shutil.rmtree(analysisDir, ignore_errors=True)
@@ -2,10 +2,10 @@
 # -*- coding: utf-8 -*-
 
 import re
-import logging
 from collections import OrderedDict
 import breakmer.assembly.contig as contig_assembler
 import breakmer.assembly.utils as assemblyUtils
+import breakmer.utils as utils
 
 __author__ = "Ryan Abo"
 __copyright__ = "Copyright 2015, Ryan Abo"
@@ -27,12 +27,12 @@ def init_assembly(kmers, fqRecs, kmerLen, rcThresh, readLen):
     Return:
         contigs: List of contig objects.
     """
-    logger = logging.getLogger('breakmer.assembly.assembler')
+    loggingName = 'breakmer.assembly.assembler'
     contigs = []
 
     # Return if no kmers to analyze.
     if len(kmers) == 0:
-        logger.info('No kmers to built contigs, returning.')
+        utils.log(loggingName, 'info', 'No kmers to built contigs, returning.')
         return contigs
 
     # Store kmers in KmerTracker object.
@@ -53,7 +53,7 @@ def init_assembly(kmers, fqRecs, kmerLen, rcThresh, readLen):
         # Only analyze contigs that exist in 2 or more reads.
         if kmer_count < 2:
             continue
-        logger.info('Initiating kmer %s, found in %d reads' % (kmer, kmer_count))
+        utils.log(loggingName, 'info', 'Initiating kmer %s, found in %d reads', kmer, kmer_count)
         setup_contigs(kmer, fqRecs, kmerLen, kmerTracker, contigBuffer)
 
         # Deal with buffered contig objects that need to be grown or completed.
@@ -61,9 +61,9 @@ def init_assembly(kmers, fqRecs, kmerLen, rcThresh, readLen):
             contig = contigBuffer.get_contig()
             contig.grow(fqRecs, kmerTracker, kmerLen, contigBuffer)
             if contig.check_invalid(rcThresh, readLen):
-                logger.info('Contig did not meet the read count threshold %d, with %d or contig length (%d) < readLen (%d)' % (rcThresh, len(contig.reads), len(contig.seq), readLen))
+                utils.log(loggingName, 'info', 'Contig did not meet the read count threshold %d, with %d or contig length (%d) < readLen (%d)', rcThresh, len(contig.reads), len(contig.seq), readLen)
             else:
-                logger.info('Adding contig to buffer')
+                utils.log(loggingName, 'info', 'Adding contig to buffer')
                 contigs.append(contig)
 
         # Clean up the data to free up memory.
@@ -84,7 +84,6 @@ def setup_contigs(kmerSeq, fqRecs, kmerLen, kmerTracker, contigBuffer):
         contigBuffer:   ContigBuffer object to track the buffered contig objects.
     Return: None
     """
-    logger = logging.getLogger('breakmer.assembly.assembler')
     contig = None
     # Find all reads with kmer sequence passed in.
     # kmerReads contains a list of tuples.
@@ -6,6 +6,7 @@ import sys
 import logging
 import shutil
 import pysam
+import numpy as np
 import breakmer.assembly.olc as olcAssembly
 import breakmer.assembly.utils as assemblyUtils
 import breakmer.realignment.realigner as realigner
@@ -139,18 +140,35 @@ class ReadBatch:
 class ContigCounts:
     """A class to track the number of read sequences that support a consensus sequence.
 
+    The count vectors are stored in a single int32 buffer with spare capacity on both
+    ends, so extending the contig sequence in either direction and adding read counts
+    are in-place slice operations. The buffer is reallocated with doubled capacity
+    when an extension does not fit.
+
     Initially set counts for the first read in the contig.
     Attributes:
-        indel_only: List of integers, providing the count for number of indel only reads support
-                    the given position in the consensus sequence.
-        others: List of integers, providing the count of non indel only reads that are assembled
-                at a given position of the consensus sequence.
+        buf:    2 x capacity numpy array, row 0 holds the indel only counts and row 1 holds
+                the counts for all other reads.
+        start:  Integer index of the first contig position in the buffer.
+        end:    Integer index after the last contig position in the buffer.
     """
 
     def __init__(self, read, nreads):
-        self.indel_only = [0] * len(read.seq)
-        self.others = [0] * len(read.seq)
-        self.set_counts(0, len(read.seq), nreads, read.indel_only)
+        seqLen = len(read.seq)
+        self.buf = np.zeros((2, 3 * seqLen), dtype=np.int32)
+        self.start = seqLen
+        self.end = 2 * seqLen
+        self.set_counts(0, seqLen, nreads, read.indel_only)
+
+    @property
+    def indel_only(self):
+        """Array view of the counts of indel only reads supporting each position of the consensus sequence."""
+        return self.buf[0, self.start:self.end]
+
+    @property
+    def others(self):
+        """Array view of the counts of non indel only reads supporting each position of the consensus sequence."""
+        return self.buf[1, self.start:self.end]
 
     def get_counts(self, p1, p2, sv_type):
         """Return the counts for a range of positions in the consensus sequence.
@@ -160,31 +178,48 @@ class ContigCounts:
             p2: Integer indicating the second position.
             sv_type: String indicating what kind of event the count is intended to support.
         Return:
-            counts: List of integers for counts of reads assembled at the provided range.
+            counts: Integer count if p1 == p2, otherwise an array of counts of reads assembled at the provided range.
         """
-        counts = []
         if sv_type == 'indel' or sv_type == 'rearr':
             if p1 == p2:
-                counts = self.indel_only[p1] + self.others[p1]
+                counts = int(self.indel_only[p1] + self.others[p1])
             else:
-                counts = map(lambda (x, y): x + y, zip(self.indel_only[p1:p2], self.others[p1:p2]))
+                counts = self.indel_only[p1:p2] + self.others[p1:p2]
         else:
             if p1 == p2:
-                counts = self.others[p1]
+                counts = int(self.others[p1])
             else:
-                counts = self.others[p1:p2]
+                counts = self.others[p1:p2].copy()
         return counts
 
     def get_total_reads(self):
         """Return the total read count supporting a contig sequence."""
-        return max(self.indel_only) + max(self.others)
+        return int(self.indel_only.max() + self.others.max())
+
+    def reserve(self, size, direction):
+        """Make sure there is room in the buffer to extend the count vectors by size positions.
+        The buffer is reallocated with double the needed capacity, with the contig counts
+        centered in the new buffer, when there is not enough room.
+        Args:
+            size: Integer for number of positions needed.
+            direction: String to indicate which side the count vectors are extended, 'pre' or 'post'.
+        Return: None
+        """
+        if (direction == 'pre' and self.start >= size) or (direction == 'post' and (self.buf.shape[1] - self.end) >= size):
+            return
+        seqLen = self.end - self.start
+        pad = max(seqLen, size) * 2
+        newBuf = np.zeros((2, seqLen + 2 * pad), dtype=np.int32)
+        newBuf[:, pad:pad + seqLen] = self.buf[:, self.start:self.end]
+        self.buf = newBuf
+        self.start = pad
+        self.end = pad + seqLen
 
     def set_superseq(self, read, nreads, start, end):
         """The read sequence is a super sequence to the current contig sequence.
         The count vectors need to be adjusted accordingly based on the read.
-        Temporary count vectors are created for the read sequence and the number
-        of reads with this sequence. The current count vectors are then added into
-        the temporary vectors and then set as the new count vectors.
+        The count vectors are extended on both sides to the length of the read
+        and the read count is added across the whole read sequence.
         Args:
             read: fq_read object.
             nreads: Integer for number of reads with read sequence.
@@ -194,16 +229,12 @@ class ContigCounts:
                  the read sequence.
         Return: None
         """
-        tmp_indel_only = [0] * len(read.seq)
-        tmp_others = [0] * len(read.seq)
-        if read.indel_only:
-            tmp_indel_only = [nreads] * len(read.seq)
-        else:
-            tmp_others = [nreads] * len(read.seq)
-        tmp_indel_only[start:end] = map(lambda (x, y): x + y, zip(tmp_indel_only[start:end], self.indel_only))
-        tmp_others[start:end] = map(lambda (x, y): x + y, zip(tmp_others[start:end], self.others))
-        self.indel_only = tmp_indel_only
-        self.others = tmp_others
+        postSize = len(read.seq) - start - (self.end - self.start)
+        self.reserve(start, 'pre')
+        self.reserve(postSize, 'post')
+        self.start -= start
+        self.end += postSize
+        self.set_counts(0, len(read.seq), nreads, read.indel_only)
 
     def set_counts(self, start, end, nreads, indel_only):
         """Add the read count to the stored contig sequence count vectors.
@@ -218,14 +249,15 @@ class ContigCounts:
         Return: None
         """
         if indel_only:
-            self.indel_only[start:end] = map(lambda x: x + nreads, self.indel_only[start:end])
+            self.indel_only[start:end] += nreads
         else:
-            self.others[start:end] = map(lambda x: x + nreads, self.others[start:end])
+            self.others[start:end] += nreads
 
     def extend_counts(self, extend_size, nreads, indel_only, direction):
         """Increase the size of the count vectors when the contig sequence is grown.
         If the direction is 'post', the count vectors must be increased at the end.
         If the direction is 'pre', the count vectors must be increased at the beginning.
+        The new positions are always zero in the spare buffer capacity.
         Args:
             extend_size: Integer for number of positions to increase the vectors.
             nreads: Integer for count to add to the count vectors.
@@ -233,26 +265,13 @@ class ContigCounts:
             direction: String to indicate which side the count vector is extended.
         Return: None
         """
-        fill_counts = [0] * extend_size
-        ecounts = [nreads] * extend_size
-        if indel_only:
-            if direction == 'post':
-                self.indel_only.extend(ecounts)
-                self.others.extend(fill_counts)
-            else:
-                ecounts.extend(self.indel_only)
-                self.indel_only = ecounts
-                fill_counts.extend(self.others)
-                self.others = fill_counts
+        self.reserve(extend_size, direction)
+        if direction == 'post':
+            self.end += extend_size
+            self.set_counts(self.end - self.start - extend_size, self.end - self.start, nreads, indel_only)
         else:
-            if direction == 'post':
-                self.indel_only.extend(fill_counts)
-                self.others.extend(ecounts)
-            else:
-                ecounts.extend(self.others)
-                self.others = ecounts
-                fill_counts.extend(self.indel_only)
-                self.indel_only = fill_counts
+            self.start -= extend_size
+            self.set_counts(0, extend_size, nreads, indel_only)
 
 
 class Builder:
@@ -261,10 +280,15 @@ class Builder:
         read_batch:     ReadBatch object
         seq:            String of the consensus sequence.
         counts:         ContigCounts object to manage all the read counts supporting the consensus sequence.
-        checked_kmers:  List of kmer sequences that had previously been checked while building the contig.
+        checked_kmers:  Set of kmer sequences that had previously been checked while building the contig.
         kmerLen:        Integer of the kmer length.
-        kmers:          List of kmer sequences that have contributed to building the contig.
+        kmers:          List of kmer tuples that have contributed to building the contig. The kmer positions
+                        are stored relative to the first base of the initial contig sequence.
         kmer_locs:      List of integers representing the positions of the kmers in the contig seq.
+        offset:         Integer number of bases added to the front of the initial contig sequence.
+        kmerIdx:        Integer index into kmers, the kmers before it have been returned by refresh_kmers.
+        readPos:        Dictionary with the sequences of the reads added to the contig as keys and their start
+                        positions relative to the first base of the initial contig sequence as values.
     """
 
     def __init__(self, kmerObj, readAlignValues):
@@ -276,10 +300,13 @@ class Builder:
         self.read_batch = ReadBatch(readAlignValues['read'], readAlignValues['align_pos'])
         self.seq = readAlignValues['read'].seq
         self.counts = ContigCounts(readAlignValues['read'], readAlignValues['nreads'])
-        self.checked_kmers = [kmerObj.seq]
+        self.checked_kmers = set([kmerObj.seq])
         self.kmerLen = kmerObj.kmerLen
         self.kmers = []
         self.kmer_locs = []
+        self.offset = 0
+        self.kmerIdx = 0
+        self.readPos = {readAlignValues['read'].seq: 0}
 
     def check_read(self, kmerObj, readAlignValues, alignType):
         """Determine if the read should be added to the assembly or not.
@@ -342,19 +369,19 @@ class Builder:
             return False
         if alignManager.same_seqs():
             # Read and contigs sequences are the same.
+            self.set_read_pos(queryRead, 0)
             return True
         if alignManager.same_max_scores():
             # Alignments both ways had equal scores.
             match = True
             if alignManager.read_is_superseq():
                 # Check if the read sequence fully contains the contig sequence.
-                self.set_superseq(queryRead, readAlignValues['nreads'], alignManager.get_alignment_values(0, 'i'), alignManager.get_alignment_values(0, 'prei'))
-                if alignType == 'grow':
-                    # Contig sequence has changed, set the kmers.
-                    self.set_kmers(kmerObj.kmerSeqSet)
+                # Contig sequence has changed, add the new kmers when growing.
+                self.set_superseq(queryRead, readAlignValues['nreads'], alignManager.get_alignment_values(0, 'i'), alignManager.get_alignment_values(0, 'prei'), kmerObj.kmerSeqSet if alignType == 'grow' else None)
             # Check if the contig sequence full contains the read sequence.
             elif alignManager.read_is_subseq():
                 self.add_subseq(alignManager.get_alignment_values(1, 'i'), alignManager.get_alignment_values(1, 'prei'), readAlignValues['nreads'], queryRead.indel_only)
+                self.set_read_pos(queryRead, alignManager.get_alignment(1).i - alignManager.get_alignment(1).j)
             # There appears to be overlap, figure out how to assemble.
             else:
                 match = False
@@ -380,17 +407,33 @@ class Builder:
             self.read_overlap_contig(alignManager.get_alignment(1), queryRead, readAlignValues['nreads'], kmerObj.kmerSeqSet, alignType)
         return match
 
-    def set_superseq(self, read, nreads, start, end):
+    def set_superseq(self, read, nreads, start, end, kmer_seqs=None):
         """The read sequence contains the current contig sequence.
+        If kmer_seqs is passed, the kmers are updated for the new contig sequence. When
+        the contig sequence is unchanged within the read, only the kmers in the sequence
+        flanking it are added, otherwise all the kmers are reset.
         Args:
             read: fq_read object.
             nreads: Integer for the number of reads with the same sequence as the read passed in.
             start: Integer for the start position the contig sequence aligns to the read sequence.
             end: Integer for the end position the contig sequence aligns to the read sequence.
+            kmer_seqs: Set of kmer sequence values or None to leave the kmers unchanged.
         Return: None
         """
+        old_seq = self.seq
         self.seq = read.seq
         self.counts.set_superseq(read, nreads, start, end)
+        self.offset += start
+        self.set_read_pos(read, 0)
+        if kmer_seqs is None:
+            return
+        if self.seq[start:end] != old_seq:
+            self.set_kmers(kmer_seqs)
+            return
+        if start > 0:
+            self.add_kmers(0, start + self.kmerLen, kmer_seqs, 'rev')
+        if end < len(self.seq):
+            self.add_kmers(end - (self.kmerLen - 1), len(self.seq), kmer_seqs, 'for')
 
     def add_subseq(self, start, end, nreads, indel_only):
         """The read checked against the contig was found to be a subsequence of the
@@ -431,9 +474,23 @@ class Builder:
         Return: None
         """
         self.seq = pre_seq + self.seq
+        self.offset += len(pre_seq)
         self.counts.set_counts(start, end, nreads, indel_only)
         self.counts.extend_counts(len(pre_seq), nreads, indel_only, 'pre')
 
+    def set_read_pos(self, read, pos):
+        """Store the start position of a read in the current contig sequence.
+        Args:
+            read: fq_read object.
+            pos: Integer of the read start position in the contig sequence.
+        Return: None
+        """
+        self.readPos[read.seq] = pos - self.offset
+
+    def get_read_offsets(self):
+        """Return a dictionary with the read sequences as keys and their start positions in the contig sequence."""
+        return dict([(seq, pos + self.offset) for seq, pos in self.readPos.items()])
+
     def finalize_reads(self, contig_reads, fq_recs, contigBuffer):
         """Sort out the reads to keep for reporting and remove the others.
         Aligned and non-redundant reads are removed from the contig read set. The
@@ -467,16 +524,14 @@ class Builder:
         Return: None
         """
         if alignment.prej == len(self.seq) and alignment.j == 0:
-            self.set_superseq(query_read, nreads, alignment.i, alignment.prei)
-            if assemblyType == 'grow':
-                self.set_kmers(kmer_seqs)
+            self.set_superseq(query_read, nreads, alignment.i, alignment.prei, kmer_seqs if assemblyType == 'grow' else None)
         else:
             post_seq = query_read.seq[alignment.prei:]
-            nseq = self.seq[(len(self.seq) - (self.kmerLen - 1)):] + post_seq
+            nseq_start = max(0, len(self.seq) - (self.kmerLen - 1))
             self.add_postseq(post_seq, alignment.j, alignment.prej, nreads, query_read.indel_only)
+            self.set_read_pos(query_read, alignment.j - alignment.i)
             if assemblyType == 'grow':
-                nkmers = get_read_kmers(nseq, self.kmerLen, kmer_seqs, 'for')
-                self.kmers.extend(nkmers)
+                self.add_kmers(nseq_start, len(self.seq), kmer_seqs, 'for')
 
     def read_overlap_contig(self, alignment, query_read, nreads, kmer_seqs, type):
         """Assemble consensus and read sequences togheter, where the consensus
@@ -492,13 +547,13 @@ class Builder:
 
         if alignment.prej == len(query_read.seq) and alignment.j == 0:
             self.add_subseq(alignment.i, alignment.prei, nreads, query_read.indel_only)
+            self.set_read_pos(query_read, alignment.i - alignment.j)
         else:
             pre_seq = query_read.seq[0:alignment.j]
-            nseq = pre_seq + self.seq[0:(self.kmerLen - 1)]
-            self.add_preseq(query_read.seq[0:alignment.j], alignment.i, alignment.prei, nreads, query_read.indel_only)
+            self.add_preseq(pre_seq, alignment.i, alignment.prei, nreads, query_read.indel_only)
+            self.set_read_pos(query_read, 0)
             if type == 'grow':
-                nkmers = get_read_kmers(nseq, self.kmerLen, kmer_seqs, 'rev')
-                self.kmers.extend(nkmers)
+                self.add_kmers(0, len(pre_seq) + (self.kmerLen - 1), kmer_seqs, 'rev')
 
     def check_alternate_reads(self, kmerTracker, contigBuffer, contigKmers):
         """Iterate through the buffered reads that were not aligned to the contig
@@ -535,33 +590,55 @@ class Builder:
             kmer_seqs: Set of kmer sequences.
         Return: None
         """
-        self.kmers = get_read_kmers(str(self.seq), self.kmerLen, kmer_seqs, 'mid')
+        self.kmers = [(x[0], x[1] - self.offset) + x[2:] for x in get_read_kmers(str(self.seq), self.kmerLen, kmer_seqs, 'mid')]
+        self.kmerIdx = 0
+
+    def add_kmers(self, start, end, kmer_seqs, order):
+        """Add the sample kmers from a segment of the contig sequence that was created
+        by extending the contig. Only the kmers in the segment are generated and the
+        positions are shifted to be relative to the initial contig sequence.
+        Args:
+            start: Integer for the start position of the segment in the contig sequence.
+            end: Integer for the end position of the segment in the contig sequence.
+            kmer_seqs: Set of kmer sequences.
+            order: String for the direction to order the new kmers.
+        Return: None
+        """
+        nkmers = get_read_kmers(self.seq[start:end], self.kmerLen, kmer_seqs, order)
+        self.kmers.extend([(x[0], x[1] + start - self.offset) + x[2:] for x in nkmers])
 
     def set_kmer_locs(self):
-        """Add the start alignment positions of each kmer sequence in the kmers list
-        to the kmer_locs list.
+        """Count the number of kmers in the kmers list covering each position in the
+        contig sequence and set the kmer_locs list.
         Args: None
         Return: None
         """
-        self.kmer_locs = [0] * len(self.seq)
-        for kmer in self.kmers:
-            kmerPos = self.seq.find(kmer[0])
-            self.kmer_locs[kmerPos:(kmerPos + self.kmerLen)] = map(lambda x: x + 1, self.kmer_locs[kmerPos:(kmerPos + self.kmerLen)])
+        seqLen = len(self.seq)
+        if len(self.kmers) == 0:
+            self.kmer_locs = [0] * seqLen
+            return
+        kmerPos = np.array([x[1] for x in self.kmers], dtype=np.int64) + self.offset
+        coverage = np.bincount(kmerPos, minlength=seqLen + 1) - np.bincount(kmerPos + self.kmerLen, minlength=seqLen + 1)
+        self.kmer_locs = np.cumsum(coverage[0:seqLen]).tolist()
 
     def refresh_kmers(self):
         """Return a list of kmer_sequences that have not been checked already.
+        Only the kmers added since the last call need to be checked, the kmers
+        returned previously are checked before the next call.
         Args: None
         Return:
             List of kmer sequences.
         """
-        return filter(lambda x: x[0] not in set(self.checked_kmers), self.kmers)
+        newKmers = [x for x in self.kmers[self.kmerIdx:] if x[0] not in self.checked_kmers]
+        self.kmerIdx = len(self.kmers)
+        return newKmers
 
     def get_seq(self):
         """Return the final consensus sequence."""
         return self.seq
 
     def get_kmers(self):
-        """Return the final kmer sequence list."""
+        """Return the final kmer list, the positions are relative to the initial contig sequence."""
         return self.kmers
 
     def get_kmer_locs(self):
@@ -705,6 +782,8 @@ class Contig:
         kmers:      List of kmer sequences used to build contig.
         reads:      Set of read IDs that have been used to build contig.
         buffer:     Set of read IDs used in a batch of processing for building a contig. This is flushed.
+        readOffsets: Dictionary of the read sequences used to build the contig and their start positions
+                     in the contig sequence.
     """
 
     def __init__(self, kmerObj, readAlignValues):
@@ -715,6 +794,7 @@ class Contig:
         self.kmers = []
         self.kmer_locs = []
         self.reads = set()
+        self.readOffsets = {}
         self.buffer = set([readAlignValues['read'].id])
         self.svEventResult = None
         self.realignment = None
@@ -836,7 +916,7 @@ class Contig:
             contigBuffer:   ContigBuffer object.
         Return: None
         """
-        logger = logging.getLogger('breakmer.assembly.contig')
+        loggingName = 'breakmer.assembly.contig'
         if not self.setup:
             self.set_kmers(kmerTracker.kmerSeqs)
         newKmers = self.refresh_kmers()
@@ -857,14 +937,15 @@ class Contig:
                     if hit == 'remove':
                         contigBuffer.remove_contig(read.id)
                 self.finalize(fqRecs, kmerTracker, contigBuffer, 'grow')
-                self.builder.checked_kmers.append(kmerSeq)
+                self.builder.checked_kmers.add(kmerSeq)
                 iter += 1
             newKmers = self.refresh_kmers()
-            logger.debug("%d kmers left to check" % len(newKmers))
+            utils.log(loggingName, 'debug', '%d kmers left to check', len(newKmers))
         self.set_kmer_locs()
         self.set_final_values()
-        logger.info('Contig done with contig seq %s. Supported by %d read(s).' % (self.seq, len(self.reads)))
-        logger.info('Read IDs: %s' % (",".join([x.id for x in list(self.reads)])))
+        utils.log(loggingName, 'info', 'Contig done with contig seq %s. Supported by %d read(s).', self.seq, len(self.reads))
+        if utils.log_enabled(loggingName, 'debug'):
+            utils.log(loggingName, 'debug', 'Read IDs: %s', ",".join([x.id for x in list(self.reads)]))
 
     def set_meta_information(self, contig_id, params, query_region_values, contig_path, kmer_cluster_fn, readVariation):
         """Sets the contig ID, params, target region values and contig path variables for later use.
@@ -888,6 +969,7 @@ class Contig:
         self.seq = self.builder.get_seq()
         self.kmers = self.builder.get_kmers()
         self.kmer_locs = self.builder.get_kmer_locs()
+        self.readOffsets = self.builder.get_read_offsets()
 
     def query_ref(self, targetRefFns):
         """
@@ -916,13 +998,32 @@ class Contig:
             annotator.annotate_event(self.svEventResult, self.meta)
 
     def output_calls(self, outputPath, svReadsBamFn):
-        """ """
+        """Write the result and read bam files for the contig.
+        Args:
+            outputPath: String of the output directory.
+            svReadsBamFn: String of the bam file with the target SV reads.
+        Return:
+            renderJob: sv_viz.RenderJob object to generate the pileup image after the calls are made,
+                       or None if no image is generated.
+        """
+        renderJob = None
         if self.svEventResult:
             self.meta.write_result(self.svEventResult, outputPath)
             readBamFn = self.meta.write_bam(outputPath, svReadsBamFn, self.reads)
             if self.meta.params.get_param('generate_image') and not self.svEventResult.is_filtered():
                 # Generate image if option is set and the result is not being filtered out.
-                svplotter.generate_pileup_img(self.svEventResult, readBamFn, outputPath, self.get_id())
+                renderJob = svplotter.RenderJob(self.svEventResult, readBamFn, outputPath, self.get_id(), self.get_read_positions(), int(self.meta.params.get_param('image_read_sample') or 50))
+        return renderJob
+
+    def get_read_positions(self):
+        """Return a dictionary with the read names (<qname>/<1 or 2>) of the contig reads as keys and
+        tuples of the read start position in the contig sequence and the read sequence as values.
+        """
+        readPositions = {}
+        for read in self.reads:
+            if read.seq in self.readOffsets:
+                readPositions[read.id.lstrip('@').rsplit('_', 1)[0]] = (self.readOffsets[read.seq], read.seq)
+        return readPositions
 
     def get_total_read_support(self):
         """Return the total read count supporting assembly."""
@@ -0,0 +1,257 @@
+#! /usr/bin/local/python
+# -*- coding: utf-8 -*-
+
+import breakmer.assembly.contig as contig_assembler
+import breakmer.assembly.utils as assemblyUtils
+import breakmer.utils as utils
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+
+def init_assembly(kmers, fqRecs, kmerLen, rcThresh, readLen, minCount=2, maxCoverageRatio=4.0):
+    """Entry function for assemblying contig sequences from a compacted de Bruijn
+    graph, an alternative to the greedy overlap assembly in assembler.init_assembly.
+    The graph is built from all the kmers of the reads that contain sample only kmers.
+    Contigs are seeded from the most frequent unused sample only kmers and the
+    graph is walked from the seed unitig in both directions. The walk stops at a
+    branch node if the coverage of the next unitig disagrees with the coverage of
+    the current unitig. The reads are then placed on the contig sequences to set the
+    read count vectors.
+    Args:
+        kmers: Dictionary of kmers only in the sample key = kmer, value = count in reads
+        fqRecs: Dictionary with sequence values as keys and a list of fq_read objects.
+        kmerLen: Integer of kmer size.
+        rcThresh: Integer representing the minimum readcount threshold for keeping a contig.
+        readLen: Integer of the read length.
+        minCount: Integer of the minimum number of reads containing a kmer for it to be included in the graph.
+        maxCoverageRatio: Float of the maximum ratio between the mean kmer counts of two unitigs joined
+                          across a branch node.
+    Return:
+        contigs: List of contig objects.
+    """
+    loggingName = 'breakmer.assembly.dbg'
+    contigs = []
+
+    # Low complexity kmers are not used as seeds, as with assembler.KmerTracker.
+    sampleKmers = dict([(mer, int(count)) for mer, count in kmers.items() if len(set(mer)) > 1])
+    if len(sampleKmers) == 0:
+        utils.log(loggingName, 'info', 'No kmers to built contigs, returning.')
+        return contigs
+
+    graph = DeBruijnGraph(kmerLen, minCount, maxCoverageRatio)
+    graph.add_reads(fqRecs, sampleKmers)
+    graph.compact()
+    utils.log(loggingName, 'info', 'De Bruijn graph built with %d kmers and %d unitigs from %d read sequences', len(graph.kmerCounts), len(graph.unitigs), len(graph.readSeqs))
+
+    sampleKmerSet = set(sampleKmers.keys())
+    usedKmers = set()
+    for kmer, kmer_count in sorted(sampleKmers.items(), key=lambda x: (x[1], x[0]), reverse=True):
+        # Only analyze contigs that exist in 2 or more reads.
+        if kmer_count < 2:
+            break
+        if kmer in usedKmers or kmer not in graph.kmerUnitig:
+            continue
+        utils.log(loggingName, 'info', 'Initiating kmer %s, found in %d reads', kmer, kmer_count)
+        seq = graph.walk(graph.kmerUnitig[kmer][0])
+        usedKmers.update(set([seq[i:i + kmerLen] for i in range(len(seq) - kmerLen + 1)]) & sampleKmerSet)
+        contig = build_contig(kmer, kmer_count, seq, graph, sampleKmerSet)
+        if contig.check_invalid(rcThresh, readLen):
+            utils.log(loggingName, 'info', 'Contig did not meet the read count threshold %d, with %d or contig length (%d) < readLen (%d)', rcThresh, len(contig.reads), len(contig.seq), readLen)
+        else:
+            utils.log(loggingName, 'info', 'Contig done with contig seq %s. Supported by %d read(s).', contig.seq, len(contig.reads))
+            contigs.append(contig)
+    return contigs
+
+
+def build_contig(kmerSeq, kmerCount, seq, graph, sampleKmerSet):
+    """Create a Contig object for a sequence assembled from the graph.
+    The contig is started with a read object holding the contig sequence and no
+    read support, and the read count vectors are then incremented with the reads
+    placed on the contig sequence.
+    Args:
+        kmerSeq:        String of the seed kmer sequence.
+        kmerCount:      Integer of the number of reads with the seed kmer.
+        seq:            String of the contig sequence.
+        graph:          DeBruijnGraph object.
+        sampleKmerSet:  Set of sample only kmer sequences.
+    Return:
+        contig: Contig object.
+    """
+    kmerObj = assemblyUtils.Kmer(kmerSeq, kmerCount, sampleKmerSet, graph.kmerLen)
+    pathRead = utils.fq_read('@' + kmerSeq, seq, '', False)
+    contig = contig_assembler.Contig(kmerObj, {'read': pathRead, 'align_pos': seq.find(kmerSeq), 'nreads': 0})
+    for start, end, offset, reads in graph.place_reads(seq):
+        for read in reads:
+            contig.builder.add_subseq(start, end, 1, read.indel_only)
+            contig.builder.set_read_pos(read, offset)
+            read.used = True
+            contig.reads.add(read)
+    contig.set_kmers(sampleKmerSet)
+    contig.set_kmer_locs()
+    contig.set_final_values()
+    return contig
+
+
+class DeBruijnGraph:
+    """A class to build and walk a de Bruijn graph of the reads with sample only kmers.
+    The graph is compacted into unitigs, maximal paths of kmers without branches.
+    Attributes:
+        kmerLen:        Integer of the kmer length.
+        minCount:       Integer of the minimum number of reads containing a kmer for it to be
+                        included in the graph.
+        maxCoverageRatio: Float of the maximum ratio between the mean kmer counts of two unitigs
+                        joined across a branch node in a walk.
+        kmerCounts:     Dictionary of kmer sequence keys and the number of reads containing them.
+        readSeqs:       List of tuples containing the read sequence and the list of fq_read objects with the sequence.
+        unitigs:        List of unitig sequences.
+        unitigCounts:   List of the mean kmer count for each unitig.
+        kmerUnitig:     Dictionary of kmer sequence keys and a tuple with the unitig index and
+                        the kmer position in the unitig as values.
+    """
+    def __init__(self, kmerLen, minCount=2, maxCoverageRatio=4.0):
+        self.kmerLen = kmerLen
+        self.minCount = minCount
+        self.maxCoverageRatio = maxCoverageRatio
+        self.kmerCounts = {}
+        self.readSeqs = []
+        self.unitigs = []
+        self.unitigCounts = []
+        self.kmerUnitig = {}
+
+    def add_reads(self, fqRecs, sampleKmers):
+        """Count the kmers of the reads that contain at least one sample only kmer.
+        Args:
+            fqRecs: Dictionary with sequence values as keys and a list of fq_read objects.
+            sampleKmers: Dictionary of sample only kmers.
+        Return: None
+        """
+        kmerCounts = {}
+        for seq in sorted(fqRecs.keys()):
+            seqKmers = [seq[i:i + self.kmerLen] for i in range(len(seq) - self.kmerLen + 1)]
+            if not any([kmer in sampleKmers for kmer in seqKmers]):
+                continue
+            self.readSeqs.append((seq, fqRecs[seq]))
+            nreads = len(fqRecs[seq])
+            for kmer in set(seqKmers):
+                kmerCounts[kmer] = kmerCounts.get(kmer, 0) + nreads
+        self.kmerCounts = dict([(kmer, count) for kmer, count in kmerCounts.items() if count >= self.minCount])
+
+    def successors(self, kmer):
+        """Return the kmers in the graph that follow a kmer."""
+        return [kmer[1:] + base for base in 'ACGT' if (kmer[1:] + base) in self.kmerCounts]
+
+    def predecessors(self, kmer):
+        """Return the kmers in the graph that precede a kmer."""
+        return [base + kmer[:-1] for base in 'ACGT' if (base + kmer[:-1]) in self.kmerCounts]
+
+    def compact(self):
+        """Merge the non-branching paths of kmers into unitigs.
+        Args: None
+        Return: None
+        """
+        for kmer in sorted(self.kmerCounts.keys()):
+            if kmer in self.kmerUnitig:
+                continue
+            path = [kmer]
+            seen = set(path)
+            # Extend forward while the next kmer is the only successor and has only one predecessor.
+            nextKmers = self.successors(kmer)
+            while len(nextKmers) == 1 and len(self.predecessors(nextKmers[0])) == 1 and nextKmers[0] not in seen:
+                path.append(nextKmers[0])
+                seen.add(nextKmers[0])
+                nextKmers = self.successors(nextKmers[0])
+            # Extend backward.
+            prevKmers = self.predecessors(kmer)
+            while len(prevKmers) == 1 and len(self.successors(prevKmers[0])) == 1 and prevKmers[0] not in seen:
+                path.insert(0, prevKmers[0])
+                seen.add(prevKmers[0])
+                prevKmers = self.predecessors(prevKmers[0])
+            unitigIdx = len(self.unitigs)
+            for i, pathKmer in enumerate(path):
+                self.kmerUnitig[pathKmer] = (unitigIdx, i)
+            self.unitigs.append(path[0] + ''.join([x[-1] for x in path[1:]]))
+            self.unitigCounts.append(float(sum([self.kmerCounts[x] for x in path])) / len(path))
+
+    def next_unitigs(self, unitigIdx, direction):
+        """Return the indices of the unitigs connected to a unitig.
+        Args:
+            unitigIdx: Integer index of the unitig.
+            direction: String 'post' for the following unitigs and 'pre' for the preceding unitigs.
+        Return:
+            List of unitig indices.
+        """
+        unitig = self.unitigs[unitigIdx]
+        if direction == 'post':
+            kmers = self.successors(unitig[-self.kmerLen:])
+        else:
+            kmers = self.predecessors(unitig[0:self.kmerLen])
+        return [self.kmerUnitig[x][0] for x in kmers]
+
+    def coverage_agrees(self, unitigIdx1, unitigIdx2):
+        """Return True if the mean kmer counts of two unitigs are within maxCoverageRatio of each other."""
+        counts = sorted([self.unitigCounts[unitigIdx1], self.unitigCounts[unitigIdx2]])
+        return counts[1] <= self.maxCoverageRatio * counts[0]
+
+    def walk(self, unitigIdx):
+        """Greedily extend a path from a unitig in both directions, choosing the connected
+        unitig with the highest kmer count at each branch. Unitigs are used once in a path.
+        The path is not extended across a branch node into a unitig whose coverage disagrees
+        with the coverage of the last unitig, i.e. a repeat shared with another region or
+        a sequencing error path.
+        Args:
+            unitigIdx: Integer index of the seed unitig.
+        Return:
+            seq: String of the path sequence.
+        """
+        seq = self.unitigs[unitigIdx]
+        visited = set([unitigIdx])
+        for direction in ('post', 'pre'):
+            current = unitigIdx
+            while True:
+                choices = [x for x in self.next_unitigs(current, direction) if x not in visited]
+                if len(choices) == 0:
+                    break
+                nextUnitig = max(choices, key=lambda x: (self.unitigCounts[x], self.unitigs[x]))
+                if not self.coverage_agrees(current, nextUnitig):
+                    utils.log('breakmer.assembly.dbg', 'debug', 'Stopping walk at unitig %d, mean kmer count %f, next unitig %d has mean kmer count %f', current, self.unitigCounts[current], nextUnitig, self.unitigCounts[nextUnitig])
+                    break
+                current = nextUnitig
+                visited.add(current)
+                if direction == 'post':
+                    seq += self.unitigs[current][(self.kmerLen - 1):]
+                else:
+                    seq = self.unitigs[current][:-(self.kmerLen - 1)] + seq
+        return seq
+
+    def place_reads(self, seq):
+        """Determine the positions of the read sequences in a contig sequence.
+        Each read sequence is placed at the offset supported by the most kmers shared
+        with the contig sequence, and kept if at least half of its kmers support it.
+        Args:
+            seq: String of the contig sequence.
+        Return:
+            placed: List of tuples containing the start and end position of the read in
+                    the contig sequence, the offset of the read start (negative if the read extends
+                    before the contig sequence) and the list of fq_read objects with the read sequence.
+        """
+        kmerPos = {}
+        for i in range(len(seq) - self.kmerLen + 1):
+            kmerPos.setdefault(seq[i:i + self.kmerLen], i)
+        placed = []
+        for readSeq, reads in self.readSeqs:
+            nkmers = len(readSeq) - self.kmerLen + 1
+            offsets = {}
+            for i in range(nkmers):
+                pos = kmerPos.get(readSeq[i:i + self.kmerLen])
+                if pos is not None:
+                    offsets[pos - i] = offsets.get(pos - i, 0) + 1
+            if len(offsets) == 0:
+                continue
+            offset, votes = max(offsets.items(), key=lambda x: (x[1], -x[0]))
+            if (2 * votes) < nkmers:
+                continue
+            placed.append((max(0, offset), min(len(seq), offset + len(readSeq)), offset, reads))
+        return placed
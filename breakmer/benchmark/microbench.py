@@ -0,0 +1,450 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""microbench.py module
+
+This module times the hot functions of the analysis in isolation on the recorded
+inputs of a target, to catch changes that slow down a stage before a full run.
+The inputs are read from a target directory written by a breakmer run
+(<targets_dir>/<target>):
+    data/<target>_sv_reads_cleaned_filtered.fastq   Cleaned variant reads.
+    kmers/<target>_sample_kmers.out                 Sample only kmers.
+    contigs/contig1/contig1.fa, contig1.fq          Contig sequence and its reads.
+    contigs/contig1/blat_res.target.psl             Target realignment result.
+and from the bam file, targets bed file and target reference fasta of the run. The
+example B2M target in example_data is used by default.
+
+Benchmarked stages:
+    olc.nw                      Needleman-Wunsch alignment of the contig reads to the contig.
+    olc.AlignManager            Two way read to contig alignment used in the contig extension.
+    assembly.find_reads         Search of the reads containing each sample kmer.
+    assembler.init_assembly     Assembly of the sample kmers and reads into contigs.
+    bam_handler.get_variant_reads   Extraction of the variant reads and check of their clippings.
+    bam_handler.cluster_discreads   Clustering of the discordant read pairs.
+    utils.get_fastq_reads       Parsing and filtering of the cleaned reads fastq.
+    realigner.AlignResults      Parsing of the target realignment psl file.
+
+Each stage is repeated --repeat times and each repeat calls the stage until --min_time
+seconds have been spent in it. The inputs are built before each call and are not timed.
+The median and minimum time per call are appended to a JSON history file, together with
+the git commit, host and python version. A stage regresses when its median time is
+more than --threshold (fraction) above the lowest median of the last --baseline_runs
+runs of the same inputs on the same host, in which case the exit status is 1.
+
+Usage:
+    python -m breakmer.benchmark.microbench
+    python -m breakmer.benchmark.microbench --smoke
+    python -m breakmer.benchmark.microbench --target_dir <targets_dir>/<target> --bam <sample.bam> \\
+        --targets_bed <targets.bed> --ref_fa <target_forward_refseq.fa> --history <history.json>
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+import timeit
+import logging
+import breakmer.utils as utils
+import breakmer.assembly.olc as olc
+import breakmer.assembly.utils as assemblyUtils
+import breakmer.assembly.assembler as assembler
+import breakmer.processor.bam_handler as bam_handler
+import breakmer.realignment.realigner as realigner
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+EXAMPLE_DIR = os.path.join(REPO_DIR, 'example_data')
+REGION_BUFFER = 200  # Same as TargetManager.regionBuffer.
+
+
+class RecordedInputs:
+    """Class to load the recorded inputs of a target.
+
+    Attributes:
+        name (str):             Target name.
+        targetDir (str):        Path to the target analysis directory.
+        bam (str):              Path to the bam file.
+        refFa (str):            Path to the target reference fasta file.
+        kmerSize (int):         Kmer size of the analysis.
+        insertSizeThresh (int): Insert size threshold for discordant read pairs.
+        chrom (str):            Target chromosome.
+        start (int):            Target start position.
+        end (int):              Target end position.
+        workDir (str):          Temporary directory for the stages writing files.
+    """
+
+    def __init__(self, options):
+        self.name = options.target
+        self.targetDir = options.target_dir
+        self.bam = options.bam
+        self.refFa = options.ref_fa
+        self.kmerSize = options.kmer_size
+        self.insertSizeThresh = options.insertsize_thresh
+        self.chrom, self.start, self.end = get_target_coords(options.targets_bed, self.name)
+        self.workDir = tempfile.mkdtemp(prefix='breakmer_microbench_')
+        self.fqFn = self.get_fn('data', self.name + '_sv_reads_cleaned_filtered.fastq')
+        if not os.path.isfile(self.fqFn):
+            self.fqFn = self.get_fn('data', self.name + '_sv_reads_cleaned.fastq')
+        self.kmersFn = self.get_fn('kmers', self.name + '_sample_kmers.out')
+        self.contigDir = self.get_fn('contigs', 'contig1')
+        self.contigSeq = ''.join([line.strip() for line in open(os.path.join(self.contigDir, 'contig1.fa')) if not line.startswith('>')])
+        self.contigReads = [seq for header, seq, qual in utils.FastqFile(os.path.join(self.contigDir, 'contig1.fq'))]
+        self.pslFn = os.path.join(self.contigDir, 'blat_res.target.psl')
+
+    def get_fn(self, *names):
+        """Return the path to a file in the target directory."""
+        return os.path.join(self.targetDir, *names)
+
+    def has_bam(self):
+        """Return True if the indexed bam file is available."""
+        return self.bam is not None and os.path.isfile(self.bam)
+
+    def get_kmers(self):
+        """Return a dictionary of the sample only kmers and their counts."""
+        kmers = {}
+        for line in open(self.kmersFn, 'r'):
+            linesplit = line.split()
+            kmers[linesplit[0]] = int(linesplit[1])
+        return kmers
+
+    def get_fq_recs(self):
+        """Return a dictionary of the cleaned reads keyed by sequence, as returned by utils.get_fastq_reads."""
+        fqRecs = {}
+        for header, seq, qual in utils.FastqFile(self.fqFn):
+            fqRecs.setdefault(seq, []).append(utils.fq_read(header, seq, qual, header.split('_')[-1] == '1'))
+        return fqRecs
+
+    def get_read_len(self, fqRecs):
+        """Return the read length."""
+        return max([len(seq) for seq in fqRecs])
+
+    def get_var_reads(self):
+        """Return the VariantReadTracker of the target, as set in Variation.set_var_reads."""
+        varReads = bam_handler.get_variant_reads(self.bam, self.chrom, self.start - REGION_BUFFER, self.end - REGION_BUFFER, self.insertSizeThresh)
+        varReads.check_clippings(self.kmerSize, self.start, self.end)
+        return varReads
+
+    def copy_to_workdir(self, fn):
+        """Copy a file to the work directory and return the path to the copy."""
+        copyFn = os.path.join(self.workDir, os.path.basename(fn))
+        shutil.copyfile(fn, copyFn)
+        return copyFn
+
+    def cleanup(self):
+        """Remove the work directory."""
+        shutil.rmtree(self.workDir)
+
+
+def get_target_coords(targetsBedFn, name):
+    """Return the chromosome, start and end of a target in a targets bed file."""
+    chrom = None
+    coords = []
+    for line in open(targetsBedFn, 'r'):
+        linesplit = line.strip().split('\t')
+        if len(linesplit) < 4 or linesplit[3] != name:
+            continue
+        chrom = linesplit[0]
+        coords.extend([int(linesplit[1]), int(linesplit[2])])
+    if chrom is None:
+        print 'Target %s is not in the targets bed file %s.' % (name, targetsBedFn)
+        sys.exit(1)
+    return chrom, min(coords), max(coords)
+
+
+def setup_contig_reads(inputs):
+    """Return the contig sequence and the sequences of its reads."""
+    return (inputs.contigSeq, inputs.contigReads)
+
+
+def run_nw(state):
+    contigSeq, reads = state
+    for readSeq in reads:
+        olc.nw(contigSeq, readSeq)
+
+
+def run_align_manager(state):
+    contigSeq, reads = state
+    for readSeq in reads:
+        minScore = float(min(len(contigSeq), len(readSeq))) / 4.0
+        olc.AlignManager(contigSeq, readSeq, minScore, 0.90).check_align_thresholds()
+
+
+def setup_find_reads(inputs):
+    return (inputs.get_kmers(), inputs.get_fq_recs().items())
+
+
+def run_find_reads(state):
+    kmers, readItems = state
+    for kmer in kmers:
+        assemblyUtils.find_reads(kmer, readItems, set())
+
+
+def setup_assembly(inputs):
+    """Return fresh assembly inputs, the reads are flagged as used during the assembly."""
+    fqRecs = inputs.get_fq_recs()
+    return (inputs.get_kmers(), fqRecs, inputs.kmerSize, 2, inputs.get_read_len(fqRecs))
+
+
+def run_assembly(state):
+    assembler.init_assembly(*state)
+
+
+def setup_variant_reads(inputs):
+    return inputs
+
+
+def run_variant_reads(inputs):
+    inputs.get_var_reads()
+
+
+def setup_cluster_discreads(inputs):
+    return inputs.get_var_reads()
+
+
+def run_cluster_discreads(varReads):
+    varReads.cluster_discreads()
+
+
+def setup_fastq_reads(inputs):
+    """Return a copy of the cleaned fastq file, the filtered fastq file is written next to it.
+
+    The variant reads are extracted once from the bam file and the recorded fastq is
+    reduced to the reads of this extraction, as the fastq and the variant reads of an
+    analysis come from the same extraction.
+    """
+    if not hasattr(inputs, 'svReads'):
+        inputs.svReads = inputs.get_var_reads().sv
+        fqDir = os.path.join(inputs.workDir, 'sv_reads')
+        os.makedirs(fqDir)
+        inputs.svFqFn = os.path.join(fqDir, os.path.basename(inputs.fqFn))
+        svFq = open(inputs.svFqFn, 'w')
+        for header, seq, qual in utils.FastqFile(inputs.fqFn):
+            if '_'.join(header.lstrip('@').split('_')[:-1]) in inputs.svReads:
+                svFq.write(header + '\n' + seq + '\n+\n' + qual + '\n')
+        svFq.close()
+    return (inputs.copy_to_workdir(inputs.svFqFn), inputs.svReads)
+
+
+def run_fastq_reads(state):
+    utils.get_fastq_reads(*state)
+
+
+def setup_align_results(inputs):
+    """Return the target realignment inputs, the contig is assembled once and reused."""
+    if not hasattr(inputs, 'contig'):
+        fqRecs = inputs.get_fq_recs()
+        contigs = assembler.init_assembly(inputs.get_kmers(), fqRecs, inputs.kmerSize, 2, inputs.get_read_len(fqRecs))
+        contig = contigs[0]
+        for assembledContig in contigs:
+            if assembledContig.seq == inputs.contigSeq:
+                contig = assembledContig
+        contig.seq = inputs.contigSeq
+        contig.meta.chr = inputs.chrom
+        contig.meta.start = inputs.start
+        contig.meta.end = inputs.end
+        contig.meta.targetName = inputs.name
+        contig.meta.regionBuffer = REGION_BUFFER
+        inputs.contig = contig
+    return (inputs.copy_to_workdir(inputs.pslFn), inputs.contig, inputs.refFa)
+
+
+def run_align_results(state):
+    pslFn, contig, refFa = state
+    realigner.AlignResults('blat', 'target', pslFn, contig, refFa)
+
+
+# Stage name, setup function, timed function and whether the stage reads the bam file.
+BENCHMARKS = [('olc.nw', setup_contig_reads, run_nw, False),
+              ('olc.AlignManager', setup_contig_reads, run_align_manager, False),
+              ('assembly.find_reads', setup_find_reads, run_find_reads, False),
+              ('assembler.init_assembly', setup_assembly, run_assembly, False),
+              ('bam_handler.get_variant_reads', setup_variant_reads, run_variant_reads, True),
+              ('bam_handler.cluster_discreads', setup_cluster_discreads, run_cluster_discreads, True),
+              ('utils.get_fastq_reads', setup_fastq_reads, run_fastq_reads, True),
+              ('realigner.AlignResults', setup_align_results, run_align_results, False)]
+
+
+def time_stage(setupFnc, runFnc, inputs, repeat, minTime):
+    """Time a stage.
+
+    Args:
+        setupFnc (function):    Function returning the inputs of a call, not timed.
+        runFnc (function):      Function to time.
+        inputs (RecordedInputs):    Recorded target inputs.
+        repeat (int):           Number of repeats.
+        minTime (float):        Minimum seconds spent in the timed function per repeat.
+    Returns:
+        result (dict):  Median and minimum seconds per call and number of calls per repeat.
+    """
+
+    times = []
+    ncalls = []
+    for i in range(repeat):
+        elapsed = 0.0
+        n = 0
+        while n == 0 or elapsed < minTime:
+            state = setupFnc(inputs)
+            startTime = timeit.default_timer()
+            runFnc(state)
+            elapsed += timeit.default_timer() - startTime
+            n += 1
+        times.append(elapsed / n)
+        ncalls.append(n)
+    return {'median': utils.median(times), 'min': min(times), 'calls': ncalls}
+
+
+def get_commit():
+    """Return the git commit of the repository or None if it is not available."""
+    try:
+        p = subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, errors = p.communicate()
+    except OSError:
+        return None
+    if p.returncode != 0:
+        return None
+    return output.strip()
+
+
+def load_history(historyFn):
+    """Return the list of the runs stored in a history file."""
+    if not os.path.isfile(historyFn):
+        return []
+    return json.load(open(historyFn, 'r'))['runs']
+
+
+def write_history(historyFn, runs):
+    """Write the list of runs to a history file."""
+    tmpFn = historyFn + '.tmp'
+    f = open(tmpFn, 'w')
+    json.dump({'runs': runs}, f, indent=2, sort_keys=True)
+    f.close()
+    os.rename(tmpFn, historyFn)
+
+
+def get_baselines(runs, run, nruns):
+    """Return the lowest median time of each stage in the last runs of the same inputs on the same host.
+
+    Args:
+        runs (list):    Previous runs from the history file.
+        run (dict):     Current run.
+        nruns (int):    Number of previous runs to consider.
+    Returns:
+        baselines (dict):   Lowest median seconds per call keyed by stage name.
+    """
+
+    baselines = {}
+    previous = [x for x in runs if x['inputs'] == run['inputs'] and x['host'] == run['host']]
+    for previousRun in previous[-nruns:]:
+        for stage, result in previousRun['results'].items():
+            if stage not in baselines or result['median'] < baselines[stage]:
+                baselines[stage] = result['median']
+    return baselines
+
+
+def run_benchmarks(options):
+    """Run the selected benchmarks, report them against the history and store the run.
+
+    Args:
+        options (Namespace):    Command line options.
+    Returns:
+        regressions (list):     Names of the stages slower than the threshold.
+    """
+
+    logger = logging.getLogger('breakmer')  # Only errors are logged, to keep the logging out of the timings.
+    logger.setLevel(logging.ERROR)
+    logger.addHandler(logging.StreamHandler())
+    inputs = RecordedInputs(options)
+    selected = options.stages.split(',') if options.stages else [x[0] for x in BENCHMARKS]
+    run = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'commit': get_commit(),
+           'host': socket.gethostname(),
+           'python': sys.version.split()[0],
+           'inputs': {'target': inputs.name, 'target_dir': os.path.abspath(inputs.targetDir), 'bam': os.path.abspath(inputs.bam) if inputs.has_bam() else None},
+           'repeat': options.repeat,
+           'results': {}}
+    try:
+        for name, setupFnc, runFnc, needsBam in BENCHMARKS:
+            if name not in selected:
+                continue
+            if needsBam and not inputs.has_bam():
+                print 'Skipping %s, bam file %s not found.' % (name, inputs.bam)
+                continue
+            run['results'][name] = time_stage(setupFnc, runFnc, inputs, options.repeat, options.min_time)
+    finally:
+        inputs.cleanup()
+
+    runs = load_history(options.history)
+    baselines = get_baselines(runs, run, options.baseline_runs)
+    regressions = []
+    print '\t'.join(['stage', 'median_ms', 'min_ms', 'baseline_ms', 'change', 'status'])
+    for name, setupFnc, runFnc, needsBam in BENCHMARKS:
+        if name not in run['results']:
+            continue
+        result = run['results'][name]
+        baseline = baselines.get(name)
+        change = ''
+        status = 'new'
+        if baseline:
+            change = '%+.1f%%' % (100.0 * (result['median'] - baseline) / baseline)
+            status = 'ok'
+            if result['median'] > baseline * (1.0 + options.threshold):
+                status = 'REGRESSION'
+                regressions.append(name)
+        print '\t'.join([name, '%.3f' % (1000 * result['median']), '%.3f' % (1000 * result['min']), '%.3f' % (1000 * baseline) if baseline else '', change, status])
+
+    if not options.no_save:
+        runs.append(run)
+        write_history(options.history, runs)
+        print 'Results appended to %s' % options.history
+    return regressions
+
+
+def get_parser():
+    """Return the command line argument parser."""
+    parser = argparse.ArgumentParser(description='Time the analysis stages on the recorded inputs of a target.')
+    parser.add_argument('--target', dest='target', default='B2M', help='Target name. [default: %(default)s]')
+    parser.add_argument('--target_dir', dest='target_dir', default=os.path.join(EXAMPLE_DIR, 'example_targets', 'B2M'), help='Target analysis directory with the recorded inputs. [default: %(default)s]')
+    parser.add_argument('--bam', dest='bam', default=os.path.join(EXAMPLE_DIR, 'B2M.bam'), help='Indexed bam file of the sample. The bam stages are skipped if it does not exist. [default: %(default)s]')
+    parser.add_argument('--targets_bed', dest='targets_bed', default=os.path.join(EXAMPLE_DIR, 'genes.bed'), help='Targets bed file. [default: %(default)s]')
+    parser.add_argument('--ref_fa', dest='ref_fa', default=os.path.join(EXAMPLE_DIR, 'ref_seq', 'B2M', 'B2M_forward_refseq.fa'), help='Target reference fasta file. [default: %(default)s]')
+    parser.add_argument('-k', '--kmer_size', dest='kmer_size', default=15, type=int, help='Kmer size of the analysis. [default: %(default)s]')
+    parser.add_argument('--insertsize_thresh', dest='insertsize_thresh', default=500, type=int, help='Insert size threshold for discordant read pairs. [default: %(default)s]')
+    parser.add_argument('--stages', dest='stages', default=None, help='Comma separated stages to run: %s. [default: all]' % ','.join([x[0] for x in BENCHMARKS]))
+    parser.add_argument('-r', '--repeat', dest='repeat', default=5, type=int, help='Number of repeats of each stage. [default: %(default)s]')
+    parser.add_argument('--min_time', dest='min_time', default=0.2, type=float, help='Minimum seconds spent in a stage per repeat. [default: %(default)s]')
+    parser.add_argument('--history', dest='history', default='microbench_history.json', help='JSON history file. [default: %(default)s]')
+    parser.add_argument('--baseline_runs', dest='baseline_runs', default=5, type=int, help='Number of previous runs the baseline is taken from. [default: %(default)s]')
+    parser.add_argument('-t', '--threshold', dest='threshold', default=0.2, type=float, help='Fraction above the baseline median for a stage to regress. [default: %(default)s]')
+    parser.add_argument('--no_save', dest='no_save', default=False, action='store_true', help='Do not append the results to the history file. [default: %(default)s]')
+    parser.add_argument('--smoke', dest='smoke', default=False, action='store_true', help='Call each stage once to check that the benchmarks run on the inputs, without saving the results or checking for regressions. [default: %(default)s]')
+    return parser
+
+
+def main(argv):
+    options = get_parser().parse_args(argv)
+    if options.stages:
+        for stage in options.stages.split(','):
+            if stage not in [x[0] for x in BENCHMARKS]:
+                print 'Unknown stage %s, choose from %s.' % (stage, ','.join([x[0] for x in BENCHMARKS]))
+                sys.exit(1)
+    if options.smoke:
+        options.repeat = 1
+        options.min_time = 0.0
+        options.no_save = True
+    regressions = run_benchmarks(options)
+    if regressions and not options.smoke:
+        print 'Stages slower than the baseline by more than %d%%: %s' % (int(100 * options.threshold), ','.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,270 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""scaling.py module
+
+This module runs the complete analysis (breakmer.py run) on synthetic panels while
+sweeping the panel size and the number of processors, to measure the throughput and
+the parallel efficiency of the RunTracker process pool.
+
+A dataset is simulated with simulate.py for each panel size (--panel_sizes) and its
+reference data is prepared once with prepare_reference_data, so that the runs only
+measure the analysis. Each panel is then analyzed with each --nprocs value. The blat,
+gfClient, gfServer and faToTwoBit binaries are replaced by the stubs of stub_aligner.py
+with a set latency (--aligner_latency) unless --real_aligners is set. jellyfish is
+always run, the reads are cleaned in-process (adapter_trimmer=internal).
+
+The output directory contains:
+    panel_<N>/                  Simulated dataset and reference data of each panel size.
+    runs/panel_<N>_n<P>/        Analysis directory of each run.
+    scaling_report.json         Run metrics, stage totals and worker peak memory of all the runs.
+    scaling_report.tsv          One line per run: wall time, targets/minute, reads/second,
+                                speedup, parallel efficiency and worker peak memory.
+    scaling_stages.tsv          Wall and CPU time of each stage, summed over the targets of each run,
+                                the CPU time is NA for the stages that ran at the same time as another.
+
+The speedup and parallel efficiency of a run are relative to the run of the same panel
+with the fewest processors, efficiency = (T_min * P_min) / (T * P). The peak memory of a
+worker is the largest process_max_rss_kb of the stage records written by that worker process in
+<analysis_name>_run_stats.json.
+
+Usage:
+    python -m breakmer.benchmark.scaling -o <out_dir> --panel_sizes 10,50,100 --nprocs 1,2,4,8
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import breakmer.utils as utils
+import breakmer.benchmark.simulate as simulate
+import breakmer.benchmark.stub_aligner as stub_aligner
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+BREAKMER_SCRIPT = os.path.join(stub_aligner.REPO_DIR, 'breakmer.py')
+STUB_PORT = 8999  # Port passed to the runs with the stub aligners, the gfClient stub passes the server check.
+REPORT_HEADER = ['panel_size', 'nprocs', 'read_pairs', 'wall_s', 'analysis_wall_s', 'targets_per_min', 'reads_per_s', 'speedup', 'efficiency', 'workers', 'max_worker_rss_kb', 'mean_worker_rss_kb']
+
+
+def simulate_panel(options, panelSize):
+    """Simulate the dataset of a panel size, unless it was simulated with the same options.
+
+    Args:
+        options (Namespace):    Command line options.
+        panelSize (int):        Number of targets.
+    Returns:
+        simParams (dict):   Simulation parameters and outputs from simulation.json.
+    """
+
+    panelDir = os.path.join(options.out_dir, 'panel_%d' % panelSize)
+    simArgs = ['-o', os.path.join(panelDir, 'sim'), '-t', str(panelSize), '-d', str(options.depth), '--read_len', str(options.read_len), '-s', str(options.seed)]
+    if options.reference_fasta is not None:
+        simArgs.extend(['-r', options.reference_fasta, '-b', options.targets_bed])
+    simOptions = simulate.get_parser().parse_args(simArgs)
+    simJsonFn = os.path.join(simOptions.out_dir, 'simulation.json')
+    if os.path.isfile(simJsonFn):
+        simParams = json.load(open(simJsonFn, 'r'))
+        if all([simParams.get(key) == value for key, value in vars(simOptions).items() if key not in ('reference_fasta', 'targets_bed', 'ntargets')]):
+            print 'Using the simulated panel in %s' % simOptions.out_dir
+            return simParams
+    simulate.simulate(simOptions)
+    return json.load(open(simJsonFn, 'r'))
+
+
+def write_config(options, panelSize, simParams, analysisName, binaries):
+    """Write the configuration file of a run.
+
+    Args:
+        options (Namespace):    Command line options.
+        panelSize (int):        Number of targets.
+        simParams (dict):       Simulation parameters and outputs.
+        analysisName (str):     Analysis name, also the run directory name.
+        binaries (dict):        Paths to the binaries keyed by configuration key.
+    Returns:
+        configFn (str):     Path to the configuration file.
+    """
+
+    panelDir = os.path.join(options.out_dir, 'panel_%d' % panelSize)
+    annotationFn = os.path.join(options.out_dir, 'empty_annotation.txt')
+    if not os.path.isfile(annotationFn):  # Required parameter, the calls are only annotated when bedtools is set.
+        open(annotationFn, 'w').close()
+    config = [('analysis_name', analysisName),
+              ('targets_bed_file', os.path.join(simParams['out_dir'], 'sim_targets.bed')),
+              ('sample_bam_file', os.path.join(simParams['out_dir'], 'sim.bam')),
+              ('analysis_dir', os.path.join(options.out_dir, 'runs', analysisName)),
+              ('reference_data_dir', os.path.join(panelDir, 'ref_data')),
+              ('cutadapt_config_file', options.cutadapt_config),
+              ('reference_fasta', os.path.abspath(simParams['reference_fasta'])),
+              ('gene_annotation_file', annotationFn),
+              ('kmer_size', str(options.kmer_size)),
+              ('adapter_trimmer', 'internal'),
+              ('target_aligner', options.target_aligner)]
+    config.extend(sorted(binaries.items()))
+    configFn = os.path.join(options.out_dir, 'runs', analysisName + '.cfg')
+    configFile = open(configFn, 'w')
+    for key, value in config:
+        configFile.write('%s=%s\n' % (key, value))
+    configFile.close()
+    return configFn
+
+
+def run_breakmer(fncCmd, configFn, nprocs, extraArgs, logFn):
+    """Run breakmer.py in a subprocess and return its wall time in seconds."""
+    cmd = [sys.executable, BREAKMER_SCRIPT, fncCmd, '-c', configFn, '-n', str(nprocs)] + extraArgs
+    logFile = open(logFn, 'w')
+    startTime = time.time()
+    returnCode = subprocess.call(cmd, stdout=logFile, stderr=subprocess.STDOUT)
+    wallTime = time.time() - startTime
+    logFile.close()
+    if returnCode != 0:
+        print 'Command %s failed with exit status %d, see %s' % (' '.join(cmd), returnCode, logFn)
+        sys.exit(1)
+    return wallTime
+
+
+def get_worker_rss(stageRecords):
+    """Return a dictionary with the peak resident set size in KB of each worker process id."""
+    workerRss = {}
+    for record in stageRecords:
+        pid = record.get('pid', 0)
+        workerRss[pid] = max(workerRss.get(pid, 0), record['process_max_rss_kb'])
+    return workerRss
+
+
+def run_sweep(options):
+    """Simulate the panels, run the analyses and write the scaling report.
+
+    Args:
+        options (Namespace):    Command line options.
+    Returns:
+        None
+    """
+
+    panelSizes = [int(x) for x in options.panel_sizes.split(',')]
+    nprocsList = sorted([int(x) for x in options.nprocs.split(',')])
+    if not os.path.exists(os.path.join(options.out_dir, 'runs')):
+        os.makedirs(os.path.join(options.out_dir, 'runs'))
+
+    binaries = {}
+    extraArgs = []
+    if not options.real_aligners:
+        binaries = stub_aligner.write_stubs(os.path.join(options.out_dir, 'stub_bin'), options.aligner_latency)
+        extraArgs = ['-p', str(STUB_PORT), '--hostname', 'localhost']
+    binaries['jellyfish'] = options.jellyfish or utils.which('jellyfish')
+    if not binaries['jellyfish']:
+        print 'jellyfish was not found in the path, set it with --jellyfish.'
+        sys.exit(1)
+
+    runs = []
+    for panelSize in panelSizes:
+        simParams = simulate_panel(options, panelSize)
+        configFn = write_config(options, panelSize, simParams, 'panel_%d_ref' % panelSize, binaries)
+        print 'Preparing the reference data of panel size %d' % panelSize
+        run_breakmer('prepare_reference_data', configFn, max(nprocsList), [], configFn.replace('.cfg', '.log'))
+        for nprocs in nprocsList:
+            analysisName = 'panel_%d_n%d' % (panelSize, nprocs)
+            configFn = write_config(options, panelSize, simParams, analysisName, binaries)
+            best = None
+            for i in range(options.repeat):
+                analysisDir = os.path.join(options.out_dir, 'runs', analysisName)
+                if os.path.exists(analysisDir):  # Targets are not reused between repeats.
+                    shutil.rmtree(analysisDir)
+                print 'Running panel size %d with %d processors (%d of %d)' % (panelSize, nprocs, i + 1, options.repeat)
+                wallTime = run_breakmer('run', configFn, nprocs, extraArgs, os.path.join(options.out_dir, 'runs', analysisName + '.log'))
+                runStats = json.load(open(os.path.join(analysisDir, 'output', analysisName + '_run_stats.json'), 'r'))
+                if best is None or wallTime < best[0]:
+                    best = (wallTime, runStats)
+            wallTime, runStats = best
+            workerRss = get_worker_rss(runStats['stages'])
+            runs.append({'panel_size': panelSize,
+                         'nprocs': nprocs,
+                         'read_pairs': simParams['read_pairs'],
+                         'wall_s': wallTime,
+                         'analysis_wall_s': runStats['wall_time']['total'],
+                         'targets_per_min': 60.0 * panelSize / wallTime,
+                         'reads_per_s': 2.0 * simParams['read_pairs'] / wallTime,
+                         'workers': len(workerRss),
+                         'max_worker_rss_kb': max(workerRss.values()) if workerRss else 0,
+                         'mean_worker_rss_kb': utils.mean(workerRss.values()) if workerRss else 0,
+                         'worker_rss_kb': workerRss,
+                         'stage_totals': runStats['stage_totals']})
+
+    for run in runs:  # Speedup and efficiency relative to the run of the same panel with the fewest processors.
+        baseRun = [x for x in runs if x['panel_size'] == run['panel_size'] and x['nprocs'] == nprocsList[0]][0]
+        run['speedup'] = baseRun['wall_s'] / run['wall_s']
+        run['efficiency'] = (baseRun['wall_s'] * baseRun['nprocs']) / (run['wall_s'] * run['nprocs'])
+    write_report(options, runs)
+
+
+def write_report(options, runs):
+    """Write the scaling report files and print the run metrics."""
+    reportFn = os.path.join(options.out_dir, 'scaling_report')
+    reportFile = open(reportFn + '.json', 'w')
+    json.dump({'options': vars(options), 'runs': runs}, reportFile, indent=2, sort_keys=True)
+    reportFile.close()
+
+    lines = ['\t'.join(REPORT_HEADER)]
+    for run in runs:
+        values = []
+        for key in REPORT_HEADER:
+            if isinstance(run[key], float):
+                values.append('%.3f' % run[key])
+            else:
+                values.append(str(run[key]))
+        lines.append('\t'.join(values))
+    reportFile = open(reportFn + '.tsv', 'w')
+    reportFile.write('\n'.join(lines) + '\n')
+    reportFile.close()
+
+    stagesFile = open(os.path.join(options.out_dir, 'scaling_stages.tsv'), 'w')
+    stagesFile.write('\t'.join(['panel_size', 'nprocs', 'stage', 'wall_s', 'cpu_s', 'child_cpu_s', 'wall_fraction']) + '\n')
+    for run in runs:
+        totalWall = sum([x['wall'] for x in run['stage_totals'].values()])
+        for stage in sorted(run['stage_totals'], key=lambda x: run['stage_totals'][x]['wall'], reverse=True):
+            total = run['stage_totals'][stage]
+            fraction = total['wall'] / totalWall if totalWall > 0 else 0.0
+            stagesFile.write('\t'.join([str(run['panel_size']), str(run['nprocs']), stage, '%.3f' % total['wall'], utils.format_seconds(total['cpu']), utils.format_seconds(total['child_cpu']), '%.3f' % fraction]) + '\n')
+    stagesFile.close()
+    print '\n'.join(lines)
+    print 'Scaling report written to %s.tsv, stage breakdown to %s' % (reportFn, os.path.join(options.out_dir, 'scaling_stages.tsv'))
+
+
+def get_parser():
+    """Return the command line argument parser."""
+    parser = argparse.ArgumentParser(description='Measure the throughput and parallel efficiency of the analysis on synthetic panels.')
+    parser.add_argument('-o', '--out_dir', dest='out_dir', required=True, help='Output directory.')
+    parser.add_argument('--panel_sizes', dest='panel_sizes', default='10,50', help='Comma separated numbers of targets. [default: %(default)s]')
+    parser.add_argument('--nprocs', dest='nprocs', default='1,2,4', help='Comma separated numbers of processors. [default: %(default)s]')
+    parser.add_argument('-r', '--reference_fasta', dest='reference_fasta', default=None, help='Reference fasta file to simulate from. A random reference is generated if not specified. [default: %(default)s]')
+    parser.add_argument('-b', '--targets_bed', dest='targets_bed', default=None, help='Targets bed file, required with --reference_fasta. [default: %(default)s]')
+    parser.add_argument('-d', '--depth', dest='depth', default=500, type=int, help='Simulated read depth. [default: %(default)s]')
+    parser.add_argument('--read_len', dest='read_len', default=100, type=int, help='Simulated read length. [default: %(default)s]')
+    parser.add_argument('-s', '--seed', dest='seed', default=1, type=int, help='Simulation random seed. [default: %(default)s]')
+    parser.add_argument('-k', '--kmer_size', dest='kmer_size', default=15, type=int, help='Kmer size of the analysis. [default: %(default)s]')
+    parser.add_argument('--target_aligner', dest='target_aligner', default='blat', choices=['blat', 'kmer'], help='Target aligner of the analysis. [default: %(default)s]')
+    parser.add_argument('--aligner_latency', dest='aligner_latency', default=0.05, type=float, help='Seconds each stub aligner call waits. [default: %(default)s]')
+    parser.add_argument('--real_aligners', dest='real_aligners', default=False, action='store_true', help='Use the blat, gfClient, gfServer and faToTwoBit binaries in the path instead of the stubs. [default: %(default)s]')
+    parser.add_argument('--jellyfish', dest='jellyfish', default=None, help='Path to the jellyfish binary. [default: jellyfish in the path]')
+    parser.add_argument('--cutadapt_config', dest='cutadapt_config', default=os.path.join(stub_aligner.REPO_DIR, 'example_data', 'cutadapt.cfg'), help='Cutadapt configuration file with the adapters to trim. [default: %(default)s]')
+    parser.add_argument('--repeat', dest='repeat', default=1, type=int, help='Number of runs of each configuration, the fastest run is reported. [default: %(default)s]')
+    return parser
+
+
+def main(argv):
+    options = get_parser().parse_args(argv)
+    if (options.reference_fasta is None) != (options.targets_bed is None):
+        print 'Both --reference_fasta and --targets_bed must be specified to use an existing reference.'
+        sys.exit(1)
+    options.out_dir = os.path.abspath(options.out_dir)
+    run_sweep(options)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
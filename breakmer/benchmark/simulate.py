@@ -0,0 +1,567 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""simulate.py module
+
+This module generates synthetic benchmark datasets with known structural variants.
+Paired-end reads are simulated for each target region of a reference fasta and a
+targets bed file at a set depth. A structural variant (indel, tandem duplication,
+inversion or translocation) is injected in a fraction of the targets and the reads
+from the variant haplotype are aligned back to the reference with the clipped,
+gapped and discordant alignments expected at the breakpoints.
+
+The output directory contains:
+    sim.bam, sim.bam.bai    Sorted and indexed bam file with the simulated reads.
+    sim_targets.bed         Targets bed file with the simulated targets.
+    truth.tsv               Injected variants with their breakpoints.
+    simulation.json         Simulation parameters, to reproduce the dataset.
+    genome.fa, genome.fa.fai    Random reference sequence, only if no reference fasta is input.
+
+Usage:
+    python -m breakmer.benchmark.simulate -o <out_dir> -r <reference.fa> -b <targets.bed> --depth 500
+    python -m breakmer.benchmark.simulate -o <out_dir> --ntargets 100 --depth 1000
+"""
+
+import os
+import sys
+import json
+import math
+import random
+import string
+import argparse
+import pysam
+from Bio import SeqIO
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+SV_TYPES = ['indel', 'tandem_dup', 'inversion', 'translocation']
+COMPLEMENT = string.maketrans('ACGTNacgtn', 'TGCANtgcan')
+CIGAR_OPS = {'M': 0, 'I': 1, 'D': 2, 'S': 4}
+TRUTH_HEADER = ['target', 'sv_type', 'sv_subtype', 'chrom', 'breakpoint', 'end', 'partner_chrom', 'partner_breakpoint', 'size', 'inserted_seq', 'alt_pairs']
+
+
+def reverse_complement(seq):
+    """Return the reverse complement of a sequence."""
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def random_seq(rng, length):
+    """Return a random sequence of a length."""
+    return ''.join([rng.choice('ACGT') for i in range(length)])
+
+
+def get_chrom_lengths(fastaFn):
+    """Return a list of tuples with the chromosome names and lengths of a fasta file,
+    read from the fasta index if it exists.
+    """
+
+    if os.path.isfile(fastaFn + '.fai'):
+        return [(line.split('\t')[0], int(line.split('\t')[1])) for line in open(fastaFn + '.fai', 'r')]
+    return [(record.id, len(record.seq)) for record in SeqIO.parse(open(fastaFn, 'rU'), 'fasta')]
+
+
+def read_targets(bedFn):
+    """Return a list of tuples (name, chrom, start, end) for the targets in a bed file.
+    The intervals with the same name are merged into one target, as in the analysis.
+    """
+
+    targets = {}
+    order = []
+    for line in open(bedFn, 'rU'):
+        fields = line.strip().split()
+        if len(fields) < 4 or line.startswith('#') or line.startswith('track'):
+            continue
+        chrom, start, end, name = fields[0], int(fields[1]), int(fields[2]), fields[3].upper()
+        if name not in targets:
+            targets[name] = [chrom, start, end]
+            order.append(name)
+        else:
+            targets[name][1] = min(targets[name][1], start)
+            targets[name][2] = max(targets[name][2], end)
+    return [(name, targets[name][0], targets[name][1], targets[name][2]) for name in order]
+
+
+def write_fasta(fastaFn, chroms, lineLen=60):
+    """Write the chromosome sequences to a fasta file with its fasta index.
+
+    Args:
+        fastaFn (str):      Path to the fasta file.
+        chroms (list):      List of tuples with the chromosome names and sequences.
+        lineLen (int):      Number of bases per line.
+    Returns:
+        None
+    """
+
+    fastaFile = open(fastaFn, 'w')
+    indexFile = open(fastaFn + '.fai', 'w')
+    offset = 0
+    for chrom, seq in chroms:
+        header = '>%s\n' % chrom
+        offset += len(header)
+        indexFile.write('\t'.join([chrom, str(len(seq)), str(offset), str(lineLen), str(lineLen + 1)]) + '\n')
+        fastaFile.write(header)
+        for i in range(0, len(seq), lineLen):
+            fastaFile.write(seq[i:(i + lineLen)] + '\n')
+        offset += len(seq) + int(math.ceil(float(len(seq)) / lineLen))
+    fastaFile.close()
+    indexFile.close()
+
+
+def make_synthetic_reference(outDir, ntargets, targetLen, spacing, rng):
+    """Write a random reference genome with the target regions spaced along the chromosomes.
+
+    Args:
+        outDir (str):       Output directory.
+        ntargets (int):     Number of targets.
+        targetLen (int):    Length of each target.
+        spacing (int):      Distance between the target starts.
+        rng (Random):       Random number generator.
+    Returns:
+        refFn (str):        Path to the reference fasta file.
+        bedFn (str):        Path to the targets bed file.
+    """
+
+    nchroms = max(2, min(22, ntargets / 50 + 2))
+    targetsPerChrom = int(math.ceil(float(ntargets) / nchroms))
+    chroms = []
+    bedLines = []
+    for i in range(nchroms):
+        chrom = 'chr%d' % (i + 1)
+        chroms.append((chrom, random_seq(rng, (targetsPerChrom + 1) * spacing)))
+        for j in range(targetsPerChrom):
+            targetIdx = i * targetsPerChrom + j
+            if targetIdx >= ntargets:
+                break
+            start = (j + 1) * spacing - targetLen / 2
+            bedLines.append('\t'.join([chrom, str(start), str(start + targetLen), 'T%05d' % (targetIdx + 1), 'exon']))
+    refFn = os.path.join(outDir, 'genome.fa')
+    write_fasta(refFn, chroms)
+    bedFn = os.path.join(outDir, 'genome_targets.bed')
+    bedFile = open(bedFn, 'w')
+    bedFile.write('\n'.join(bedLines) + '\n')
+    bedFile.close()
+    return refFn, bedFn
+
+
+class Reference:
+    """Access to the reference sequence, one chromosome is kept in memory at a time.
+
+    Attributes:
+        records (dict):     Biopython index of the fasta records.
+        lengths (list):     List of tuples with the chromosome names and lengths.
+        chrom (str):        Name of the chromosome in memory.
+        seq (str):          Upper case sequence of the chromosome in memory.
+    """
+
+    def __init__(self, fastaFn):
+        self.records = SeqIO.index(fastaFn, 'fasta')
+        self.lengths = get_chrom_lengths(fastaFn)
+        self.chrom = None
+        self.seq = None
+
+    def fetch(self, chrom, start, end):
+        """Return the upper case reference sequence of an interval."""
+        if chrom != self.chrom:
+            self.chrom = chrom
+            self.seq = str(self.records[chrom].seq).upper()
+        return self.seq[start:end]
+
+    def get_length(self, chrom):
+        """Return the length of a chromosome."""
+        return dict(self.lengths)[chrom]
+
+
+class Block:
+    """Segment of a simulated haplotype, copied from the reference or inserted.
+
+    Attributes:
+        chrom (str):    Reference chromosome or None for inserted sequence.
+        start (int):    Reference start position (0-based).
+        end (int):      Reference end position (exclusive).
+        strand (str):   + if the segment is copied from the forward strand, - if it is inverted.
+        seq (str):      Segment sequence on the haplotype strand.
+    """
+
+    def __init__(self, chrom, start, end, strand, seq):
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+        self.strand = strand
+        self.seq = seq
+
+
+def copy_block(reference, chrom, start, end, strand='+'):
+    """Return a Block copying a reference interval."""
+    seq = reference.fetch(chrom, start, end)
+    if strand == '-':
+        seq = reverse_complement(seq)
+    return Block(chrom, start, end, strand, seq)
+
+
+def make_event(rng, svType, target, reference, options):
+    """Create the variant haplotype of a target with an injected structural variant.
+
+    Args:
+        rng (Random):       Random number generator.
+        svType (str):       Variant type, one of SV_TYPES.
+        target (tuple):     Target name, chrom, start and end.
+        reference (Reference):  Reference sequence.
+        options (Namespace):    Simulation options.
+    Returns:
+        blocks (list):      List of Block objects of the variant haplotype.
+        truth (dict):       Truth set values of the variant.
+    """
+
+    name, chrom, start, end = target
+    regionStart = max(0, start - options.flank)
+    regionEnd = min(reference.get_length(chrom), end + options.flank)
+    margin = min(50, (end - start) / 4)
+    bp = rng.randint(start + margin, end - margin)
+    truth = {'target': name, 'sv_type': svType, 'sv_subtype': '', 'chrom': chrom, 'breakpoint': bp, 'end': bp, 'partner_chrom': '', 'partner_breakpoint': '', 'size': 0, 'inserted_seq': ''}
+    if svType == 'indel':
+        size = rng.randint(options.min_indel, options.max_indel)
+        if rng.random() < 0.5:
+            truth.update({'sv_subtype': 'deletion', 'end': bp + size, 'size': size})
+            blocks = [copy_block(reference, chrom, regionStart, bp), copy_block(reference, chrom, bp + size, regionEnd)]
+        else:
+            insSeq = random_seq(rng, size)
+            truth.update({'sv_subtype': 'insertion', 'size': size, 'inserted_seq': insSeq})
+            blocks = [copy_block(reference, chrom, regionStart, bp), Block(None, 0, size, '+', insSeq), copy_block(reference, chrom, bp, regionEnd)]
+    elif svType == 'tandem_dup':
+        size = min(rng.randint(100, 500), regionEnd - bp - options.read_len)
+        truth.update({'end': bp + size, 'size': size})
+        blocks = [copy_block(reference, chrom, regionStart, bp + size), copy_block(reference, chrom, bp, regionEnd)]
+    elif svType == 'inversion':
+        size = min(rng.randint(200, 1000), regionEnd - bp - options.read_len)
+        truth.update({'end': bp + size, 'size': size})
+        blocks = [copy_block(reference, chrom, regionStart, bp), copy_block(reference, chrom, bp, bp + size, '-'), copy_block(reference, chrom, bp + size, regionEnd)]
+    elif svType == 'translocation':
+        partnerLen = regionEnd - bp
+        partners = [x for x in reference.lengths if x[0] != chrom and x[1] > 2 * partnerLen]
+        if len(partners) > 0:
+            partnerChrom, partnerChromLen = rng.choice(partners)
+            partnerPos = rng.randint(partnerLen, partnerChromLen - partnerLen)
+        else:  # Single chromosome reference, use a distant position on the same chromosome.
+            partnerChrom, partnerChromLen = chrom, reference.get_length(chrom)
+            partnerPos = (bp + partnerChromLen / 2) % (partnerChromLen - partnerLen)
+        truth.update({'partner_chrom': partnerChrom, 'partner_breakpoint': partnerPos})
+        blocks = [copy_block(reference, chrom, regionStart, bp), copy_block(reference, partnerChrom, partnerPos, partnerPos + partnerLen)]
+    return blocks, truth
+
+
+def get_overlaps(blockOffsets, start, end):
+    """Return a list of tuples (block index, start, end) of the haplotype blocks
+    overlapping an interval of the haplotype sequence.
+    """
+
+    overlaps = []
+    for i, (blockStart, blockEnd) in enumerate(blockOffsets):
+        if blockStart < end and blockEnd > start:
+            overlaps.append((i, max(start, blockStart), min(end, blockEnd)))
+    return overlaps
+
+
+def get_ref_gap(blockA, blockB, maxIndel):
+    """Return the reference gap between two consecutive haplotype blocks if they can be
+    joined into one gapped alignment, otherwise None.
+    """
+
+    if blockA.chrom is None or blockB.chrom is None or blockA.chrom != blockB.chrom or blockA.strand != blockB.strand:
+        return None
+    gap = (blockB.start - blockA.end) if blockA.strand == '+' else (blockA.start - blockB.end)
+    if gap < 0 or gap > maxIndel:
+        return None
+    return gap
+
+
+def align_read(blocks, blockOffsets, start, end, options):
+    """Align a read from a haplotype interval back to the reference. The read is
+    aligned to the block with the most read bases and the alignment is extended
+    through small deletions and insertions. The remaining bases are soft-clipped.
+
+    Args:
+        blocks (list):          List of Block objects of the haplotype.
+        blockOffsets (list):    List of tuples with the block start and end in the haplotype sequence.
+        start (int):            Read start in the haplotype sequence.
+        end (int):              Read end in the haplotype sequence.
+        options (Namespace):    Simulation options.
+    Returns:
+        Tuple (chrom, pos, strand, cigar) with the cigar ordered along the reference,
+        or None if the read does not align.
+    """
+
+    overlaps = get_overlaps(blockOffsets, start, end)
+    mapped = [x for x in overlaps if blocks[x[0]].chrom is not None]
+    if len(mapped) == 0:
+        return None
+    anchor = max(mapped, key=lambda x: x[2] - x[1])
+    if (anchor[2] - anchor[1]) < options.min_anchor:
+        return None
+    lo = hi = overlaps.index(anchor)
+    while True:  # Extend to the right of the anchor.
+        if hi + 1 < len(overlaps) and get_ref_gap(blocks[overlaps[hi][0]], blocks[overlaps[hi + 1][0]], options.max_indel) is not None:
+            hi += 1
+        elif hi + 2 < len(overlaps) and blocks[overlaps[hi + 1][0]].chrom is None and len(blocks[overlaps[hi + 1][0]].seq) <= options.max_indel and get_ref_gap(blocks[overlaps[hi][0]], blocks[overlaps[hi + 2][0]], options.max_indel) is not None:
+            hi += 2
+        else:
+            break
+    while True:  # Extend to the left of the anchor.
+        if lo - 1 >= 0 and get_ref_gap(blocks[overlaps[lo - 1][0]], blocks[overlaps[lo][0]], options.max_indel) is not None:
+            lo -= 1
+        elif lo - 2 >= 0 and blocks[overlaps[lo - 1][0]].chrom is None and len(blocks[overlaps[lo - 1][0]].seq) <= options.max_indel and get_ref_gap(blocks[overlaps[lo - 2][0]], blocks[overlaps[lo][0]], options.max_indel) is not None:
+            lo -= 2
+        else:
+            break
+
+    cigar = []
+    if overlaps[lo][1] > start:
+        cigar.append(('S', overlaps[lo][1] - start))
+    prevBlock = None
+    for blockIdx, ovStart, ovEnd in overlaps[lo:(hi + 1)]:
+        block = blocks[blockIdx]
+        if block.chrom is None:
+            cigar.append(('I', ovEnd - ovStart))
+            continue
+        if prevBlock is not None:
+            gap = get_ref_gap(prevBlock, block, options.max_indel)
+            if gap > 0:
+                cigar.append(('D', gap))
+        cigar.append(('M', ovEnd - ovStart))
+        prevBlock = block
+    if overlaps[hi][2] < end:
+        cigar.append(('S', end - overlaps[hi][2]))
+
+    # The first and last aligned blocks are reference blocks, inserted blocks are only joined between them.
+    anchorBlock = blocks[anchor[0]]
+    if anchorBlock.strand == '+':
+        firstIdx, firstStart = overlaps[lo][0], overlaps[lo][1]
+        pos = blocks[firstIdx].start + (firstStart - blockOffsets[firstIdx][0])
+    else:  # The haplotype strand is the reverse reference strand, the last aligned base is the leftmost.
+        lastIdx, lastEnd = overlaps[hi][0], overlaps[hi][2]
+        pos = blocks[lastIdx].end - (lastEnd - blockOffsets[lastIdx][0])
+        cigar.reverse()
+    return anchorBlock.chrom, pos, anchorBlock.strand, cigar
+
+
+def add_errors(rng, seq, errorRate):
+    """Add substitution errors to a read sequence.
+
+    Returns:
+        seq (str):      Read sequence with errors.
+        qual (str):     Base qualities, errors have a lower quality.
+    """
+
+    seq = list(seq)
+    qual = ['I'] * len(seq)
+    for i in range(len(seq)):
+        if rng.random() < errorRate:
+            seq[i] = rng.choice([x for x in 'ACGT' if x != seq[i]])
+            qual[i] = '0'
+    return ''.join(seq), ''.join(qual)
+
+
+def simulate_pairs(rng, blocks, npairs, namePrefix, options):
+    """Simulate read pairs from a haplotype and align them to the reference.
+
+    Args:
+        rng (Random):           Random number generator.
+        blocks (list):          List of Block objects of the haplotype.
+        npairs (int):           Number of read pairs.
+        namePrefix (str):       Read name prefix.
+        options (Namespace):    Simulation options.
+    Returns:
+        Generator of read pairs, each a list of two read dictionaries.
+    """
+
+    hapSeq = ''.join([block.seq for block in blocks])
+    blockOffsets = []
+    offset = 0
+    for block in blocks:
+        blockOffsets.append((offset, offset + len(block.seq)))
+        offset += len(block.seq)
+    readLen = options.read_len
+    for i in range(npairs):
+        fragLen = max(readLen, int(rng.gauss(options.insert_size, options.insert_sd)))
+        if fragLen > len(hapSeq):
+            continue
+        fragStart = rng.randint(0, len(hapSeq) - fragLen)
+        readCoords = [(fragStart, fragStart + readLen, '+'), (fragStart + fragLen - readLen, fragStart + fragLen, '-')]
+        if rng.random() < 0.5:  # Read 1 from either strand of the fragment.
+            readCoords.reverse()
+        pair = []
+        for readStart, readEnd, readStrand in readCoords:
+            seq, qual = add_errors(rng, hapSeq[readStart:readEnd], options.error_rate)
+            read = {'qname': '%s_%d' % (namePrefix, i), 'mapped': False, 'chrom': None, 'pos': -1, 'reverse': readStrand == '-', 'cigar': None}
+            alignment = align_read(blocks, blockOffsets, readStart, readEnd, options)
+            if alignment is not None:
+                chrom, pos, blockStrand, cigar = alignment
+                read.update({'mapped': True, 'chrom': chrom, 'pos': pos, 'cigar': cigar, 'end': pos + sum([x[1] for x in cigar if x[0] in 'MD'])})
+                read['reverse'] = (readStrand == '-') != (blockStrand == '-')
+                if blockStrand == '-':
+                    seq, qual = reverse_complement(seq), qual[::-1]
+            elif readStrand == '-':  # Unmapped reads are stored as sequenced.
+                seq, qual = reverse_complement(seq), qual[::-1]
+            read['seq'] = seq
+            read['qual'] = qual
+            pair.append(read)
+        yield pair
+
+
+def make_aligned_read(read, mate, isRead1, tids, options):
+    """Create a pysam aligned read for a simulated read and its mate."""
+    flag = 0x1 | (0x40 if isRead1 else 0x80)
+    if not read['mapped']:
+        flag |= 0x4
+    if not mate['mapped']:
+        flag |= 0x8
+    if read['reverse']:
+        flag |= 0x10
+    if mate['reverse']:
+        flag |= 0x20
+    chrom, pos = read['chrom'], read['pos']
+    mateChrom, matePos = mate['chrom'], mate['pos']
+    if not read['mapped'] and mate['mapped']:  # Place the unmapped read at the mate position.
+        chrom, pos = mateChrom, matePos
+    if read['mapped'] and not mate['mapped']:
+        mateChrom, matePos = chrom, pos
+    isize = 0
+    if read['mapped'] and mate['mapped'] and read['chrom'] == mate['chrom']:
+        left = min(read['pos'], mate['pos'])
+        right = max(read['end'], mate['end'])
+        isize = right - left
+        if read['pos'] > mate['pos'] or (read['pos'] == mate['pos'] and not isRead1):
+            isize = -isize
+        fwd, rev = (read, mate) if not read['reverse'] else (mate, read)
+        if read['reverse'] != mate['reverse'] and fwd['pos'] <= rev['pos'] and abs(isize) <= options.insert_size + 6 * options.insert_sd:
+            flag |= 0x2
+
+    alignedRead = pysam.AlignedRead()
+    alignedRead.qname = read['qname']
+    alignedRead.seq = read['seq']
+    alignedRead.flag = flag
+    alignedRead.tid = tids[chrom] if chrom is not None else -1
+    alignedRead.pos = pos
+    alignedRead.mapq = 60 if read['mapped'] else 0
+    if read['mapped']:
+        alignedRead.cigar = [(CIGAR_OPS[op], length) for op, length in read['cigar']]
+    alignedRead.mrnm = tids[mateChrom] if mateChrom is not None else -1
+    alignedRead.mpos = matePos
+    alignedRead.isize = isize
+    alignedRead.qual = read['qual']
+    return alignedRead
+
+
+def simulate(options):
+    """Simulate the reads of all the targets and write the bam file and truth set.
+
+    Args:
+        options (Namespace):    Simulation options from the command line.
+    Returns:
+        None
+    """
+
+    rng = random.Random(options.seed)
+    if not os.path.exists(options.out_dir):
+        os.makedirs(options.out_dir)
+    refFn, bedFn = options.reference_fasta, options.targets_bed
+    if refFn is None:
+        refFn, bedFn = make_synthetic_reference(options.out_dir, options.ntargets, options.target_len, options.target_spacing, rng)
+        print 'Wrote random reference %s and targets %s' % (refFn, bedFn)
+    reference = Reference(refFn)
+    targets = read_targets(bedFn)
+    if options.ntargets is not None:  # The first targets in the bed file order.
+        targets = targets[0:options.ntargets]
+    targets = sorted(targets, key=lambda x: (x[1], x[2]))
+    svTypes = options.sv_types.split(',')
+
+    tids = dict([(chrom, i) for i, (chrom, length) in enumerate(reference.lengths)])
+    header = {'HD': {'VN': '1.0', 'SO': 'unsorted'}, 'SQ': [{'SN': chrom, 'LN': length} for chrom, length in reference.lengths]}
+    unsortedFn = os.path.join(options.out_dir, 'sim.unsorted.bam')
+    bamOut = pysam.Samfile(unsortedFn, 'wb', header=header)
+    truthFile = open(os.path.join(options.out_dir, 'truth.tsv'), 'w')
+    truthFile.write('\t'.join(TRUTH_HEADER) + '\n')
+    targetsFile = open(os.path.join(options.out_dir, 'sim_targets.bed'), 'w')
+    npairsTotal = 0
+    for targetIdx, target in enumerate(targets):
+        name, chrom, start, end = target
+        targetsFile.write('\t'.join([chrom, str(start), str(end), name]) + '\n')
+        regionStart = max(0, start - options.flank)
+        regionEnd = min(reference.get_length(chrom), end + options.flank)
+        npairs = int(round(float(options.depth) * (regionEnd - regionStart) / (2 * options.read_len)))
+        refBlocks = [copy_block(reference, chrom, regionStart, regionEnd)]
+        haplotypes = [(refBlocks, npairs, name + '_ref')]
+        if rng.random() < options.sv_fraction and (end - start) > 2 * options.read_len:
+            svType = svTypes[targetIdx % len(svTypes)]
+            blocks, truth = make_event(rng, svType, target, reference, options)
+            altPairs = int(round(npairs * options.vaf))
+            haplotypes = [(refBlocks, npairs - altPairs, name + '_ref'), (blocks, altPairs, name + '_alt')]
+            truth['alt_pairs'] = altPairs
+            truthFile.write('\t'.join([str(truth[key]) for key in TRUTH_HEADER]) + '\n')
+        for blocks, hapPairs, namePrefix in haplotypes:
+            for read1, read2 in simulate_pairs(rng, blocks, hapPairs, namePrefix, options):
+                bamOut.write(make_aligned_read(read1, read2, True, tids, options))
+                bamOut.write(make_aligned_read(read2, read1, False, tids, options))
+                npairsTotal += 1
+        if (targetIdx + 1) % 100 == 0:
+            print 'Simulated %d of %d targets, %d read pairs' % (targetIdx + 1, len(targets), npairsTotal)
+    bamOut.close()
+    truthFile.close()
+    targetsFile.close()
+
+    bamFn = os.path.join(options.out_dir, 'sim.bam')
+    pysam.sort(unsortedFn, bamFn.replace('.bam', ''))
+    pysam.index(bamFn)
+    os.remove(unsortedFn)
+    simParams = vars(options).copy()
+    simParams.update({'reference_fasta': refFn, 'targets_bed': bedFn, 'ntargets': len(targets), 'read_pairs': npairsTotal})
+    paramsFile = open(os.path.join(options.out_dir, 'simulation.json'), 'w')
+    json.dump(simParams, paramsFile, indent=2, sort_keys=True)
+    paramsFile.close()
+    print 'Simulated %d read pairs for %d targets in %s' % (npairsTotal, len(targets), bamFn)
+
+
+def get_parser():
+    """Return the command line argument parser."""
+    parser = argparse.ArgumentParser(description='Simulate paired-end reads with structural variants in target regions.')
+    parser.add_argument('-o', '--out_dir', dest='out_dir', required=True, help='Output directory.')
+    parser.add_argument('-r', '--reference_fasta', dest='reference_fasta', default=None, help='Reference fasta file. A random reference is generated if not specified. [default: %(default)s]')
+    parser.add_argument('-b', '--targets_bed', dest='targets_bed', default=None, help='Targets bed file, required with --reference_fasta. [default: %(default)s]')
+    parser.add_argument('-t', '--ntargets', dest='ntargets', default=None, type=int, help='Number of targets to simulate, the first targets of the bed file or the number of random targets. [default: all targets]')
+    parser.add_argument('--target_len', dest='target_len', default=1000, type=int, help='Length of the random reference targets. [default: %(default)s]')
+    parser.add_argument('--target_spacing', dest='target_spacing', default=10000, type=int, help='Distance between the random reference targets. [default: %(default)s]')
+    parser.add_argument('-d', '--depth', dest='depth', default=500, type=int, help='Read depth. [default: %(default)s]')
+    parser.add_argument('--read_len', dest='read_len', default=100, type=int, help='Read length. [default: %(default)s]')
+    parser.add_argument('--insert_size', dest='insert_size', default=300, type=int, help='Mean fragment length. [default: %(default)s]')
+    parser.add_argument('--insert_sd', dest='insert_sd', default=30, type=int, help='Fragment length standard deviation. [default: %(default)s]')
+    parser.add_argument('--error_rate', dest='error_rate', default=0.001, type=float, help='Substitution error rate per base. [default: %(default)s]')
+    parser.add_argument('--flank', dest='flank', default=500, type=int, help='Bases simulated on each side of the targets. [default: %(default)s]')
+    parser.add_argument('--sv_types', dest='sv_types', default=','.join(SV_TYPES), help='Comma separated variant types to inject, assigned to the targets in turn. [default: %(default)s]')
+    parser.add_argument('--sv_fraction', dest='sv_fraction', default=0.5, type=float, help='Fraction of the targets with a variant. [default: %(default)s]')
+    parser.add_argument('--vaf', dest='vaf', default=0.5, type=float, help='Fraction of the read pairs from the variant haplotype. [default: %(default)s]')
+    parser.add_argument('--min_indel', dest='min_indel', default=5, type=int, help='Minimum indel size. [default: %(default)s]')
+    parser.add_argument('--max_indel', dest='max_indel', default=40, type=int, help='Maximum indel size, also the largest gap in the simulated alignments. [default: %(default)s]')
+    parser.add_argument('--min_anchor', dest='min_anchor', default=20, type=int, help='Minimum aligned bases for a read to be mapped. [default: %(default)s]')
+    parser.add_argument('-s', '--seed', dest='seed', default=1, type=int, help='Random seed. [default: %(default)s]')
+    return parser
+
+
+def main(argv):
+    options = get_parser().parse_args(argv)
+    if (options.reference_fasta is None) != (options.targets_bed is None):
+        print 'Both --reference_fasta and --targets_bed must be specified to use an existing reference.'
+        sys.exit(1)
+    if options.reference_fasta is None and options.ntargets is None:
+        print '--ntargets must be specified to simulate a random reference.'
+        sys.exit(1)
+    for svType in options.sv_types.split(','):
+        if svType not in SV_TYPES:
+            print 'Unknown variant type %s, choose from %s.' % (svType, ','.join(SV_TYPES))
+            sys.exit(1)
+    simulate(options)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,95 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""stub_aligner.py module
+
+This module stands in for the blat, gfClient, gfServer and faToTwoBit binaries in the
+scaling benchmarks, so that the scheduling and I/O of the pipeline can be measured
+without the real genome or a blat server. Each call waits for a set latency and then:
+    blat        Aligns the query fasta to the target fasta with kmer_aligner and writes
+                the PSL records to the output file.
+    gfClient    Writes an empty PSL output file, no genome alignments are reported.
+    gfServer    Writes 'Server ready for queries' to the -log file for start, exits for stop.
+    faToTwoBit  Writes an empty 2bit file.
+
+write_stubs() writes executable wrappers for the four programs that are set as the
+blat, gfclient, gfserver and fatotwobit binaries in the configuration file.
+
+Usage:
+    python -m breakmer.benchmark.stub_aligner <program> <latency_seconds> <program arguments>
+"""
+
+import os
+import sys
+import stat
+import time
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROGRAMS = {'blat': 'blat', 'gfClient': 'gfclient', 'gfServer': 'gfserver', 'faToTwoBit': 'fatotwobit'}  # Program names and their configuration keys.
+
+
+def write_stubs(binDir, latency):
+    """Write the stub program wrappers.
+
+    Args:
+        binDir (str):       Directory to write the wrappers to.
+        latency (float):    Seconds each call waits before returning.
+    Returns:
+        stubs (dict):   Paths to the wrappers keyed by configuration key.
+    """
+
+    if not os.path.exists(binDir):
+        os.makedirs(binDir)
+    stubs = {}
+    for program, configKey in PROGRAMS.items():
+        stubFn = os.path.join(binDir, program)
+        stubFile = open(stubFn, 'w')
+        stubFile.write('#!/bin/sh\n')
+        stubFile.write('PYTHONPATH=%s${PYTHONPATH:+:$PYTHONPATH} exec %s -m breakmer.benchmark.stub_aligner %s %f "$@"\n' % (REPO_DIR, sys.executable, program, latency))
+        stubFile.close()
+        os.chmod(stubFn, os.stat(stubFn).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        stubs[configKey] = stubFn
+    return stubs
+
+
+def get_positional(args):
+    """Return the arguments that are not options."""
+    return [arg for arg in args if not arg.startswith('-')]
+
+
+def run_stub(program, latency, args):
+    """Run a stub program.
+
+    Args:
+        program (str):      Program name.
+        latency (float):    Seconds to wait before returning.
+        args (list):        Program arguments.
+    Returns:
+        None
+    """
+
+    positional = get_positional(args)
+    if program == 'gfServer':
+        if len(positional) > 0 and positional[0] == 'start':
+            for arg in args:
+                if arg.startswith('-log='):
+                    logFile = open(arg.split('=', 1)[1], 'w')
+                    logFile.write('Server ready for queries!\n')
+                    logFile.close()
+        return
+    time.sleep(latency)
+    if program == 'blat':
+        import breakmer.realignment.kmer_aligner as kmer_aligner
+        refFn, queryFn, resultFn = positional[-3:]
+        kmer_aligner.align_fasta(refFn, queryFn, resultFn)
+    elif program in ('gfClient', 'faToTwoBit'):
+        open(positional[-1], 'w').close()
+
+
+if __name__ == '__main__':
+    run_stub(sys.argv[1], float(sys.argv[2]), sys.argv[3:])
@@ -476,12 +476,14 @@ class SVBreakpoints:
             left_idx = qb[0] - min(qb[1], 5)
             right_idx = qb[0] + min(qb[2], 5)
             bc = contigCountTracker.get_counts(left_idx, right_idx, svType)
-            self.counts['n'].append(min(bc))
-            self.counts['d'].append(min(contigCountTracker.get_counts((qb[0] - 1), (qb[0] + 1), svType)))
+            self.counts['n'].append(int(bc.min()))
+            self.counts['d'].append(int(contigCountTracker.get_counts((qb[0] - 1), (qb[0] + 1), svType).min()))
             self.counts['b'].append(contigCountTracker.get_counts(qb[0], qb[0], svType))
             self.kmers.append(contig.get_kmer_locs()[qb[0]])
-            utils.log(self.loggingName, 'debug', 'Read count around breakpoint %d : %s' % (qb[0], ",".join([str(x) for x in bc])))
-        utils.log(self.loggingName, 'debug', 'Kmer count around breakpoints %s' % (",".join([str(x) for x in self.kmers])))
+            if utils.log_enabled(self.loggingName, 'debug'):
+                utils.log(self.loggingName, 'debug', 'Read count around breakpoint %d : %s', qb[0], ",".join([str(x) for x in bc]))
+        if utils.log_enabled(self.loggingName, 'debug'):
+            utils.log(self.loggingName, 'debug', 'Kmer count around breakpoints %s', ",".join([str(x) for x in self.kmers]))
 
 
 class SVEvent:
@@ -664,7 +666,7 @@ class SVEvent:
     def which_rearr(self, varReads, tcoords, qcoords, strands, brkpts):
         rearrValues = {'discReadCount': None, 'svType': 'rearrangement', 'svSubType': None, 'hit': False}
         if not self.check_overlap(tcoords[0], tcoords[1]):
-            utils.log(self.loggingName, 'debug', 'Checking rearrangement svType, strand1 %s, strand2 %s, breakpt1 %d, breakpt %d' % (strands[0], strands[1], brkpts[0], brkpts[1]))
+            utils.log(self.loggingName, 'debug', 'Checking rearrangement svType, strand1 %s, strand2 %s, breakpt1 %d, breakpt %d', strands[0], strands[1], brkpts[0], brkpts[1])
             if (strands[0] != strands[1]): # and (brkpts[0] < brkpts[1]):
                 # Inversion
                 # Get discordantly mapped read-pairs
@@ -766,8 +768,9 @@ class SVEvent:
             strands.append(strand)
         if len(set(strands)) == 1:
             same_strand = True
-        utils.log(self.loggingName, 'debug', 'Checking read strands for contig reads %s' % (",".join([read.id for read in self.contig.reads])))
-        utils.log(self.loggingName, 'debug', 'Reads are on same strand: %r' % same_strand)
+        if utils.log_enabled(self.loggingName, 'debug'):
+            utils.log(self.loggingName, 'debug', 'Checking read strands for contig reads %s', ",".join([read.id for read in self.contig.reads]))
+        utils.log(self.loggingName, 'debug', 'Reads are on same strand: %r', same_strand)
         return len(set(strands))
 
     def get_seq_complexity(self):
@@ -776,13 +779,13 @@ class SVEvent:
         blatResult, nBasesAligned = self.blatResultsSorted[0]
         alignedSeq = self.contig.seq[blatResult.qstart():blatResult.qend()]
         merSize = 3
-        utils.log(self.loggingName, 'debug', 'Checking sequence complexity of blat result segment %s using %d-mers' % (alignedSeq, merSize))
+        utils.log(self.loggingName, 'debug', 'Checking sequence complexity of blat result segment %s using %d-mers', alignedSeq, merSize)
         nmers = {}
         totalMersPossible = len(alignedSeq) - 2
         for i in range(len(alignedSeq) - (merSize - 1)):
             nmers[str(alignedSeq[i:i + merSize]).upper()] = True
         complexity = round((float(len(nmers)) / float(totalMersPossible)) * 100, 4)
-        utils.log(self.loggingName, 'debug', 'Complexity measure %f, based on %d unique %d-mers observed out of a total of %d %d-mers possible' % (complexity, len(nmers), merSize, totalMersPossible, merSize))
+        utils.log(self.loggingName, 'debug', 'Complexity measure %f, based on %d unique %d-mers observed out of a total of %d %d-mers possible', complexity, len(nmers), merSize, totalMersPossible, merSize)
         return complexity
 
     def get_startend_missing_query_coverage(self):
@@ -801,7 +804,7 @@ class SVEvent:
             else:
                 break
         percentMissing = round((float(missingCov) / float(len(self.contig.seq))) * 100, 4)
-        utils.log(self.loggingName, 'debug', 'Calculated %f missing coverage of blat query sequence at beginning and end' % percentMissing)
+        utils.log(self.loggingName, 'debug', 'Calculated %f missing coverage of blat query sequence at beginning and end', percentMissing)
         return percentMissing
 
     def is_filtered(self):
@@ -856,7 +859,7 @@ class ContigCaller:
                 self.svEvent = SVEvent(blatResult, self.contig, 'indel')
                 return hasIndel
             else:
-                utils.log(self.loggingName, 'debug', 'Storing clipped blat result start %d, end %d' % (blatResult.qstart(), blatResult.qend()))
+                utils.log(self.loggingName, 'debug', 'Storing clipped blat result start %d, end %d', blatResult.qstart(), blatResult.qend())
                 self.clippedQs.append((blatResult.qstart(), blatResult.qend(), blatResult, i))
         utils.log(self.loggingName, 'info', 'Contig does not have indel, return %r' % hasIndel)
         return hasIndel
@@ -866,11 +869,11 @@ class ContigCaller:
         utils.log(self.loggingName, 'info', 'Checking for SVs')
         gaps = [(0, self.realignment.get_qsize())]
         if len(self.clippedQs) > 1:
-            utils.log(self.loggingName, 'debug', 'Iterating through %d clipped blat results.' % len(self.clippedQs))
+            utils.log(self.loggingName, 'debug', 'Iterating through %d clipped blat results.', len(self.clippedQs))
             mergedClip = [0, None]
             for i, clippedQs in enumerate(self.clippedQs):
                 qs, qe, blatResult, idx = clippedQs
-                utils.log(self.loggingName, 'debug', 'Blat result with start %d, end %d, chrom %s' % (qs, qe, blatResult.get_seq_name('ref')))
+                utils.log(self.loggingName, 'debug', 'Blat result with start %d, end %d, chrom %s', qs, qe, blatResult.get_seq_name('ref'))
                 gaps = self.iter_gaps(gaps, self.clippedQs[i], i)
                 if self.svEvent.qlen > mergedClip[0]:
                     mergedClip = [self.svEvent.qlen, self.svEvent]
@@ -888,9 +891,10 @@ class ContigCaller:
         new_gaps = []
         qs, qe, blatResult, idx = clippedQuerySeqVals
         hit = False
+        logDebug = utils.log_enabled(self.loggingName, 'debug')
         for gap in gaps:
             gs, ge = gap
-            utils.log(self.loggingName, 'debug', 'Gap coords %d, %d' % (gs, ge))
+            utils.log(self.loggingName, 'debug', 'Gap coords %d, %d', gs, ge)
             startWithinGap = (qs >= gs and qs <= ge)
             endWithinGap = (qe <= ge and qe >= gs)
             gapEdgeDistStart = (qs <= gs) and ((gs - qs) < 15)
@@ -904,7 +908,7 @@ class ContigCaller:
                     if (ge - qe + 1) > 10:
                         ngap.append((qe + 1, ge))
                 if iterIdx == 0:
-                    utils.log(self.loggingName, 'debug', 'Creating SV event from blat result with start %d, end %d' % (qs, qe))
+                    utils.log(self.loggingName, 'debug', 'Creating SV event from blat result with start %d, end %d', qs, qe)
                     self.svEvent = SVEvent(blatResult, self.contig, 'rearrangement')
                     new_gaps.extend(ngap)
                     hit = True
@@ -917,14 +921,15 @@ class ContigCaller:
                     new_gaps.append(gap)
             else:
                 new_gaps.append(gap)
-            utils.log(self.loggingName, 'debug', 'New gap coords %s' % (",".join([str(x) for x in new_gaps])))
+            if logDebug:
+                utils.log(self.loggingName, 'debug', 'New gap coords %s', ",".join([str(x) for x in new_gaps]))
         if not hit:
             self.svEvent.check_previous_add(blatResult)
         return new_gaps
 
     def check_add_br(self, qs, qe, gs, ge, blatResult):
         """ """
-        utils.log(self.loggingName, 'info', 'Checking to add blat result with start %d, end %d' % (qs, qe))
+        utils.log(self.loggingName, 'info', 'Checking to add blat result with start %d, end %d', qs, qe)
         add = False
         # Calc % of segment overlaps with gap
         over_perc = round((float(min(qe, ge) - max(qs, gs)) / float(qe - qs)) * 100)
@@ -937,10 +942,10 @@ class ContigCaller:
             ov_left = abs(qs - gs)
         blatResult.set_segment_overlap(ov_left, ov_right)
         max_seg_overlap = max(ov_right, ov_left)
-        utils.log(self.loggingName, 'debug', 'Blat query segment overlaps gap by %f' % over_perc)
-        utils.log(self.loggingName, 'debug', 'Max segment overlap %f' % max_seg_overlap)
-        utils.log(self.loggingName, 'debug', 'Event in target %r and blat result in target %r' % (self.svEvent.in_target, blatResult.in_target))
+        utils.log(self.loggingName, 'debug', 'Blat query segment overlaps gap by %f', over_perc)
+        utils.log(self.loggingName, 'debug', 'Max segment overlap %f', max_seg_overlap)
+        utils.log(self.loggingName, 'debug', 'Event in target %r and blat result in target %r', self.svEvent.in_target, blatResult.in_target)
         if over_perc >= 50 and (max_seg_overlap < 15 or (blatResult.in_target and self.svEvent.in_target)):
             add = True
-        utils.log(self.loggingName, 'debug', 'Add blat result to SV event %r' % add)
+        utils.log(self.loggingName, 'debug', 'Add blat result to SV event %r', add)
         return add
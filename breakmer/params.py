@@ -3,14 +3,21 @@
 
 import os
 import sys
+import copy
+import argparse
 import logging
 import random
+import multiprocessing
 import subprocess
 import time
 import pysam
 import shutil
+import tempfile
 import breakmer.utils as utils
 import breakmer.caller.filter as resultfilter
+import breakmer.processor.pon as pon
+import breakmer.processor.genome_filter as genome_filter
+import breakmer.processor.shard as shard
 
 __author__ = "Ryan Abo"
 __copyright__ = "Copyright 2015, Ryan Abo"
@@ -18,6 +25,85 @@ __email__ = "ryanabo@gmail.com"
 __license__ = "MIT"
 
 
+# Analysis options shared by the run and serve functions of breakmer.py and the api module.
+ANALYSIS_PARSER = argparse.ArgumentParser(add_help=False)
+ANALYSIS_PARSER.add_argument('--log_level', dest='log_level', default='INFO', type=str.upper, choices=['DEBUG', 'INFO', 'ERROR'], help='Log level [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--log_module_levels', dest='log_module_levels', default=None, help='Comma separated module log levels overriding --log_level, i.e. assembly=DEBUG,caller.sv_caller=DEBUG. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--indel_size', dest='indel_size', default=15, type=int, help='Indel size filter. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--trl_sr_thresh', dest='trl_sr_thresh', default=2, type=int, help='Split read support threshold for translocations. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--indel_sr_thresh', dest='indel_sr_thresh', default=5, type=int, help='Split read support threshold for indels. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--rearr_sr_thresh', dest='rearr_sr_thresh', default=2, type=int, help='Split read support threshold for rearrangements. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--rearr_min_seg_len', dest='rearr_minseg_len', default=30, type=int, help='Threshold for minimum segment to be rearranged. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--trl_min_seg_len', dest='trl_minseg_len', default=25, type=int, help='Threshold for minimum length of translocation segment. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--align_thresh', dest='align_thresh', default=.90, type=int, help='Threshold for minimum read alignment for assembly. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--no_output_header', dest='no_output_header', default=False, action='store_true', help='Suppress output headers. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--discread_only_thresh', dest='discread_only_thresh', default=2, type=int, help='The number of discordant read pairs in a cluster to output without evidence from a split read event. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--generate_image', dest='generate_image', default=False, action='store_true', help='Generate pileup image for events. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--image_read_sample', dest='image_read_sample', default=50, type=int, help='The maximum number of reads sampled for each pileup image. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--hostname', dest='blat_hostname', default='localhost', help='The hostname for the blat server. Localhost will be used if not specified. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('-g', '--gene_list', dest='gene_list', default=None, help='Gene list to consider for analysis. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('-f', '--filter_list', dest='filterList', default=None, help='Input a set of events to filter out. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('-n', '--nprocessors', dest='nprocs', default=1, type=int, help='The number of processors to use for analysis. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('-s', '--start_blat_server', dest='start_blat_server', default=False, action='store_true', help='Start the blat server. Random port number and localhost will be used if neither specified. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('-k', '--keep_blat_server', dest='keep_blat_server', default=False, action='store_true', help='Keep the blat server alive. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('-p', '--port_number', dest='blat_port', default=None, type=int, help='The port number for the blat server. A random port number (8000-9500) will be used if not specified. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--cutadapt_cores', dest='cutadapt_cores', default=None, type=int, help='The number of cores for each cutadapt run when adapter_trimmer=cutadapt_batch is set in the configuration file. The available cores divided by the number of processors will be used if not specified. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--pon_min_samples', dest='pon_min_samples', default=None, type=int, help='Remove sample-only kmers found in at least this many samples of the panel of normals in pon_dir. The value used to build the panel of normals is used if not specified. Values lower than the build value have no effect since the panel of normals only stores the kmers found in at least that many samples. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--contig_threads', dest='contig_threads', default=1, type=int, help='The number of threads used to realign and call the contigs of a target, per processor. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--profile_targets', dest='profile_targets', default=None, help='Comma separated list of target names to profile with cProfile, or all. The profiles are written to <targets_dir>/<target>/profile/ and merged in the output directory. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--profile_slowest', dest='profile_slowest', default=None, type=int, help='Profile all the targets and keep the profiles of this number of slowest targets. [default: %(default)s]')
+ANALYSIS_PARSER.add_argument('--profile_memory', dest='profile_memory', default=False, action='store_true', help='Write the largest memory allocation sites of the profiled targets, using tracemalloc if it is available. [default: %(default)s]')
+
+SERVER_OPTIONS = ('log_level', 'log_module_levels', 'nprocs', 'start_blat_server', 'keep_blat_server', 'blat_port', 'blat_hostname', 'cutadapt_cores')  # Analysis options set once for all the jobs of a server.
+SAMPLE_PARAMS = {'normal_bam_file': str, 'insertsize_thresh': float, 'readLen': int}  # Sample parameters that can be set for a job, with their types.
+FILE_PARAMS = ('normal_bam_file', 'gene_list', 'filterList')  # Parameters that are paths to input files.
+
+
+def check_overrides(overrides):
+    """Check the parameters set for a sample job and convert them to the types of the
+    analysis options, as they are converted from the command line.
+
+    The parameters are the analysis options of ANALYSIS_PARSER, keyed by their parameter
+    name (i.e. indel_sr_thresh, filterList), except the options set once for the server
+    (SERVER_OPTIONS), and the sample parameters normal_bam_file, insertsize_thresh and readLen.
+
+    Args:
+        overrides (dict):   Parameters set for the job.
+    Returns:
+        checked (dict):     Parameters converted to the option types, the file paths made absolute.
+    Raises:
+        ValueError if a parameter is not known, has a value of the wrong type or a file does not exist.
+    """
+
+    actions = dict([(action.dest, action) for action in ANALYSIS_PARSER._actions if action.dest not in SERVER_OPTIONS])
+    checked = {}
+    for key, value in overrides.items():
+        if key in SAMPLE_PARAMS:
+            valueType, choices, isFlag = SAMPLE_PARAMS[key], None, False
+        elif key in actions:
+            valueType, choices, isFlag = actions[key].type or str, actions[key].choices, actions[key].nargs == 0
+        else:
+            raise ValueError('Unknown parameter %s in the job overrides, choose from %s.' % (key, ','.join(sorted(actions.keys() + SAMPLE_PARAMS.keys()))))
+        if isFlag:
+            if not isinstance(value, bool):
+                raise ValueError('Parameter %s must be true or false, not %r.' % (key, value))
+        elif isinstance(value, bool) or not isinstance(value, (basestring, int, long, float)):
+            raise ValueError('Parameter %s has a value of type %s, not a %s.' % (key, type(value).__name__, valueType.__name__))
+        else:
+            try:
+                value = valueType(str(value))
+            except ValueError:
+                raise ValueError('Parameter %s value %r is not a valid %s.' % (key, value, valueType.__name__))
+            if choices and value not in choices:
+                raise ValueError('Parameter %s value %r is not one of %s.' % (key, value, ','.join(choices)))
+        if key in FILE_PARAMS:
+            value = os.path.abspath(value)
+            if not os.path.isfile(value):
+                raise ValueError('File %s set for parameter %s does not exist.' % (value, key))
+        checked[key] = value
+    return checked
+
+
 class ParamManager:
     """ParamManager class stores all the input specifications provided to the program to run. These include
     file paths, thresholds, directories, etc...
@@ -64,7 +150,15 @@ class ParamManager:
         """
 
         self.parse_opts(arguments)  # Parse the config file and command line parameters into the self.opts dictionary.
-        utils.setup_logger(self.get_param('analysis_dir', True), 'breakmer')  # Create logging object.
+        logPath = self.get_param('analysis_dir', True)
+        if self.get_param('shard'):  # Each shard writes its log and outputs to <analysis_dir>/shards/shard_<i>_of_<N>.
+            try:
+                logPath = os.path.join(logPath, 'shards', shard.get_shard_name(self.get_param('shard')))
+            except ValueError as e:
+                print e
+                sys.exit(1)
+        if self.fncCmd != 'api':  # The api module logs with the logging configuration of the calling program.
+            utils.setup_logger(logPath, 'breakmer', self.get_param('log_level') or 'INFO', self.get_param('log_module_levels'))  # Create logging object.
         utils.log(self.loggingName, 'info', 'Setting up parameters')
 
         # Log all parameters passed in, warn for poor paths
@@ -81,13 +175,132 @@ class ParamManager:
             utils.log(self.loggingName, 'info', 'Preset reference data option set! Only the reference data directory will be setup.')
             return
 
-        # Setup directories
+        self.set_analysis_paths()  # Setup directories
+
+        # If starting the blat server then return.
+        if self.fncCmd == 'start_blat_server':
+            utils.log(self.loggingName, 'info', 'Starting the blat server.')
+            return
+
+        if self.fncCmd == 'merge':
+            utils.log(self.loggingName, 'info', 'Merging the shard outputs.')
+            return
+
+        if self.fncCmd == 'build_pon':
+            self.set_pon_params()
+        elif self.fncCmd in ('run', 'serve', 'api') and self.get_param('pon_dir'):
+            self.check_pon()
+        if self.fncCmd in ('run', 'serve', 'api') and self.get_param('genome_kmer_filter'):
+            self.check_genome_filter()
+
+        self.check_binaries()  # Check if Jellyfish and Cutadapt work.
+        if self.get_param('adapter_trimmer') == 'cutadapt_batch' and self.get_param('cutadapt_cores') is None:
+            # Share the available cores among the processors that run cutadapt in batch.
+            self.set_param('cutadapt_cores', max(1, multiprocessing.cpu_count() / int(self.get_param('nprocs'))))
+        self.filter = resultfilter.ResultFilter(self.get_param('filterList'), self)  # Instantiate the filter class.
+        if self.fncCmd in ('serve', 'api') or self.get_param('samples'):  # The insert size threshold is set for each sample.
+            return
+        self.set_insertsize_thresh()  # Set the expected insert size threshold from the properly mapped read pairs.
+
+    def get_sample_params(self, analysisName, bamFn, analysisDir, overrides=None):
+        """Return the parameters to analyze a sample with the targets and settings of these
+        parameters, for the samples of a run with a samples manifest and the serve jobs.
+        The insert size threshold is estimated from the sample bam file unless it is set
+        in the overrides.
+
+        Args:
+            analysisName (str): Analysis name of the sample.
+            bamFn (str):        Sample bam file.
+            analysisDir (str):  Analysis directory of the sample.
+            overrides (dict):   Parameters set for the sample.
+        Returns:
+            sampleParams (ParamManager): Parameters of the sample analysis.
+        """
+
+        overrides = overrides or {}
+        sampleParams = copy.copy(self)
+        sampleParams.fncCmd = 'run'
+        sampleParams.opts = dict(self.opts)
+        sampleParams.paths = dict(self.paths)
+        for key in ('targets_dir', 'samples'):  # Each sample has its own targets directory in its analysis directory.
+            sampleParams.opts.pop(key, None)
+        for key, value in overrides.items():
+            sampleParams.set_param(key, value)
+        sampleParams.set_param('sample_bam_file', bamFn)
+        sampleParams.set_param('analysis_name', analysisName)
+        sampleParams.set_param('analysis_dir', analysisDir)
+        sampleParams.set_analysis_paths()
+        if 'gene_list' in overrides:
+            sampleParams.targets = {}
+            sampleParams.set_targets()
+        if 'filterList' in overrides:
+            sampleParams.filter = resultfilter.ResultFilter(sampleParams.get_param('filterList'), sampleParams)
+        if 'insertsize_thresh' not in overrides or 'readLen' not in overrides:
+            sampleParams.set_insertsize_thresh()
+            for key in ('insertsize_thresh', 'readLen'):
+                if key in overrides:
+                    sampleParams.set_param(key, overrides[key])
+        return sampleParams
+
+    def get_samples(self):
+        """Parse the samples manifest file set with the samples parameter. Each line is tab-delimited
+        with the sample name, the sample bam file and, optionally, the normal bam file of the sample.
+        Empty lines and lines starting with # are skipped.
+
+        Args:
+            None
+        Returns:
+            samples (list): List of (sample name, bam file, parameter overrides) tuples in manifest order.
+        """
+
+        samples = []
+        errors = []
+        for line in open(self.get_param('samples'), 'rU'):
+            if not line.strip() or line.startswith('#'):
+                continue
+            values = line.rstrip('\r\n').split('\t')
+            if len(values) < 2 or len(values) > 3:
+                errors.append('Samples manifest line is not formatted as name<tab>bam[<tab>normal bam]: %s' % line.strip())
+                continue
+            sampleName, bamFn = values[0].strip(), os.path.abspath(values[1].strip())
+            overrides = {}
+            if len(values) == 3 and values[2].strip():
+                overrides['normal_bam_file'] = os.path.abspath(values[2].strip())
+            for fn in [bamFn] + overrides.values():
+                if not os.path.isfile(fn):
+                    errors.append('Bam file %s of sample %s does not exist.' % (fn, sampleName))
+            if not sampleName or os.sep in sampleName:
+                errors.append('Sample name %s is not a valid directory name.' % sampleName)
+            if sampleName in [x[0] for x in samples]:
+                errors.append('Sample %s is listed more than once.' % sampleName)
+            samples.append((sampleName, bamFn, overrides))
+        if len(samples) == 0:
+            errors.append('No samples listed in %s.' % self.get_param('samples'))
+        if errors:
+            for error in errors:
+                utils.log(self.loggingName, 'error', error)
+            print 'Samples manifest %s is not valid:\n%s' % (self.get_param('samples'), '\n'.join(errors))
+            sys.exit(1)
+        return samples
+
+    def set_analysis_paths(self):
+        """Set the analysis, output and targets directory paths from the analysis_dir and
+        targets_dir parameters and create them.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+
         self.paths['analysis'] = os.path.abspath(os.path.normpath(self.opts['analysis_dir']))
         self.paths['output'] = os.path.join(self.paths['analysis'], 'output')
         if 'targets_dir' in self.opts:
             self.paths['targets'] = os.path.abspath(os.path.normpath(self.opts['targets_dir']))
         else:
             self.paths['targets'] = os.path.join(self.paths['analysis'], 'targets')
+        if self.get_param('shard'):  # The shard outputs are written with its log file.
+            self.paths['output'] = os.path.join(self.paths['analysis'], 'shards', shard.get_shard_name(self.get_param('shard')))
 
         # Create all the paths.
         for path in self.paths:
@@ -95,15 +308,6 @@ class ParamManager:
             if not os.path.exists(self.paths[path]):
                 os.makedirs(self.paths[path])
 
-        # If starting the blat server then return.
-        if self.fncCmd == 'start_blat_server':
-            utils.log(self.loggingName, 'info', 'Starting the blat server.')
-            return
-
-        self.check_binaries()  # Check if Jellyfish and Cutadapt work.
-        self.filter = resultfilter.ResultFilter(self.get_param('filterList'), self)  # Instantiate the filter class.
-        self.set_insertsize_thresh()  # Set the expected insert size threshold from the properly mapped read pairs.
-
     def parse_opts(self, arguments):
         """Formats input parameters into self.opts dictionary. It first parses the configuration file and stores the key, values in the self.opts dictionary.
         It will exit with an error if the configuration file does not have lines in the proper format (i.e., key=value).
@@ -166,10 +370,105 @@ class ParamManager:
                     'gene_annotation_file']
         if self.fncCmd == 'prepare_reference_data':
             required = ['reference_data_dir', 'reference_fasta', 'targets_bed_file']
+        elif self.fncCmd == 'merge':
+            required = ['analysis_name', 'targets_bed_file', 'analysis_dir', 'reference_data_dir', 'reference_fasta']
+        elif self.fncCmd == 'serve' or self.get_param('samples'):  # The sample bam files are set by the jobs or the samples manifest.
+            required.remove('sample_bam_file')
+        elif self.fncCmd == 'api':  # The sample is set for each target analysis.
+            required.remove('sample_bam_file')
+            required.remove('analysis_name')
+        elif self.fncCmd == 'build_pon':
+            required = ['analysis_name',
+                        'targets_bed_file',
+                        'analysis_dir',
+                        'reference_data_dir',
+                        'cutadapt_config_file',
+                        'reference_fasta',
+                        'pon_dir',
+                        'pon_bam_list']
 
         for req in required:
             self.get_param(req, True)
 
+    def set_pon_params(self):
+        """Set the parameters to build the panel of normals database. The first normal
+        sample bam file is used to determine the insert size threshold and read length.
+        Batch cleaning is not used since the samples are processed one at a time.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+
+        if self.get_kmer_size() > pon.MAX_KMER_SIZE:
+            utils.log(self.loggingName, 'error', 'The kmer size %d is larger than %d, the largest kmer size of a panel of normals. Exiting.' % (self.get_kmer_size(), pon.MAX_KMER_SIZE))
+            sys.exit(1)
+        bamFns = pon.get_bam_list(self)
+        if len(bamFns) == 0:
+            utils.log(self.loggingName, 'error', 'No bam files listed in the panel of normals bam list %s. Exiting.' % self.get_param('pon_bam_list'))
+            sys.exit(1)
+        self.set_param('sample_bam_file', bamFns[0])
+        if self.get_param('pon_min_samples') is None:
+            self.set_param('pon_min_samples', 2)
+        if self.get_param('adapter_trimmer') == 'cutadapt_batch':
+            self.set_param('adapter_trimmer', 'cutadapt')
+        if not os.path.exists(self.get_param('pon_dir')):
+            os.makedirs(self.get_param('pon_dir'))
+        utils.log(self.loggingName, 'info', 'Building panel of normals in %s from %d samples with a minimum of %d samples per kmer.' % (self.get_param('pon_dir'), len(bamFns), int(self.get_param('pon_min_samples'))))
+
+    def check_pon(self):
+        """Check the panel of normals database manifest matches the analysis kmer size and
+        set the minimum number of samples to the value used to build it, if not specified.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+
+        if self.get_kmer_size() > pon.MAX_KMER_SIZE:
+            utils.log(self.loggingName, 'error', 'The kmer size %d is larger than %d, the largest kmer size of a panel of normals. Exiting.' % (self.get_kmer_size(), pon.MAX_KMER_SIZE))
+            sys.exit(1)
+        manifest = pon.read_manifest(self.get_param('pon_dir'))
+        if manifest is None:
+            utils.log(self.loggingName, 'error', 'Panel of normals manifest not found in %s. Exiting.' % self.get_param('pon_dir'))
+            sys.exit(1)
+        if int(manifest['kmer_size']) != self.get_kmer_size():
+            utils.log(self.loggingName, 'error', 'Panel of normals kmer size %d does not match the kmer size %d. Exiting.' % (int(manifest['kmer_size']), self.get_kmer_size()))
+            sys.exit(1)
+        if self.get_param('pon_min_samples') is None:
+            self.set_param('pon_min_samples', manifest['min_samples'])
+        elif int(self.get_param('pon_min_samples')) < int(manifest['min_samples']):
+            utils.log(self.loggingName, 'warning', 'pon_min_samples %d is lower than the value %d used to build the panel of normals, which only stores the kmers found in at least %d samples.' % (int(self.get_param('pon_min_samples')), int(manifest['min_samples']), int(manifest['min_samples'])))
+        utils.log(self.loggingName, 'info', 'Removing sample-only kmers found in at least %d samples of the panel of normals %s' % (int(self.get_param('pon_min_samples')), self.get_param('pon_dir')))
+
+    def check_genome_filter(self):
+        """Check the genome kmer filter mode and that the filter built by prepare_reference_data
+        exists for the reference fasta and the analysis kmer size.
+
+        The drop mode, removing the genome kmers before the assembly, is not supported: it
+        removes the kmers on the partner side of translocation junctions.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+
+        if self.get_param('genome_kmer_filter') == 'drop':
+            utils.log(self.loggingName, 'error', 'genome_kmer_filter=drop is not supported, the genome kmers include the kmers on the partner side of translocation junctions, use flag. Exiting.')
+            sys.exit(1)
+        if self.get_param('genome_kmer_filter') != 'flag':
+            utils.log(self.loggingName, 'error', 'genome_kmer_filter must be flag, not %s. Exiting.' % self.get_param('genome_kmer_filter'))
+            sys.exit(1)
+        filterFn = genome_filter.get_filter_fn(self)
+        report = genome_filter.read_report(filterFn)
+        if report is None or report['reference_key'] != utils.get_binary_key(self.get_param('reference_fasta')):
+            utils.log(self.loggingName, 'error', 'Genome kmer filter %s not found for the reference fasta %s, run prepare_reference_data with genome_kmer_filter set. Exiting.' % (filterFn, self.get_param('reference_fasta')))
+            sys.exit(1)
+        utils.log(self.loggingName, 'info', 'Using genome kmer filter %s to flag sample-only kmers, estimated false positive rate %f' % (filterFn, report['fpr']))
+
     def check_binaries(self):
         """Check the required binaries.
         There are six required binaries to perform the complete analysis (blat, gfserver,
@@ -178,6 +477,14 @@ class ParamManager:
         if no path was provided that the binary is on the path. Cutadapt and Jellyfish
         are also tested using small set of hardcoded data.
 
+        The test results and the tool versions are cached in the reference data directory
+        (<reference_data_dir>/.binary_check_cache), one entry per binary name and one per set
+        of tested binaries, holding the key of the binary path, modification time and size it
+        was checked for. The Cutadapt and Jellyfish tests are only re-run when one of these keys
+        (or the cutadapt configuration file) changes, and the entry is then replaced so the
+        cache does not grow with each upgrade. The resolved versions are stored in the
+        opts dictionary as 'cutadapt_version' and 'jellyfish_version'.
+
         Args:
             None
         Returns:
@@ -186,19 +493,22 @@ class ParamManager:
             None
         """
 
-        binaries = ('blat', 
-                    'gfserver', 
-                    'gfclient', 
-                    'fatotwobit', 
-                    'cutadapt', 
-                    'jellyfish')
+        binaries = ['blat',
+                    'gfserver',
+                    'gfclient',
+                    'fatotwobit',
+                    'cutadapt',
+                    'jellyfish']
+        useCutadapt = self.get_param('adapter_trimmer') != 'internal'
+        if not useCutadapt:  # Reads are cleaned in-process, cutadapt is not required.
+            binaries.remove('cutadapt')
         for binaryName in binaries:
             binaryPath = self.get_param(binaryName)
             if binaryPath is not None:
                 binaryCheck = utils.which(binaryPath)  # Use the binary path specified in the config file.
             else:
                 binaryCheck = utils.which(binaryName)  # Perform a which on the server to see if the binary is in the path.
-                self.set_param(binary, binaryCheck)  # Store the result in the opts dictionary.
+                self.set_param(binaryName, binaryCheck)  # Store the result in the opts dictionary.
             if not binaryCheck:  # No binary found or specified. Throw an error.
                 print 'Missing path/executable for', binaryName
                 utils.log(self.loggingName, 'error', 'Missing path/executable for %s' % binaryName)
@@ -206,29 +516,87 @@ class ParamManager:
             utils.log(self.loggingName, 'info', '%s path = %s' % (binaryName, binaryCheck))
         utils.log(self.loggingName, 'info', 'All the required binaries have been checked successfully!')
 
-        # Test cutadapt and jellyfish binaries
-        testDir = os.path.join(self.paths['analysis'], 'bin_test')
-        testFq = os.path.join(testDir, 'test.fq')
-        if not os.path.exists(testDir):
-            os.makedirs(testDir)
+        # Check the cache for previous test results of the same cutadapt and jellyfish installs.
+        cacheFn = os.path.join(self.paths['ref_data'], '.binary_check_cache')
+        cache = utils.load_binary_cache(cacheFn)
+        testBinaries = [binaryName for binaryName in ('cutadapt', 'jellyfish') if binaryName in binaries]
+        binaryKeys = [(binaryName, utils.get_binary_key(self.get_param(binaryName))) for binaryName in testBinaries]
+        testKey = ';'.join([binaryKey for binaryName, binaryKey in binaryKeys] + [str(utils.get_binary_key(self.get_param('cutadapt_config_file')))])
+        cacheUpdated = False
+
+        for key in ('versions', 'tests'):  # Cache entries are dictionaries keyed by binary name, drop the entries of older caches.
+            if not isinstance(cache.get(key), dict):
+                cache[key] = {}
+        cache['versions'] = dict([(binaryName, entry) for binaryName, entry in cache['versions'].items() if isinstance(entry, dict)])
+        for binaryName, binaryKey in binaryKeys:
+            versionEntry = cache['versions'].get(binaryName)
+            if not isinstance(versionEntry, dict) or versionEntry.get('key') != binaryKey:
+                if binaryName == 'cutadapt':
+                    version = utils.get_cutadapt_version(self.get_param('cutadapt'))
+                else:
+                    version = utils.get_jellyfish_version(self.get_param('jellyfish'))
+                cache['versions'][binaryName] = {'key': binaryKey, 'version': version}
+                cacheUpdated = True
+            self.set_param('%s_version' % binaryName, cache['versions'][binaryName]['version'])
+            utils.log(self.loggingName, 'info', '%s version = %s' % (binaryName, self.get_param('%s_version' % binaryName)))
+
+        testName = ','.join(testBinaries)
+        if cache['tests'].get(testName) == testKey:
+            utils.log(self.loggingName, 'info', 'Binary tests previously passed for %s (%s), skipping tests.' % (', '.join(testBinaries), cacheFn))
+        else:
+            self.test_binaries(useCutadapt)
+            cache['tests'][testName] = testKey
+            cacheUpdated = True
+
+        if cacheUpdated:
+            utils.write_binary_cache(cacheFn, cache)
+
+    def test_binaries(self, useCutadapt=True):
+        """Test cutadapt and jellyfish binaries on a small set of hardcoded data.
+
+        The program exits with an error if either of the binaries fail to run. The test
+        files are written to a new bin_test_* directory, removed after the test, so that
+        the shards of a run started together do not remove each other's test files.
+
+        Args:
+            useCutadapt (boolean):  Run cutadapt on the test data before jellyfish. If False,
+                                    jellyfish is run directly on the test data.
+        Returns:
+            None
+        Raises:
+            None
+        """
 
+        testDir = tempfile.mkdtemp(prefix='bin_test_', dir=self.paths['analysis'])
+        try:
+            self.run_binary_tests(testDir, useCutadapt)
+        finally:
+            shutil.rmtree(testDir, ignore_errors=True)  # Remove the test directory.
+
+    def run_binary_tests(self, testDir, useCutadapt):
+        """Run the cutadapt and jellyfish tests of test_binaries in a test directory."""
+
+        testFq = os.path.join(testDir, 'test.fq')
         fqFile = open(testFq, 'w')
         fqFile.write("@H91H9ADXX140327:1:2102:19465:23489/2\nCACCCCCACTGAAAAAGATGAGTATGCCTGCCGTGTGAACCATGTGACTTTACAATCTGCATATTGGGATTGTCAGGGAATGTTCTTAAAGATC\n+\n69EEEFBAFBFABCCFFBEFFFDDEEHHDGH@FEFEFCAGGCDEEEBGEEBCGBCCGDFGCBBECFFEBDCDCEDEEEAABCCAEC@>>BB?@C\n@H91H9ADXX140327:2:2212:12198:89759/2\nTCTTGTACTACACTGAATTCACCCCCACTGAAAAAGATGAGTATGCCTGCCGTGTGAACCATGTGACTTTACAATCTGCATATTGGGATTGTCAGGGA\n+\nA@C>C;?AB@BBACDBCAABBDDCDDCDEFCDDDDEBBFCEABCGDBDEEF>@GBGCEDGEDGCGFECAACFEGDFFGFECB@DFGCBABFAECEB?=")
         fqFile.close()
 
-        cleanFq, returnCode = utils.test_cutadapt(testFq, self.get_param('cutadapt'), self.get_param('cutadapt_config_file'))
+        if useCutadapt:
+            cleanFq, returnCode = utils.test_cutadapt(testFq, self.get_param('cutadapt'), self.get_param('cutadapt_config_file'))
+        else:
+            cleanFq, returnCode = testFq, 0
         if cleanFq:
-            utils.log(self.loggingName, 'info', 'Test cutadapt ran successfully')
-            jfish_prgm, rc = utils.test_jellyfish(self.get_param('jellyfish'), cleanFq, testDir)
-            if returnCode != 0:
-                utils.log(self.loggingName, 'error', '%s unable to run successfully, exit code %s. Check installation and correct version.' % (jfish_prgm, str(returnCode)))
+            if useCutadapt:
+                utils.log(self.loggingName, 'info', 'Test cutadapt ran successfully')
+            jfish_prgm, rc = utils.test_jellyfish(self.get_param('jellyfish'), cleanFq, testDir, self.get_param('jellyfish_version'))
+            if rc != 0:
+                utils.log(self.loggingName, 'error', '%s unable to run successfully, exit code %s. Check installation and correct version.' % (jfish_prgm, str(rc)))
                 sys.exit(1)
             else:
                 utils.log(self.loggingName, 'info', 'Test jellyfish ran successfully')
         else:
             utils.log(self.loggingName, 'error', 'Cutadapt failed to run, exit code %s. Check installation and version.' % str(returnCode))
             sys.exit(1)
-        shutil.rmtree(testDir)  # Remove the test directory.
 
     def set_insertsize_thresh(self):
         """Store the insert sizes for a small number of "properly mapped" reads
@@ -317,7 +685,9 @@ class ParamManager:
         utils.log(self.loggingName, 'info', '%d targets' % len(self.targets))
 
     def check_blat_server(self):
-        """Run a test query on the specified blat server to make sure it is running. 
+        """Run a test query on the specified blat server to make sure it is running. The
+        query is written to a new blatserver_test_* directory in the analysis directory,
+        removed after the query, as the analysis directory is shared by the shards of a run.
 
         Args:
             None
@@ -327,10 +697,8 @@ class ParamManager:
             None
         """
 
-        testDir = os.path.join(self.paths['analysis'], 'blatserver_test')
+        testDir = tempfile.mkdtemp(prefix='blatserver_test_', dir=self.paths['analysis'])
         testFaFn = os.path.join(testDir, 'test.fa')
-        if not os.path.exists(testDir):
-            os.makedirs(testDir)
         testFa = open(testFaFn, 'w')
         testFa.write('>test\nCCAAGGGAGACTTCAAGCAGAAAATCTTTAAGGGACCCTTGCATAGCCAGAAGTCCTTTTCAGGCTGATGTACATAAAATATTTAGTAGCCAGGACAGTAGAAGGACTGAAGAGTGAGAGGAGCTCCCAGGGCCTGGAAAGGCCACTTTGTAAGCTCATTCTTG')
         testFa.close()
@@ -340,7 +708,7 @@ class ParamManager:
         utils.log(self.loggingName, 'info', 'Blat server test system command %s' % cmd)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
         output, errors = p.communicate()
-        utils.log(self.loggingName, 'info', 'Realignment output file %s' % resultFn)
+        shutil.rmtree(testDir, ignore_errors=True)
         serverSuccess = True
         if errors != '':
             serverSuccess = False
@@ -361,7 +729,7 @@ class ParamManager:
             None
         """
 
-        if self.fncCmd == 'prepare_reference_data':  # Do not start blat server for this function.
+        if self.fncCmd in ('prepare_reference_data', 'build_pon'):  # Do not start blat server for these functions.
             return
         elif self.fncCmd == 'start_blat_server':
             port = self.get_param('blat_port')
@@ -372,7 +740,7 @@ class ParamManager:
             if port is None:
                 self.set_param('blat_port', random.randint(8000, 9500))
                 utils.log(self.loggingName, 'info', 'Starting blat server on port %d on host %s.' % (self.get_param('blat_port'), self.get_param('blat_hostname')))    
-        elif self.fncCmd == 'run':  # Start the blat server if it is not already running.
+        elif self.fncCmd in ('run', 'serve', 'api'):  # Start the blat server if it is not already running.
             if not self.get_param('start_blat_server'):  # Start blat server option is not set. Check that one is running, if not, start it.
                 port = self.get_param('blat_port')
                 hostname = self.get_param('blat_hostname')
@@ -419,6 +787,22 @@ class ParamManager:
         utils.log(self.loggingName, 'info', 'Server ready!')
         os.chdir(curdir)
 
+    def stop_blat_server(self):
+        """Stop the blat server at the end of the analysis, unless the keep_blat_server
+        option is set. The temporary analysis directory created by api.load_params is removed.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+
+        if not self.get_param('keep_blat_server'):  # Keep blat server is not specified.
+            cmd = '%s stop %s %d' % (self.get_param('gfserver'), self.get_param('blat_hostname'), int(self.get_param('blat_port')))
+            os.system(cmd)
+        if self.fncCmd == 'api' and self.get_param('remove_analysis_dir'):
+            shutil.rmtree(self.paths['analysis'], ignore_errors=True)
+
     def get_target_names(self):
         """Get a list of target names.
 
@@ -208,7 +208,7 @@ class Segment:
 
 class AlignSegments:
     def __init__(self, svEventResult):
-        """ """
+        """svEventResult is a RenderJob object with the realignment results and contig values."""
         self.svEventResult = svEventResult
         self.segments = []
         self.colors = ['green', 'orange', 'blue', 'orange', 'purple']
@@ -229,11 +229,11 @@ class AlignSegments:
 
     def get_contig_seq(self):
         """ """
-        return self.svEventResult.contig.seq
+        return self.svEventResult.get_contig_seq()
 
     def get_contig_id(self):
         """ """
-        return self.svEventResult.contig.get_id()
+        return self.svEventResult.get_contig_id()
 
     def set_orderedseqs(self, orderedSeqValues):
         """ """
@@ -258,52 +258,106 @@ class AlignSegments:
         return colors
 
 
-def generate_pileup_img(svEventResult, bamReadsFn, outPath, contigId):
-    """ """
-    segmentManager = AlignSegments(svEventResult)
-    # print 'sv_viz.py svEvent output', svEventResult.get_formatted_output_values()
-    bamFile = pysam.Samfile(bamReadsFn, "rb")
-    segmentManager.set_orderedseqs(pile_reads(bamFile.fetch(), svEventResult.contig.seq))
-    plot_pileup(segmentManager, os.path.join(outPath, contigId))
+class RenderJob:
+    """Values needed to generate the pileup image of a contig after all the calls are made.
+    The job holds the realignment results and the contig values, not the contig object, so
+    that it can be sent to a rendering process.
+    Attributes:
+        blatResults:    List of tuples containing the query start and the BlatResult objects of the event.
+        annotated:      Boolean indicating whether the event was annotated.
+        contigSeq:      String of the contig sequence.
+        contigId:       String of the contig ID.
+        bamReadsFn:     String of the contig reads bam file.
+        outPath:        String of the output directory.
+        readPositions:  Dictionary with read names as keys and tuples of the read start position in the
+                        contig sequence and the read sequence as values, from the assembly.
+        maxReads:       Integer of the maximum number of reads to plot.
+    """
+    def __init__(self, svEventResult, bamReadsFn, outPath, contigId, readPositions, maxReads):
+        self.blatResults = svEventResult.blatResults
+        self.annotated = svEventResult.check_annotated()
+        self.contigSeq = svEventResult.contig.seq
+        self.contigId = contigId
+        self.bamReadsFn = bamReadsFn
+        self.outPath = outPath
+        self.readPositions = readPositions
+        self.maxReads = maxReads
+
+    def check_annotated(self):
+        """ """
+        return self.annotated
 
+    def get_contig_seq(self):
+        """ """
+        return self.contigSeq
+
+    def get_contig_id(self):
+        """ """
+        return self.contigId
 
-def pile_reads(reads, contigSeq):
+    def render(self):
+        """Place the sampled contig reads and plot the pileup image."""
+        segmentManager = AlignSegments(self)
+        bamFile = pysam.Samfile(self.bamReadsFn, "rb")
+        segmentManager.set_orderedseqs(pile_reads(bamFile.fetch(), self.contigSeq, self.readPositions, self.maxReads))
+        bamFile.close()
+        plot_pileup(segmentManager, os.path.join(self.outPath, self.contigId))
+
+
+def render_job(renderJob):
+    """Render a RenderJob, used as the process pool function."""
+    renderJob.render()
+
+
+def generate_pileup_img(svEventResult, bamReadsFn, outPath, contigId, readPositions=None, maxReads=50):
     """ """
+    RenderJob(svEventResult, bamReadsFn, outPath, contigId, readPositions or {}, maxReads).render()
+
+
+def pile_reads(reads, contigSeq, readPositions=None, maxReads=50):
+    """Determine the position of the reads in the contig sequence. The reads are sampled
+    evenly to at most maxReads before they are placed. The read positions known from the
+    assembly are used, and the reads that are not in readPositions are found in the contig
+    sequence or aligned to it.
+    Args:
+        reads:          Iterator of pysam read objects.
+        contigSeq:      String of the contig sequence.
+        readPositions:  Dictionary with read names (<qname>/<1 or 2>) as keys and tuples of the
+                        read start position and the read sequence as values.
+        maxReads:       Integer of the maximum number of reads to return.
+    Return:
+        Tuple with the list of (position, padded read sequence) tuples sorted by position and a boolean
+        indicating whether the reads were sampled.
+    """
+
+    if readPositions is None:
+        readPositions = {}
+    reads = list(reads)
+    readsSampled = len(reads) > maxReads
+    if readsSampled:
+        reads = [reads[(i * len(reads)) / maxReads] for i in range(maxReads)]
 
-    readCounts = 0
     orderedSeqs = []
     for read in reads:
-        idx = contigSeq.find(read.seq)
-        seq = read.seq
-        add = True
-        if idx == -1:
-            aln1 = olcAssembly.nw(contigSeq, read.seq)
-            aln2 = olcAssembly.nw(read.seq, contigSeq)
-            idx = aln1[3]
-            seq = aln1[1]
-            if aln1[-1] < aln2[-1]:
-                idx = aln2[5]
-                seq = aln2[0]
-        if add:
-            orderedSeqs.append((idx, ' ' * idx + seq))
-        readCounts += 1
-    os = sorted(orderedSeqs, key=lambda x: x[0])
-
-    readsSampled = False
-    returnReads = []
-    readSampleCounter = 0
-    if len(os) > 50:
-        readsSampled = True
-        sampleIdx = readCounts / 50
-        for read in os:
-            if readSampleCounter == sampleIdx:
-                readSampleCounter = 0
-                returnReads.append(read)
-            else:
-                readSampleCounter += 1
-    else:
-        returnReads = os
-    return (returnReads, readsSampled)
+        readName = read.qname + '/' + ('2' if read.is_read2 else '1')
+        if readName in readPositions:
+            idx, seq = readPositions[readName]
+            if idx < 0:
+                seq = seq[-idx:]
+                idx = 0
+        else:
+            idx = contigSeq.find(read.seq)
+            seq = read.seq
+            if idx == -1:
+                aln1 = olcAssembly.nw(contigSeq, read.seq)
+                aln2 = olcAssembly.nw(read.seq, contigSeq)
+                idx = aln1[3]
+                seq = aln1[1]
+                if aln1[-1] < aln2[-1]:
+                    idx = aln2[5]
+                    seq = aln2[0]
+        orderedSeqs.append((idx, ' ' * idx + seq))
+    return (sorted(orderedSeqs, key=lambda x: x[0]), readsSampled)
 
 
 def plot_pileup(segmentManager, outName):
@@ -0,0 +1,341 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""adapter_trimmer.py module
+
+This module contains an in-process replacement for running cutadapt on the
+extracted reads of each target. The adapters and thresholds are parsed from the
+cutadapt configuration file so the same file drives both modes.
+"""
+
+from itertools import izip
+import breakmer.utils as utils
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+TRIMMERS = {}  # AdapterTrimmer objects keyed by configuration file, created once per process.
+
+
+def count_mismatches(readSeq, adapterSeq, maxErrors):
+    """Count the mismatches between two equal length sequences, stopping once
+    the maximum number of errors is exceeded. An N in the adapter sequence matches
+    any base.
+
+    Args:
+        readSeq (str):      Read sequence.
+        adapterSeq (str):   Adapter sequence.
+        maxErrors (int):    The maximum number of mismatches allowed.
+    Returns:
+        errors (int):       The number of mismatches, maxErrors + 1 if it was exceeded.
+    """
+
+    errors = 0
+    for readBase, adapterBase in izip(readSeq, adapterSeq):
+        if readBase != adapterBase and adapterBase != 'N':
+            errors += 1
+            if errors > maxErrors:
+                break
+    return errors
+
+
+class Adapter:
+    """Class to store an adapter sequence and find its best match in a read sequence.
+
+    A 3' adapter (-a) is matched anywhere in the read, or partially at the end of the read,
+    and the adapter and all the bases after it are removed. A 5' adapter (-g) is matched
+    anywhere in the read, or partially at the start of the read, and the adapter and all the
+    bases preceding it are removed.
+
+    Matching allows mismatches at the cutadapt error rate but not insertions or deletions.
+
+    Attributes:
+        seq (str):          Adapter sequence.
+        where (str):        'back' for 3' adapters and 'front' for 5' adapters.
+        errorRate (float):  Maximum number of errors per matched adapter base.
+        minOverlap (int):   Minimum number of bases that must overlap for partial matches.
+        matchSeq (str):     Sequence used for matching, reversed for front adapters.
+        seeds (list):       List of tuples with the exact match seed sequences and their offsets in matchSeq.
+    """
+
+    def __init__(self, seq, where, errorRate, minOverlap):
+        self.seq = seq.upper()
+        self.where = where
+        self.errorRate = errorRate
+        self.minOverlap = minOverlap
+        self.matchSeq = self.seq if where == 'back' else self.seq[::-1]
+        self.seeds = []
+        self.set_seeds()
+
+    def set_seeds(self):
+        """Split the adapter into max errors + 1 pieces. Any full length match must
+        contain at least one of these pieces exactly.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+
+        adapterLen = len(self.matchSeq)
+        nSeeds = int(self.errorRate * adapterLen) + 1
+        seedLen = adapterLen / nSeeds
+        for i in range(nSeeds):
+            start = i * seedLen
+            end = adapterLen if i == (nSeeds - 1) else start + seedLen
+            seed = self.matchSeq[start:end]
+            if seed.find('N') == -1:
+                self.seeds.append((seed, start))
+
+    def match(self, seq):
+        """Find the best match of the adapter within a sequence.
+
+        Args:
+            seq (str):      Read sequence.
+        Returns:
+            match (tuple):  (number of matched bases, -errors, trim position) or None if there is no match.
+                            The trim position is the index in seq where the adapter starts for
+                            back adapters and ends for front adapters.
+        """
+
+        matchSeq = seq if self.where == 'back' else seq[::-1]
+        best = None
+        adapterLen = len(self.matchSeq)
+        seqLen = len(matchSeq)
+
+        # Full length adapter matches, located using the exact match seeds.
+        candidates = set()
+        if len(self.seeds) == 0:
+            candidates = set(range(0, seqLen - adapterLen + 1))
+        for seed, offset in self.seeds:
+            idx = matchSeq.find(seed)
+            while idx > -1:
+                pos = idx - offset
+                if pos >= 0 and (pos + adapterLen) <= seqLen:
+                    candidates.add(pos)
+                idx = matchSeq.find(seed, idx + 1)
+        maxErrors = int(self.errorRate * adapterLen)
+        for pos in sorted(candidates):
+            errors = count_mismatches(matchSeq[pos:pos + adapterLen], self.matchSeq, maxErrors)
+            if errors <= maxErrors:
+                best = self.better_match(best, (adapterLen - errors, -errors, pos))
+
+        # Partial adapter matches overlapping the end of the sequence.
+        if best is None or best[1] < 0:
+            for pos in range(max(0, seqLen - adapterLen + 1), seqLen - self.minOverlap + 1):
+                overlap = seqLen - pos
+                maxErrors = int(self.errorRate * overlap)
+                errors = count_mismatches(matchSeq[pos:], self.matchSeq[0:overlap], maxErrors)
+                if errors <= maxErrors:
+                    best = self.better_match(best, (overlap - errors, -errors, pos))
+
+        if best is not None and self.where == 'front':
+            best = (best[0], best[1], seqLen - best[2])
+        return best
+
+    def better_match(self, best, match):
+        """Return the better of two matches, more matched bases and then fewer errors win.
+        Ties are resolved by the leftmost position.
+
+        Args:
+            best (tuple):   Current best match or None.
+            match (tuple):  New match.
+        Returns:
+            The better match (tuple).
+        """
+
+        if best is None or (match[0], match[1]) > (best[0], best[1]):
+            return match
+        return best
+
+
+class AdapterTrimmer:
+    """Class to perform adapter and quality trimming of read sequences in-process
+    using the parameters in a cutadapt configuration file.
+
+    The supported cutadapt options are -a/--adapter, -g/--front, -q/--quality-cutoff,
+    -m/--minimum-length, -e/--error-rate, -O/--overlap and --quality-base. Other options
+    are logged and ignored.
+
+    Attributes:
+        loggingName (str):  Module name for logging file purposes.
+        adapters (list):    List of Adapter objects.
+        qualCutoffs (list): 5' and 3' quality cutoffs.
+        minLen (int):       Minimum read length to keep after trimming.
+        errorRate (float):  Maximum adapter error rate.
+        minOverlap (int):   Minimum adapter overlap.
+        qualBase (int):     Quality score offset.
+    """
+
+    def __init__(self, configFn):
+        self.loggingName = 'breakmer.processor.adapter_trimmer'
+        self.adapters = []
+        self.qualCutoffs = [0, 0]
+        self.minLen = 0
+        self.errorRate = 0.1
+        self.minOverlap = 3
+        self.qualBase = 33
+        self.parse_config(configFn)
+
+    def parse_config(self, configFn):
+        """Parse the cutadapt configuration file options.
+
+        Args:
+            configFn (str): Path to the cutadapt configuration file.
+        Returns:
+            None
+        """
+
+        adapterSeqs = []
+        optValues = utils.stringify(configFn).split()
+        i = 0
+        while i < len(optValues):
+            opt = optValues[i]
+            value = None
+            if opt.find('=') > -1:
+                opt, value = opt.split('=', 1)
+            elif i + 1 < len(optValues):
+                value = optValues[i + 1]
+                i += 1
+            if opt in ('-a', '--adapter'):
+                adapterSeqs.append((value, 'back'))
+            elif opt in ('-g', '--front'):
+                adapterSeqs.append((value, 'front'))
+            elif opt in ('-q', '--quality-cutoff'):
+                cutoffs = [int(x) for x in value.split(',')]
+                self.qualCutoffs = [0, cutoffs[0]] if len(cutoffs) == 1 else cutoffs
+            elif opt in ('-m', '--minimum-length'):
+                self.minLen = int(value)
+            elif opt in ('-e', '--error-rate'):
+                self.errorRate = float(value)
+            elif opt in ('-O', '--overlap'):
+                self.minOverlap = int(value)
+            elif opt == '--quality-base':
+                self.qualBase = int(value)
+            else:
+                utils.log(self.loggingName, 'debug', 'Cutadapt option %s is not supported by the internal trimmer, ignoring.' % opt)
+            i += 1
+        for seq, where in adapterSeqs:
+            self.adapters.append(Adapter(seq, where, self.errorRate, self.minOverlap))
+        utils.log(self.loggingName, 'info', 'Internal trimmer set with %d adapters, quality cutoffs %s, minimum length %d' % (len(self.adapters), ','.join([str(x) for x in self.qualCutoffs]), self.minLen))
+
+    def quality_trim_index(self, qual, cutoff, reverse=False):
+        """Determine the quality trimming index using the BWA algorithm used by cutadapt.
+
+        Args:
+            qual (str):     Quality string.
+            cutoff (int):   Quality cutoff.
+            reverse (bool): Trim from the 5' end instead of the 3' end.
+        Returns:
+            The index to trim at (int). Bases after (3') or before (5') this index are removed.
+        """
+
+        if reverse:
+            indices = range(len(qual))
+            trimIndex = 0
+        else:
+            indices = range(len(qual) - 1, -1, -1)
+            trimIndex = len(qual)
+        score = 0
+        maxScore = 0
+        for i in indices:
+            score += cutoff - (ord(qual[i]) - self.qualBase)
+            if score < 0:
+                break
+            if score > maxScore:
+                maxScore = score
+                trimIndex = i + 1 if reverse else i
+        return trimIndex
+
+    def trim(self, seq, qual):
+        """Quality trim and then remove the best matching adapter from a read.
+
+        Args:
+            seq (str):  Read sequence.
+            qual (str): Read quality string.
+        Returns:
+            A tuple containing the trimmed sequence and quality string, or None if the
+            trimmed read is shorter than the minimum length.
+        """
+
+        start, end = 0, len(seq)
+        if self.qualCutoffs[0] > 0:
+            start = self.quality_trim_index(qual, self.qualCutoffs[0], True)
+        if self.qualCutoffs[1] > 0:
+            end = max(start, self.quality_trim_index(qual, self.qualCutoffs[1]))
+        seq, qual = seq[start:end], qual[start:end]
+
+        bestMatch = None
+        bestAdapter = None
+        for adapter in self.adapters:
+            match = adapter.match(seq)
+            if match is not None and (bestMatch is None or (match[0], match[1]) > (bestMatch[0], bestMatch[1])):
+                bestMatch = match
+                bestAdapter = adapter
+        if bestMatch is not None:
+            if bestAdapter.where == 'back':
+                seq, qual = seq[0:bestMatch[2]], qual[0:bestMatch[2]]
+            else:
+                seq, qual = seq[bestMatch[2]:], qual[bestMatch[2]:]
+
+        if len(seq) < self.minLen:
+            return None
+        return seq, qual
+
+
+def get_trimmer(configFn):
+    """Return the AdapterTrimmer for a cutadapt configuration file, creating it
+    the first time it is requested in this process.
+
+    Args:
+        configFn (str):     Path to the cutadapt configuration file.
+    Returns:
+        AdapterTrimmer object
+    """
+
+    if configFn not in TRIMMERS:
+        TRIMMERS[configFn] = AdapterTrimmer(configFn)
+    return TRIMMERS[configFn]
+
+
+def trim_sv_reads(varReads, trimmer, minLen, filteredFqFn):
+    """Clean the extracted variant reads in-process without writing and re-reading
+    fastq files.
+
+    The reads are quality trimmed as for the extracted reads fastq (bam_handler.fq_line),
+    cleaned with the AdapterTrimmer, and then checked to determine whether the
+    softclipped sequences survived cleaning (utils.check_cleaned_read). The reads
+    that are kept are written to a fastq file for kmer counting.
+
+    Args:
+        varReads (VariantReadTracker): Extracted reads, the reads to clean are stored in the sv dictionary
+                                with the read name as the key and a tuple (read, clip_seqs, clip_coords, indel_only)
+                                as the value.
+        trimmer (AdapterTrimmer): Trimmer object.
+        minLen (int):           Minimum length of quality trimmed reads (kmer size).
+        filteredFqFn (str):     Path to the fastq file to write the kept reads.
+    Returns:
+        fq_recs (dict):         Dictionary with sequence as the key and a list of utils.fq_read objects as the value.
+    """
+
+    fq_recs = {}
+    filt_fq = open(filteredFqFn, 'w')
+    for name in varReads.sv:
+        read, sc_seqs, clip_coords, indel_only = varReads.sv[name]
+        start, end, trimLength = varReads.get_trim_coords(read, 5)
+        if trimLength == 0 or trimLength < minLen:
+            continue
+        old_seq = read.seq[start:end]
+        trimmed = trimmer.trim(old_seq, read.qual[start:end])
+        if trimmed is None:
+            continue
+        seq, qual = trimmed
+        if not utils.check_cleaned_read(seq, old_seq, sc_seqs):
+            continue
+        header = "@" + name + "_" + str(int(indel_only))
+        filt_fq.write(header + "\n" + seq + "\n+\n" + qual + "\n")
+        fq_recs.setdefault(seq, []).append(utils.fq_read(header, seq, qual, indel_only))
+    filt_fq.close()
+    return fq_recs
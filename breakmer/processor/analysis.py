@@ -6,8 +6,16 @@ import sys
 import logging
 import time
 import math
+import json
+import copy
 import multiprocessing
 import breakmer.processor.target as target
+import breakmer.processor.pon as pon
+import breakmer.processor.genome_filter as genome_filter
+import breakmer.processor.profiler as target_profiler
+import breakmer.processor.shard as shard
+import breakmer.realignment.cache as realign_cache
+import breakmer.plotting.sv_viz as svplotter
 import breakmer.utils as utils
 
 __author__ = "Ryan Abo"
@@ -16,76 +24,169 @@ __email__ = "ryanabo@gmail.com"
 __license__ = "MIT"
 
 
-def check_status(results):
-    """Check the status of the multiple processors running analysis
+def analyze_targets(targetList):
+    """Analyze a list of targets.
+
+    A list of TargetManager objects are passed in to be analyzed independently.
+    Each target ref data is set, if necessary, then the reads are extracted,
+    contigs built, and calls made.
+
+    This function performs all the top level functions on the target regions being analyzed.
 
     Args:
-        results (list): A list of results from the multiprocessing analysis.
+        targetList (list):          A list of TargetManager objects, representing target regions.
     Returns:
-        notReady (int): An integer value indicating the number of processors not complete.
+        aggregateResults (dict):    A dictoinary containing lists of formatted output strings for the
+                                    contig-based calls and the discordant-only read clusters, the pileup
+                                    image jobs, the stage timing records and the profile records of the targets,
+                                    and the number of contig and discordant read outputs of each target.
+    Raises:
+        None
     """
 
-    notReady = 0
-    for r in results:
-        if not r.ready():
-            notReady += 1
-    return (notReady)
+    aggregateResults = {'contigs': [], 'discreads': [], 'render': [], 'stats': [], 'profiles': [], 'targets': []}  # Formatted output strings for contig based calls and discordant read calls are different.
+    batchClean = len(targetList) > 0 and targetList[0].fnc == 'run' and targetList[0].params.get_param('adapter_trimmer') == 'cutadapt_batch'
+    if batchClean:  # Extract the reads for all the targets and clean them with a single cutadapt run.
+        batch_extract_reads(targetList)
+    for targetRegion in targetList:
+        targetProfiler = target_profiler.get_target_profiler(targetRegion)
+        if targetProfiler is not None:
+            targetProfiler.start()
+        outputs = analyze_target(targetRegion, batchClean)
+        if targetProfiler is not None:
+            aggregateResults['profiles'].append(targetProfiler.stop())
+        if outputs is not None:
+            for key in outputs:
+                aggregateResults[key].extend(outputs[key])
+        aggregateResults['targets'].append((targetRegion.name, len(outputs['contigs']) if outputs else 0, len(outputs['discreads']) if outputs else 0))
+    realign_cache.log_stats('breakmer.processor.analysis')
+    for targetRegion in targetList:  # Include the targets that stopped early.
+        aggregateResults['stats'].extend(targetRegion.get_stage_records())
+    return aggregateResults
 
 
-def wait(results):
-    """Check if the nprocs are complete.
+def analyze_target(targetRegion, batchClean):
+    """Analyze a single target, from setting the reference data to writing the results.
 
     Args:
-        results (list): A list of results from the multiprocessing analysis.
+        targetRegion (TargetManager):   Target region to analyze.
+        batchClean (boolean):           The target reads were extracted and cleaned in batch.
+    Returns:
+        outputs (dict):                 Formatted output of the target or None if there are no results.
+    """
+
+    if batchClean:
+        if not targetRegion.clean_sv_reads():  # No SV reads left after cleaning.
+            return None
+    else:
+        # print 'Analyzing', targetRegion.name
+        utils.log('breakmer.processor.analysis', 'info', 'Analyzing %s' % targetRegion.name)
+        targetRegion.set_ref_data()
+        if targetRegion.fnc == 'prepare_reference_data':  # Stop here if only preparing ref data.
+            return None
+        if not targetRegion.find_sv_reads():  # No SV reads extracted. Exiting.
+            return None
+    targetRegion.compare_kmers()  # Perform kmer subtraction.
+    targetRegion.resolve_sv()  # Assemble extracted reads and make calls.
+    outputs = None
+    if targetRegion.has_results():
+        outputs = targetRegion.get_formatted_output()
+    targetRegion.complete_analysis()  # Write results out to file.
+    return outputs
+
+
+def batch_extract_reads(targetList):
+    """Extract the reads for a list of targets and clean all the extracted reads
+    with a single cutadapt run.
+
+    The tagged batch fastq is written to <targets_dir>/batch_<pid>_reads.fastq and
+    cutadapt uses the cutadapt_cores parameter number of cores.
+
+    Args:
+        targetList (list):  A list of TargetManager objects.
     Returns:
-        None
-    Raises:
         None
     """
 
-    njobs = check_status(results)
-    while njobs > 0:
-        time.sleep(10)
-        jobs = check_status(results)
-        if jobs < njobs:
-            njobs = jobs
+    params = targetList[0].params
+    readFiles = []
+    for targetRegion in targetList:
+        utils.log('breakmer.processor.analysis', 'info', 'Analyzing %s' % targetRegion.name)
+        targetRegion.set_ref_data()
+        targetRegion.extract_reads()
+        readFiles.extend(targetRegion.get_read_files())
+    batchFn = os.path.join(params.paths['targets'], 'batch_%d_reads.fastq' % os.getpid())
+    utils.log('breakmer.processor.analysis', 'info', 'Cleaning reads for %d targets in batch file %s' % (len(targetList), batchFn))
+    utils.run_batch_cutadapt(readFiles, params.get_param('cutadapt'), params.get_param('cutadapt_config_file'), batchFn, int(params.get_param('cutadapt_cores')), params.get_param('cutadapt_version'), 'breakmer.processor.analysis')
 
 
-def analyze_targets(targetList):
-    """Analyze a list of targets.
+def aggregate_results(multiprocResults):
+    """Wait for the results of the target groups analyzed in a pool and aggregate them.
 
-    A list of TargetManager objects are passed in to be analyzed independently.
-    Each target ref data is set, if necessary, then the reads are extracted,
-    contigs built, and calls made.
+    Args:
+        multiprocResults (list):    List of AsyncResult objects of analyze_targets().
+    Returns:
+        aggResults (dict):          Aggregated results of all the target groups.
+    """
 
-    This function performs all the top level functions on the target regions being analyzed.
+    aggResults = {'contigs': [], 'discreads': []}  # Buffer the formatted output strings for each target to write out in batch.
+    for multiprocResult in multiprocResults:
+        a = multiprocResult.get()
+        aggResults['contigs'].extend(a['contigs'])
+        aggResults['discreads'].extend(a['discreads'])
+        aggResults.setdefault('render', []).extend(a.get('render', []))
+        aggResults.setdefault('stats', []).extend(a.get('stats', []))
+        aggResults.setdefault('profiles', []).extend(a.get('profiles', []))
+        aggResults.setdefault('targets', []).extend(a.get('targets', []))
+    return aggResults
+
+
+def prepare_reference_state(targetList):
+    """Write the reference sequence files, the blast databases and the reference kmer counts
+    of a list of targets, once for all the samples of a run with a samples manifest.
 
     Args:
-        targetList (list):          A list of TargetManager objects, representing target regions.
+        targetList (list):  A list of TargetManager objects.
     Returns:
-        aggregateResults (dict):    A dictoinary containing lists of formatted output strings for the
-                                    contig-based calls and the discordant-only read clusters.
-    Raises:
         None
     """
 
-    aggregateResults = {'contigs': [], 'discreads': []}  # Formatted output strings for contig based calls and discordant read calls are different.
     for targetRegion in targetList:
-        # print 'Analyzing', targetRegion.name
-        utils.log('breakmer.processor.analysis', 'info', 'Analyzing %s' % targetRegion.name)
         targetRegion.set_ref_data()
-        if targetRegion.fnc == 'prepare_reference_data':  # Stop here if only preparing ref data.
-            continue
-        if not targetRegion.find_sv_reads():  # No SV reads extracted. Exiting.
-            continue
-        targetRegion.compare_kmers()  # Perform kmer subtraction.
-        targetRegion.resolve_sv()  # Assemble extracted reads and make calls.
-        if targetRegion.has_results():
-            outputs = targetRegion.get_formatted_output()
-            for key in outputs:
-                aggregateResults[key].extend(outputs[key])
-        targetRegion.complete_analysis()  # Write results out to file.
-    return aggregateResults
+        for refFn in targetRegion.files['target_ref_fn']:
+            utils.run_jellyfish(refFn, targetRegion.params.get_param('jellyfish'), targetRegion.params.get_kmer_size(), targetRegion.params.get_param('jellyfish_version'))
+
+
+def set_reference_state(params):
+    """Write the reference data of all the targets and load their reference kmers in this
+    process, before the processor pool is created, so that the processors share them
+    (copy-on-write) whichever target groups they are given. This is used by a run with a
+    samples manifest and by the serve function.
+
+    Args:
+        params (ParamManager):  Parameters for breakmer analysis.
+    Returns:
+        None
+    """
+
+    startTime = time.time()
+    nprocs = int(params.get_param('nprocs'))
+    refParams = copy.copy(params)
+    refParams.fncCmd = 'prepare_reference_data'
+    refParams.opts = dict(params.opts)
+    if refParams.get_param('readLen') is None:  # Not set before a sample bam file, the reference data does not depend on it.
+        refParams.set_param('readLen', 0)
+    refTargets = [target.TargetManager(targetName, refParams) for targetName in sorted(refParams.get_target_names())]
+    if nprocs > 1:
+        p = multiprocessing.Pool(nprocs)
+        p.map(prepare_reference_state, [refTargets[i::nprocs] for i in range(nprocs)])
+        p.close()
+        p.join()
+    else:
+        prepare_reference_state(refTargets)
+    for targetRegion in refTargets:
+        targetRegion.variation.set_reference_kmers(targetRegion.files['target_ref_fn'], True)
+    utils.log('breakmer.processor.analysis', 'info', 'Reference state of %d targets set in %.1f seconds' % (len(refTargets), time.time() - startTime))
 
 
 class RunTracker:
@@ -102,6 +203,7 @@ class RunTracker:
 
     def __init__(self, params):
         self.params = params
+        self.targetNames = []
         # self.results = []
         self.loggingName = 'breakmer.processor.analysis'
 
@@ -117,42 +219,219 @@ class RunTracker:
             None
         """
 
-        startTime = time.clock()  # Track the run time.
+        startTime = time.time()  # Track the run time, CPU time is measured per target stage in the worker processes.
+
+        if self.params.fncCmd == 'merge':
+            self.write_aggregated_output(shard.merge_shards(self.params))
+            print 'Shard outputs merged!'
+            return
 
         self.params.start_blat_server()
         if self.params.fncCmd == 'start_blat_server':
             print 'Server started!'
             return
 
+        if self.params.get_param('samples'):
+            self.run_samples(startTime)
+            self.params.stop_blat_server()
+            print 'Analysis complete!'
+            return
+
+        aggResults = self.analyze()
+
+        if self.params.fncCmd == 'prepare_reference_data':
+            if self.params.get_param('genome_kmer_filter'):  # Build the genome-wide kmer filter once for all targets.
+                genome_filter.build_filter(self.params)
+            print 'Reference data setup!'
+            return
+        elif self.params.fncCmd == 'build_pon':
+            pon.write_manifest(self.params, self.params.get_target_names())
+            print 'Panel of normals built!'
+            return
+
+        self.write_results(aggResults, startTime)
+        self.params.stop_blat_server()
+        print 'Analysis complete!'
+
+    def analyze(self, pool=None, analyzeFnc=analyze_targets):
+        """Create the target regions and analyze them, in groups of targets mapped to the
+        processes of a pool if nprocs > 1.
+
+        Args:
+            pool (multiprocessing.Pool):    Pool of nprocs worker processes to use, a pool is created
+                                            and closed for this analysis if it is None.
+            analyzeFnc (function):          Function analyzing a list of targets.
+        Returns:
+            aggResults (dict):  Aggregated results of all the targets, see analyze_targets().
+        """
+
         targetAnalysisList = self.create_targets()
 
-        aggResults = {'contigs': [], 'discreads': []}  # Buffer the formatted output strings for each target to write out in batch.
+        if self.params.fncCmd == 'build_pon':  # Count the normal sample kmers for the panel of normals instead.
+            analyzeFnc = pon.build_targets
+
         nprocs = int(self.params.get_param('nprocs'))
         if nprocs > 1:  # Make use of multiprocessing by mapping targets to n jobs.
             utils.log(self.loggingName, 'info', 'Creating all reference data.')
-            p = multiprocessing.Pool(nprocs)
-            multiprocResults = []
-            for targetList in targetAnalysisList:
-                multiprocResults.append(p.apply_async(analyze_targets, (targetList, )))
-            wait(multiprocResults)
-            for multiprocResult in multiprocResults:
-                a = multiprocResult.get()
-                aggResults['contigs'].extend(a['contigs'])
-                aggResults['discreads'].extend(a['discreads'])
+            p = pool if pool is not None else multiprocessing.Pool(nprocs)
+            aggResults = aggregate_results([p.apply_async(analyzeFnc, (targetList, )) for targetList in targetAnalysisList])
+            if pool is None:
+                p.close()
+                p.join()
         else:
-            aggResults = analyze_targets(targetAnalysisList)
+            aggResults = analyzeFnc(targetAnalysisList)
+        return aggResults
 
-        if self.params.fncCmd == 'prepare_reference_data':
-            print 'Reference data setup!'
-            return
+    def run_samples(self, startTime):
+        """Analyze the samples of the samples manifest with the reference state of the targets
+        set once for all the samples.
+
+        The reference sequence files and kmer counts of all the targets are written first, and
+        the reference kmers are loaded in this process before the processor pool is created, so
+        the processors share them (copy-on-write) and look them up instead of reloading them.
+        The target groups of all the samples are then queued to the same pool, so the processors
+        move on to the next sample while the last targets of a sample finish, and the outputs of
+        each sample are written to <analysis_dir>/samples/<sample>/output/ as its targets complete.
+        A summary of the samples is written to <output_dir>/<analysis_name>_samples.tsv.
+
+        Args:
+            startTime (float):  Start time of the run.
+        Returns:
+            None
+        """
+
+        samples = self.params.get_samples()
+        sampleTrackers = []
+        for sampleName, bamFn, overrides in samples:
+            sampleParams = self.params.get_sample_params(sampleName, bamFn, os.path.join(self.params.paths['analysis'], 'samples', sampleName), overrides)
+            sampleTrackers.append(RunTracker(sampleParams))
+        nprocs = int(self.params.get_param('nprocs'))
+        utils.log(self.loggingName, 'info', 'Analyzing %d samples with %d processors' % (len(samples), nprocs))
+
+        set_reference_state(sampleTrackers[0].params)
+
+        p = multiprocessing.Pool(nprocs) if nprocs > 1 else None
+        sampleResults = []
+        for sampleTracker in sampleTrackers:
+            if p is not None:
+                sampleResults.append([p.apply_async(analyze_targets, (targetList, )) for targetList in sampleTracker.create_targets()])
+        summary = []
+        for i, sampleTracker in enumerate(sampleTrackers):
+            if p is not None:
+                aggResults = aggregate_results(sampleResults[i])
+            else:
+                aggResults = sampleTracker.analyze()
+            sampleTracker.write_results(aggResults, startTime, p)
+            utils.log(self.loggingName, 'info', 'Sample %s complete in %.1f seconds' % (sampleTracker.params.get_param('analysis_name'), time.time() - startTime))
+            summary.append([sampleTracker.params.get_param('analysis_name'), sampleTracker.params.get_param('sample_bam_file'), sampleTracker.params.paths['output'], str(len(aggResults['contigs'])), str(len(aggResults['discreads']))])
+        if p is not None:
+            p.close()
+            p.join()
+
+        summaryFn = os.path.join(self.params.paths['output'], self.params.get_param('analysis_name') + '_samples.tsv')
+        summaryFile = open(summaryFn, 'w')
+        summaryFile.write('\t'.join(['sample', 'bam', 'output_dir', 'contig_calls', 'discread_calls']) + '\n')
+        for values in summary:
+            summaryFile.write('\t'.join(values) + '\n')
+        summaryFile.close()
+        utils.log(self.loggingName, 'info', 'Analysis of %d samples complete in %s, summary written to %s' % (len(samples), str(time.time() - startTime), summaryFn))
+
+    def write_results(self, aggResults, startTime, pool=None):
+        """Write the output files, the pileup images, the run statistics and profiles and
+        the shard manifest of an analysis.
+
+        Args:
+            aggResults (dict):              Aggregated results of all the targets.
+            startTime (float):              Start time of the analysis.
+            pool (multiprocessing.Pool):    Pool of worker processes to render the images with, if set.
+        Returns:
+            None
+        """
 
         self.write_aggregated_output(aggResults)
-        utils.log(self.loggingName, 'info', 'Analysis complete in %s' % str(time.clock() - startTime))
+        renderStartTime = time.time()
+        self.render_images(aggResults.get('render', []), pool)
+        runTimes = {'render_images': time.time() - renderStartTime, 'total': time.time() - startTime}
+        self.write_run_stats(aggResults.get('stats', []), runTimes)
+        target_profiler.merge_profiles(self.params, aggResults.get('profiles', []))
+        if self.params.get_param('shard'):  # Written last, the shard is only merged when its manifest exists.
+            shard.write_manifest(self.params, self.targetNames, aggResults)
+        utils.log(self.loggingName, 'info', 'Analysis complete in %s' % str(runTimes['total']))
+
+    def render_images(self, renderJobs, pool=None):
+        """Generate the pileup images of the calls, deferred until all the targets are
+        analyzed. The images are rendered in a process pool with nprocs processes.
 
-        if not self.params.get_param('keep_blat_server'):  # Keep blat server is specified.
-            cmd = '%s stop %s %d' % (self.params.get_param('gfserver'), self.params.get_param('blat_hostname'), int(self.params.get_param('blat_port')))
-            os.system(cmd)
-        print 'Analysis complete!'
+        Args:
+            renderJobs (list):              List of sv_viz.RenderJob objects.
+            pool (multiprocessing.Pool):    Pool of worker processes to use, if set.
+        Returns:
+            None
+        """
+
+        if len(renderJobs) == 0:
+            return
+        nprocs = min(int(self.params.get_param('nprocs')), len(renderJobs))
+        utils.log(self.loggingName, 'info', 'Rendering %d pileup images with %d processes' % (len(renderJobs), nprocs))
+        if nprocs > 1 and pool is not None:
+            pool.map(svplotter.render_job, renderJobs)
+        elif nprocs > 1:
+            p = multiprocessing.Pool(nprocs)
+            p.map(svplotter.render_job, renderJobs)
+            p.close()
+            p.join()
+        else:
+            map(svplotter.render_job, renderJobs)
+
+    def write_run_stats(self, stageRecords, runTimes):
+        """Write the stage timing, resource use and count records of all the targets.
+
+        The output files are:
+            <output_dir>/<analysis_name>_run_stats.json - run wall times, per stage totals and all the target stage records.
+            <output_dir>/<analysis_name>_run_stats.tsv - one line per target and stage.
+
+        The CPU times of a stage that ran at the same time as another stage are not known and
+        written as NA, see utils.StageTracker.
+
+        Args:
+            stageRecords (list):    List of stage record dictionaries from utils.StageTracker.
+            runTimes (dict):        Wall times in seconds of the whole run and of the image rendering.
+        Returns:
+            None
+        """
+
+        stageTotals = {}
+        for record in stageRecords:
+            if record['stage'] not in stageTotals:
+                stageTotals[record['stage']] = {'targets': 0, 'runs': 0, 'wall': 0.0, 'cpu': 0.0, 'child_cpu': 0.0, 'process_max_rss_kb': 0, 'counts': {}}
+            total = stageTotals[record['stage']]
+            total['targets'] += 1
+            for key in ('runs', 'wall'):
+                total[key] += record[key]
+            for key in ('cpu', 'child_cpu'):  # None if the stage overlapped another stage in any target.
+                total[key] = None if total[key] is None or record[key] is None else total[key] + record[key]
+            total['process_max_rss_kb'] = max(total['process_max_rss_kb'], record['process_max_rss_kb'])
+            for key in record['counts']:
+                total['counts'][key] = total['counts'].get(key, 0) + record['counts'][key]
+
+        runStats = {'analysis_name': self.params.get_param('analysis_name'),
+                    'nprocs': int(self.params.get_param('nprocs')),
+                    'targets': len(set([record['target'] for record in stageRecords])),
+                    'wall_time': runTimes,
+                    'tool_versions': {'cutadapt': self.params.get_param('cutadapt_version'), 'jellyfish': self.params.get_param('jellyfish_version')},
+                    'stage_totals': stageTotals,
+                    'stages': stageRecords}
+        statsFn = os.path.join(self.params.paths['output'], self.params.get_param('analysis_name') + '_run_stats')
+        utils.log(self.loggingName, 'info', 'Writing %d target stage records to %s.json and %s.tsv' % (len(stageRecords), statsFn, statsFn))
+        statsFile = open(statsFn + '.json', 'w')
+        json.dump(runStats, statsFile, indent=2, sort_keys=True)
+        statsFile.close()
+        statsFile = open(statsFn + '.tsv', 'w')
+        statsFile.write('\t'.join(['target', 'stage', 'runs', 'wall_s', 'cpu_s', 'child_cpu_s', 'process_max_rss_kb', 'counts']) + '\n')
+        for record in stageRecords:
+            counts = ','.join(['%s=%d' % (key, record['counts'][key]) for key in sorted(record['counts'])])
+            statsFile.write('\t'.join([record['target'], record['stage'], str(record['runs']), '%.3f' % record['wall'], utils.format_seconds(record['cpu']), utils.format_seconds(record['child_cpu']), str(record['process_max_rss_kb']), counts]) + '\n')
+        statsFile.close()
 
     def create_targets(self):
         """Create target objects and group them by the number of
@@ -173,10 +452,12 @@ class RunTracker:
                                analyzed by a processor.
         """
 
+        # Iterate through the target name list, sorted alphabetically, limited to the targets of the shard if set.
+        self.targetNames = shard.get_shard_targets(self.params)
         nprocs = int(self.params.get_param('nprocs'))
         multiprocs = nprocs > 1
         ngroups = nprocs
-        ntargets = len(self.params.targets)
+        ntargets = len(self.targetNames)
         ntargetsPerGroup = ntargets / nprocs
         modval = math.fmod(ntargets, nprocs)
         if modval > 0:
@@ -184,10 +465,7 @@ class RunTracker:
         trgtGroups = []
         trgtGroup = []
 
-        # Iterate through the target name list, sorted alphabetically.
-        targetNames = self.params.get_target_names()
-        targetNames.sort()
-        for targetName in targetNames:
+        for targetName in self.targetNames:
             targetManager = target.TargetManager(targetName, self.params)
             if multiprocs:
                 if len(trgtGroup) == ntargetsPerGroup:
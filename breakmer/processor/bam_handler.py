@@ -7,6 +7,7 @@ This module contains the classes and functions to handle the
 """
 
 import pysam
+import numpy as np
 
 __author__ = "Ryan Abo"
 __copyright__ = "Copyright 2015, Ryan Abo"
@@ -14,37 +15,87 @@ __email__ = "ryanabo@gmail.com"
 __license__ = "MIT"
 
 
-def trim_qual(read, min_qual, min_len):
-    qual_str = read.qual
-    q = []
-    coords = [0, len(qual_str)]
-    start = seq_trim(qual_str, min_qual)
-    if start == len(qual_str):
+def trim_qual(read, min_qual, min_len, coords=None):
+    """Trim the low quality bases from the start and end of a read.
+
+    Args:
+        read (pysam read obj):  Read to trim, the seq and qual values are modified.
+        min_qual (int):         Minimum acceptable Phred quality score.
+        min_len (int):          Minimum length of the trimmed read.
+        coords (tuple):         Precomputed (start, end, length) good quality coordinates for min_qual,
+                                see batch_trim_coords. These are computed if not provided.
+    Return:
+        read (pysam read obj):  The trimmed read or None if the trimmed read is too short.
+    """
+
+    if coords is None:
+        coords = trim_coords(read.qual, min_qual)
+    start, end, lngth = coords
+    if lngth == 0 or lngth < min_len:
         return None
-    else:
-        end = len(qual_str) - seq_trim(qual_str[::-1], min_qual)
-        lngth = end - start
-        if lngth < min_len:
-            return None
-        nseq = read.seq[start:end]
-        nqual = qual_str[start:end]
-        read.seq = nseq
-        read.qual = nqual
+    qual_str = read.qual
+    nseq = read.seq[start:end]
+    nqual = qual_str[start:end]
+    read.seq = nseq
+    read.qual = nqual
     return read
 
 
-def fq_line(read, indel_only, min_len, trim=True):
+def fq_line(read, indel_only, min_len, trim=True, coords=None):
     add_val = '0'
     if indel_only:
         add_val = '1'
     lineout = None
     if trim:
-        read = trim_qual(read, 5, min_len)
+        read = trim_qual(read, 5, min_len, coords)
     if read:
         lineout = "@" + get_seq_readname(read) + "_" + add_val + "\n" + read.seq + "\n+\n" + read.qual + "\n"
     return lineout
 
 
+def batch_trim_coords(qualStrs, minQuals):
+    """Determine the good quality coordinates for a batch of reads with vectorized
+    comparisons. This is equivalent to calling trim_coords on each quality string.
+
+    The quality strings are packed into a 2D uint8 buffer (one row per read) and the
+    first and last positions with quality >= minQual are determined for each read.
+
+    Args:
+        qualStrs (list):    List of quality strings (i.e., read.qual), offset by 33.
+        minQuals (list):    List of minimum acceptable Phred quality scores.
+    Return:
+        coords (dict):      Key is the minQual and value is a list of (start, end, length) tuples,
+                            (0, 0, 0) for reads with no good quality bases.
+    """
+
+    coords = {}
+    nReads = len(qualStrs)
+    if nReads == 0:
+        for minQual in minQuals:
+            coords[minQual] = []
+        return coords
+
+    lengths = np.fromiter((len(x) for x in qualStrs), dtype=np.int64, count=nReads)
+    maxLen = int(lengths.max())
+    # Scatter the concatenated quality values into the padded read x position buffer.
+    quals = np.frombuffer(''.join(qualStrs), dtype=np.uint8)
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    rows = np.repeat(np.arange(nReads), lengths)
+    cols = np.arange(len(quals)) - offsets
+    qualBuffer = np.zeros((nReads, maxLen), dtype=np.uint8)  # Padding is below any quality threshold.
+    qualBuffer[rows, cols] = quals
+
+    for minQual in minQuals:
+        good = qualBuffer >= (minQual + 33)
+        anyGood = good.any(axis=1)
+        starts = good.argmax(axis=1)
+        ends = maxLen - good[:, ::-1].argmax(axis=1)
+        starts[~anyGood] = 0
+        ends[~anyGood] = 0
+        coords[minQual] = zip(starts.tolist(), ends.tolist(), (ends - starts).tolist())
+    return coords
+
+
 def get_seq_readname(read):
     """ """
     end = '1'
@@ -214,7 +265,7 @@ def get_region_reads(bamFile, chrom, start, end):
     return (reads, bamF)
 
 
-def get_variant_reads(bamFile, chrom, start, end, insertSizeThresh):
+def get_variant_reads(bamFile, chrom, start, end, insertSizeThresh, reads=None):
     """Get the softclipped, discordant read pairs, and unmapped reads.
     These reads are stored in the VarReadTracker object.
 
@@ -223,16 +274,25 @@ def get_variant_reads(bamFile, chrom, start, end, insertSizeThresh):
     to the check_read function.
 
     Args:
-        bamFile (str):  Path to the bam file to open, must be indexed!
+        bamFile (str):  Path to the bam file to open, must be indexed! An open pysam bam file
+                        object can be passed instead, it is left open.
         chrom (str):    Chromosome of the region to extract
         start (int):    Region start location to extract.
         end (int):      Region end location to extract.
+        reads (iterable):   Reads of the region to use instead of the reads fetched from the bam file.
     Return:
         varReadTracker (VariantReadTracker): VarReadTracker object
     """
 
-    reads, bamF = get_region_reads(bamFile, chrom, start, end)
-    varReadTracker = VariantReadTracker(bamF, insertSizeThresh)
+    if isinstance(bamFile, basestring):
+        regionReads, bamF = get_region_reads(bamFile, chrom, start, end)
+        varReadTracker = VariantReadTracker(bamF, insertSizeThresh)
+    else:
+        bamF = bamFile
+        regionReads = bamF.fetch(chrom, start, end) if reads is None else None
+        varReadTracker = VariantReadTracker(bamF, insertSizeThresh, False)
+    if reads is None:
+        reads = regionReads
     for read in reads:
         skip = False
         if read.mate_is_unmapped or read.rnext == -1:
@@ -595,9 +655,10 @@ class VariantReadTracker:
                               suggestive of some uncategorized event.
         sv (dict):            Dictionary
         bam (str):            Bam file source the reads came from.
+        closeBam (boolean):   Close the bam file after the reads are written.
     """
 
-    def __init__(self, bamFile, insertSizeThresh):
+    def __init__(self, bamFile, insertSizeThresh, closeBam=True):
         """
         """
 
@@ -607,7 +668,9 @@ class VariantReadTracker:
         self.unmapped = {}
         self.unmapped_keep = []
         self.sv = {}
+        self.trimCoords = {}
         self.bam = bamFile
+        self.closeBam = closeBam
 
     def check_read(self, read):
         """Stores all reads in the self.pair_indices dictionary if it is
@@ -648,14 +711,53 @@ class VariantReadTracker:
 
         self.unmapped[read.qname] = read
 
+    def set_trim_coords(self, reads, batchSize=50000):
+        """Determine the good quality sequence coordinates of the reads in batches and store
+        them by read object. The coordinates are computed once for the minimum quality used
+        to extract clipped sequences (3) and to trim reads written to fastq (5).
+
+        The coordinates are keyed by the identity of the read object and not by the read name,
+        the secondary and supplementary alignments of a read have the same name but a different,
+        possibly hard-clipped, sequence and quality string. The read is stored with its
+        coordinates so that its identity is not reused while the coordinates are kept.
+
+        Args:
+            reads (list):       List of pysam read objects.
+            batchSize (int):    Number of reads to process in each batch.
+        Return:
+            None
+        """
+
+        for i in range(0, len(reads), batchSize):
+            batch = reads[i:(i + batchSize)]
+            coords = batch_trim_coords([read.qual for read in batch], (3, 5))
+            for j, read in enumerate(batch):
+                self.trimCoords[id(read)] = (read, {3: coords[3][j], 5: coords[5][j]})
+
+    def get_trim_coords(self, read, minQual):
+        """Return the stored good quality coordinates for a read, computing them if the
+        read was not part of a batch.
+
+        Args:
+            read (pysam read obj):  Read object.
+            minQual (int):          Minimum quality, 3 or 5.
+        Return:
+            Tuple (start, end, length)
+        """
+
+        if id(read) not in self.trimCoords:
+            self.set_trim_coords([read])
+        return self.trimCoords[id(read)][1][minQual]
+
     def check_clippings(self, kmer_size, region_start_pos, region_end_pos):
         """
         """
 
+        self.set_trim_coords([read_vals[0] for read_vals in self.valid])
         for read_vals in self.valid:
             read, proper_map, overlap_reads = read_vals
             if read.cigar or len(read.cigar) > 1:
-                good_qual_coords = trim_coords(read.qual, 3)  # Get the (start, end, length) of the high-quality sequence bases.
+                good_qual_coords = self.get_trim_coords(read, 3)  # Get the (start, end, length) of the high-quality sequence bases.
                 clip_coords = get_clip_coords(read)  # Get the [start, end] of the non-clipped sequence bases.
                 self.extract_clippings(read_vals, clip_coords, good_qual_coords, kmer_size)
 
@@ -716,30 +818,36 @@ class VariantReadTracker:
         """
         """
 
+        unmappedReads = []
         for name in self.unmapped_keep:
             if name in self.unmapped:
                 read = self.unmapped[name]
                 self.sv[get_seq_readname(read)] = (read, None, None, False)
+                unmappedReads.append(read)
                 lout = ">" + read.qname + "\n" + str(read.seq)
                 clipped_fa.write(lout + "\n")
+        self.set_trim_coords(unmappedReads)
 
         for name in self.sv:
             read, clip_seqs, clip_coords, indel_only = self.sv[name]
             if sv_bam:
                 sv_bam.write(read)
-            lout = fq_line(read, indel_only, kmer_size, True)
-            if lout:
-                reads_fq.write(lout)
+            if reads_fq:
+                lout = fq_line(read, indel_only, kmer_size, True, self.get_trim_coords(read, 5))
+                if lout:
+                    reads_fq.write(lout)
             if clip_seqs:
                 for clip in clip_seqs['buffered']:
                     clipped_fa.write(">" + name + "\n" + clip + "\n")
-        self.bam.close()
+        if self.closeBam:
+            self.bam.close()
 
     def clear_sv_reads(self):
         """
         """
 
         self.sv = None
+        self.trimCoords = {}
 
     def get_disc_reads(self):
         """This function needs to be updated to handle the new disc read storage.
@@ -0,0 +1,288 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""genome_filter.py module
+
+This module builds and queries a Bloom filter of the canonical kmers in the whole
+genome reference fasta. Sample-only kmers that are present elsewhere in the genome
+(paralogs, pseudogenes, mis-mapped reads) are then flagged, they are written out
+but kept for the assembly: the kmers on each side of a translocation junction are
+genome kmers of the partner regions and are needed to assemble the junction contigs.
+
+The filter is sized for the genome_filter_fpr false positive rate (default 0.01)
+with one kmer per base of the reference fasta file, an upper bound on the number of
+distinct kmers, unless its size is set in MB with genome_filter_memory. The filter
+bits are stored in <reference_data_dir>/genome_kmers_<k>mer.bloom.npy with a JSON
+report (<filter file>.json) containing the filter size, the number of hash functions,
+the fraction of bits set and the estimated false positive rate.
+"""
+
+import os
+import math
+import json
+import numpy as np
+import breakmer.utils as utils
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+FILTERS = {}  # GenomeKmerFilter objects keyed by filter file, loaded once per process.
+BASE_CODES = np.empty(256, dtype=np.uint8)  # 2-bit base codes indexed by the ASCII value, 4 for non-ACGT bases.
+BASE_CODES.fill(4)
+for _i, _base in enumerate('ACGT'):
+    BASE_CODES[ord(_base)] = _i
+    BASE_CODES[ord(_base.lower())] = _i
+BIT_COUNTS = np.array([bin(x).count('1') for x in range(256)], dtype=np.uint8)
+DEFAULT_FPR = 0.01  # Target false positive rate of the filter if genome_filter_fpr is not set.
+
+
+def get_filter_fn(params):
+    """Return the genome kmer filter file name for the analysis kmer size."""
+    return os.path.join(params.paths['ref_data'], 'genome_kmers_%dmer.bloom.npy' % params.get_kmer_size())
+
+
+def canonical_kmer_codes(bases, kmerLen):
+    """Return the canonical 2-bit encoded kmers of a base code array. The canonical
+    kmer is the smaller of the kmer and its reverse complement encodings.
+
+    Args:
+        bases (numpy.ndarray):  Array of base codes (0-3 for ACGT and 4 for others).
+        kmerLen (int):          Kmer length, at most 32.
+    Returns:
+        Array of uint64 canonical kmer codes, kmers with non-ACGT bases are skipped.
+    """
+
+    nkmers = len(bases) - kmerLen + 1
+    if nkmers <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    fwd = np.zeros(nkmers, dtype=np.uint64)
+    rev = np.zeros(nkmers, dtype=np.uint64)
+    for i in range(kmerLen):
+        baseCodes = (bases[i:(i + nkmers)] & 3).astype(np.uint64)
+        fwd = (fwd << np.uint64(2)) | baseCodes
+        rev |= (np.uint64(3) - baseCodes) << np.uint64(2 * i)
+    invalid = np.concatenate(([0], np.cumsum(bases > 3)))
+    valid = (invalid[kmerLen:] - invalid[0:nkmers]) == 0
+    return np.minimum(fwd, rev)[valid]
+
+
+def mix_hash(codes):
+    """Scramble 64-bit values with the splitmix64 finalizer."""
+    codes = codes + np.uint64(0x9E3779B97F4A7C15)
+    codes = (codes ^ (codes >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    codes = (codes ^ (codes >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return codes ^ (codes >> np.uint64(31))
+
+
+class GenomeKmerFilter:
+    """Bloom filter of the canonical genome kmers.
+
+    Attributes:
+        kmerLen (int):          Kmer length.
+        nbits (int):            Number of bits in the filter.
+        nhashes (int):          Number of hash functions.
+        bits (numpy.ndarray):   uint8 array with the filter bits.
+    """
+
+    def __init__(self, kmerLen, nbits, nhashes, bits=None):
+        self.kmerLen = kmerLen
+        self.nbits = nbits
+        self.nhashes = nhashes
+        self.bits = bits
+        if self.bits is None:
+            self.bits = np.zeros((nbits + 7) / 8, dtype=np.uint8)
+
+    def get_bit_indices(self, codes):
+        """Return the filter bit positions for each hash function (nhashes x len(codes) array)."""
+        h1 = mix_hash(codes)
+        h2 = mix_hash(h1) | np.uint64(1)
+        idx = np.empty((self.nhashes, len(codes)), dtype=np.uint64)
+        for i in range(self.nhashes):
+            idx[i] = (h1 + np.uint64(i) * h2) % np.uint64(self.nbits)
+        return idx
+
+    def add(self, codes):
+        """Set the filter bits for an array of kmer codes.
+
+        Args:
+            codes (numpy.ndarray):  Array of uint64 canonical kmer codes.
+        Returns:
+            None
+        """
+
+        if len(codes) == 0:
+            return
+        idx = np.unique(self.get_bit_indices(codes))
+        byteIdx = (idx >> np.uint64(3)).astype(np.int64)
+        masks = np.left_shift(1, (idx & np.uint64(7)).astype(np.uint8)).astype(np.uint8)
+        # Combine the bits in the same byte, since fancy indexing does not accumulate repeated indices.
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(byteIdx)) + 1))
+        self.bits[byteIdx[starts]] |= np.bitwise_or.reduceat(masks, starts)
+
+    def contains(self, codes):
+        """Return a boolean array indicating whether each kmer code is in the filter."""
+        if len(codes) == 0:
+            return np.zeros(0, dtype=bool)
+        idx = self.get_bit_indices(codes)
+        bitSet = (self.bits[(idx >> np.uint64(3)).astype(np.int64)] >> (idx & np.uint64(7)).astype(np.uint8)) & 1
+        return bitSet.all(axis=0)
+
+    def fill_fraction(self):
+        """Return the fraction of filter bits that are set."""
+        nset = 0
+        chunkSize = 1 << 24
+        for i in range(0, len(self.bits), chunkSize):
+            nset += int(BIT_COUNTS[self.bits[i:(i + chunkSize)]].sum(dtype=np.int64))
+        return float(nset) / self.nbits
+
+
+def iter_fasta_chunks(fastaFn, chunkSize, kmerLen):
+    """Iterate over a fasta file returning overlapping base code arrays, so that every
+    kmer of a sequence is in exactly one chunk.
+
+    Args:
+        fastaFn (str):      Path to the fasta file.
+        chunkSize (int):    Number of bases to accumulate before returning a chunk.
+        kmerLen (int):      Kmer length.
+    Returns:
+        Generator of numpy uint8 base code arrays.
+    """
+
+    buf = bytearray()
+    for line in open(fastaFn, 'r'):
+        if line.startswith('>'):
+            if len(buf) >= kmerLen:
+                yield BASE_CODES[np.frombuffer(bytes(buf), dtype=np.uint8)]
+            buf = bytearray()
+            continue
+        buf.extend(line.rstrip())
+        if len(buf) >= chunkSize:
+            yield BASE_CODES[np.frombuffer(bytes(buf), dtype=np.uint8)]
+            buf = buf[-(kmerLen - 1):]
+    if len(buf) >= kmerLen:
+        yield BASE_CODES[np.frombuffer(bytes(buf), dtype=np.uint8)]
+
+
+def get_filter_size(params, nkmersExpected):
+    """Return the number of bits and hash functions of the filter for the expected number
+    of genome kmers. The number of bits is set by the genome_filter_memory parameter (MB)
+    or for the genome_filter_fpr false positive rate, m = -n * ln(p) / ln(2)^2.
+
+    Args:
+        params (ParamManager):  Parameters for breakmer analysis.
+        nkmersExpected (int):   Expected number of distinct canonical genome kmers.
+    Returns:
+        Tuple with the number of bits and the number of hash functions.
+    """
+
+    if params.get_param('genome_filter_memory'):
+        nbits = int(params.get_param('genome_filter_memory')) * 8 * 1024 * 1024
+    else:
+        fpr = float(params.get_param('genome_filter_fpr') or DEFAULT_FPR)
+        nbits = int(math.ceil(-nkmersExpected * math.log(fpr) / (math.log(2) ** 2)))
+        nbits = ((nbits + 63) / 64) * 64
+    nhashes = max(1, min(16, int(round(math.log(2) * nbits / nkmersExpected))))
+    return nbits, nhashes
+
+
+def build_filter(params):
+    """Build the genome kmer Bloom filter from the reference fasta and write it
+    with its report, unless the filter of the same size exists for the reference.
+
+    Args:
+        params (ParamManager):  Parameters for breakmer analysis.
+    Returns:
+        None
+    """
+
+    loggingName = 'breakmer.processor.genome_filter'
+    filterFn = get_filter_fn(params)
+    refFastaFn = params.get_param('reference_fasta')
+    kmerLen = params.get_kmer_size()
+    refKey = utils.get_binary_key(refFastaFn)
+    nkmersExpected = max(1, os.path.getsize(refFastaFn))  # Upper bound on the number of distinct canonical kmers.
+    nbits, nhashes = get_filter_size(params, nkmersExpected)
+    report = read_report(filterFn)
+    if report is not None and report['reference_key'] == refKey and report['nbits'] == nbits and os.path.isfile(filterFn):
+        utils.log(loggingName, 'info', 'Genome kmer filter %s exists for reference %s, estimated false positive rate %f' % (filterFn, refFastaFn, report['fpr']))
+        return
+
+    utils.log(loggingName, 'info', 'Building genome kmer filter %s from %s with %d bits and %d hash functions' % (filterFn, refFastaFn, nbits, nhashes))
+    bloom = GenomeKmerFilter(kmerLen, nbits, nhashes)
+    nkmers = 0
+    for bases in iter_fasta_chunks(refFastaFn, 1 << 22, kmerLen):
+        codes = np.unique(canonical_kmer_codes(bases, kmerLen))
+        bloom.add(codes)
+        nkmers += len(codes)
+
+    fill = bloom.fill_fraction()
+    report = {'reference_fasta': refFastaFn,
+              'reference_key': refKey,
+              'kmer_size': kmerLen,
+              'nbits': nbits,
+              'nhashes': nhashes,
+              'kmers_added': nkmers,
+              'fill_fraction': fill,
+              'fpr': fill ** nhashes}
+    tmpFn = filterFn + '.tmp'
+    f = open(tmpFn, 'wb')
+    np.save(f, bloom.bits)
+    f.close()
+    os.rename(tmpFn, filterFn)
+    f = open(filterFn + '.json', 'w')
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.close()
+    utils.log(loggingName, 'info', 'Genome kmer filter built with %d kmers, %f of the bits set, estimated false positive rate %f' % (nkmers, fill, report['fpr']))
+    print 'Genome kmer filter estimated false positive rate %f (%d hash functions, %f of %d bits set)' % (report['fpr'], nhashes, fill, nbits)
+
+
+def read_report(filterFn):
+    """Return the filter report dictionary or None if it does not exist."""
+    if not os.path.isfile(filterFn + '.json'):
+        return None
+    return json.load(open(filterFn + '.json', 'r'))
+
+
+def get_filter(filterFn):
+    """Return the GenomeKmerFilter for a filter file, memory-mapping it the first time
+    it is requested in this process.
+
+    Args:
+        filterFn (str): Path to the filter file.
+    Returns:
+        GenomeKmerFilter object or None if the filter does not exist.
+    """
+
+    if filterFn not in FILTERS:
+        report = read_report(filterFn)
+        if report is None or not os.path.isfile(filterFn):
+            return None
+        FILTERS[filterFn] = GenomeKmerFilter(int(report['kmer_size']), int(report['nbits']), int(report['nhashes']), np.load(filterFn, mmap_mode='r'))
+    return FILTERS[filterFn]
+
+
+def check_kmers(kmers, filterFn, kmerLen):
+    """Return the kmers that are present in the genome kmer filter.
+
+    Args:
+        kmers (list):       List of kmer sequences.
+        filterFn (str):     Path to the filter file.
+        kmerLen (int):      Kmer length.
+    Returns:
+        List of the kmer sequences found in the genome.
+    """
+
+    bloom = get_filter(filterFn)
+    if bloom is None or len(kmers) == 0:
+        return []
+    bases = BASE_CODES[np.frombuffer(''.join(kmers), dtype=np.uint8)].reshape(len(kmers), kmerLen)
+    fwd = np.zeros(len(kmers), dtype=np.uint64)
+    rev = np.zeros(len(kmers), dtype=np.uint64)
+    for i in range(kmerLen):
+        baseCodes = (bases[:, i] & 3).astype(np.uint64)
+        fwd = (fwd << np.uint64(2)) | baseCodes
+        rev |= (np.uint64(3) - baseCodes) << np.uint64(2 * i)
+    found = bloom.contains(np.minimum(fwd, rev)) & (bases < 4).all(axis=1)
+    return [kmer for kmer, inGenome in zip(kmers, found) if inGenome]
@@ -0,0 +1,205 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""pon.py module
+
+This module builds and queries a panel of normals (PON) kmer database. The sample-only
+kmers of each target are counted in a set of normal samples and the kmers found in at
+least a minimum number of samples are stored per target as a sorted array of 2-bit
+encoded kmers (<pon_dir>/<target>.kmers.npy) with the number of samples containing each
+kmer (<pon_dir>/<target>.counts.npy). The arrays are memory-mapped when the database is
+used to subtract germline and recurrent artefact kmers from the sample-only kmers.
+"""
+
+import os
+import json
+import numpy as np
+import breakmer.utils as utils
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+MANIFEST_FN = 'pon_manifest.json'
+MAX_KMER_SIZE = 32  # Largest kmer encoded in a 64-bit integer with 2 bits per base.
+BASE_CODES = np.empty(256, dtype=np.uint8)  # 2-bit base codes indexed by the ASCII value, 4 for non-ACGT bases.
+BASE_CODES.fill(4)
+for _i, _base in enumerate('ACGT'):
+    BASE_CODES[ord(_base)] = _i
+    BASE_CODES[ord(_base.lower())] = _i
+
+
+def encode_kmers(kmers, kmerLen):
+    """Encode kmer sequences into 64-bit integers with 2 bits per base.
+
+    Args:
+        kmers (list):       List of kmer sequences.
+        kmerLen (int):      Kmer length, at most MAX_KMER_SIZE.
+    Returns:
+        codes (numpy.ndarray):  Array of uint64 encoded kmers.
+        valid (numpy.ndarray):  Boolean array, False for kmers with non-ACGT bases.
+    """
+
+    if len(kmers) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=bool)
+    bases = BASE_CODES[np.frombuffer(''.join(kmers), dtype=np.uint8).reshape(len(kmers), kmerLen)]
+    valid = (bases < 4).all(axis=1)
+    codes = np.zeros(len(kmers), dtype=np.uint64)
+    for i in range(kmerLen):
+        codes = (codes << np.uint64(2)) | (bases[:, i] & 3).astype(np.uint64)
+    return codes, valid
+
+
+def get_bam_list(params):
+    """Return the normal sample bam files listed in the pon_bam_list file, one path per line.
+
+    Args:
+        params (ParamManager):  Parameters for breakmer analysis.
+    Returns:
+        List of bam file paths.
+    """
+
+    bamFns = []
+    for line in open(params.get_param('pon_bam_list'), 'rU'):
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        bamFns.append(line)
+    return bamFns
+
+
+def get_target_fns(ponDir, targetName):
+    """Return the kmer and count array file names for a target."""
+    return os.path.join(ponDir, targetName + '.kmers.npy'), os.path.join(ponDir, targetName + '.counts.npy')
+
+
+def write_target_pon(ponDir, targetName, kmerSampleCounts, kmerLen, minSamples):
+    """Write the kmers found in at least minSamples normal samples for a target.
+
+    Args:
+        ponDir (str):               Path to the panel of normals directory.
+        targetName (str):           Target name.
+        kmerSampleCounts (dict):    Dictionary with kmer sequence keys and the number of samples
+                                    containing the kmer as values.
+        kmerLen (int):              Kmer length.
+        minSamples (int):           Minimum number of samples to keep a kmer.
+    Returns:
+        nkmers (int):               Number of kmers written.
+    """
+
+    kmers = [kmer for kmer in kmerSampleCounts if kmerSampleCounts[kmer] >= minSamples]
+    codes, valid = encode_kmers(kmers, kmerLen)
+    counts = np.array([kmerSampleCounts[kmer] for kmer in kmers], dtype=np.uint16)
+    codes, counts = codes[valid], counts[valid]
+    order = np.argsort(codes)
+    for fn, values in zip(get_target_fns(ponDir, targetName), (codes[order], counts[order])):
+        tmpFn = fn + '.tmp'
+        f = open(tmpFn, 'wb')
+        np.save(f, values)
+        f.close()
+        os.rename(tmpFn, fn)
+    return len(codes)
+
+
+def load_target_pon(ponDir, targetName):
+    """Memory-map the kmer and count arrays of a target.
+
+    Args:
+        ponDir (str):       Path to the panel of normals directory.
+        targetName (str):   Target name.
+    Returns:
+        Tuple with the kmer and count arrays or None if the target is not in the database.
+    """
+
+    kmerFn, countFn = get_target_fns(ponDir, targetName)
+    if not os.path.isfile(kmerFn) or not os.path.isfile(countFn):
+        return None
+    return np.load(kmerFn, mmap_mode='r'), np.load(countFn, mmap_mode='r')
+
+
+def subtract_kmers(kmers, ponDir, targetName, kmerLen, minSamples):
+    """Remove the kmers found in at least minSamples normal samples of the database.
+
+    Args:
+        kmers (list):       List of kmer sequences.
+        ponDir (str):       Path to the panel of normals directory.
+        targetName (str):   Target name.
+        kmerLen (int):      Kmer length.
+        minSamples (int):   Minimum number of samples containing a kmer to remove it.
+    Returns:
+        List of the kmer sequences not in the database.
+    """
+
+    pon = load_target_pon(ponDir, targetName)
+    if pon is None:
+        utils.log('breakmer.processor.pon', 'info', 'Target %s is not in the panel of normals %s, no kmers removed.' % (targetName, ponDir))
+        return kmers
+    ponKmers, ponCounts = pon
+    if len(kmers) == 0 or len(ponKmers) == 0:
+        return kmers
+    codes, valid = encode_kmers(kmers, kmerLen)
+    idx = np.minimum(np.searchsorted(ponKmers, codes), len(ponKmers) - 1)
+    found = valid & (ponKmers[idx] == codes) & (ponCounts[idx] >= minSamples)
+    utils.log('breakmer.processor.pon', 'info', 'Removed %d of %d sample-only kmers found in the panel of normals for target %s.' % (int(found.sum()), len(kmers), targetName))
+    return [kmer for kmer, inPon in zip(kmers, found) if not inPon]
+
+
+def write_manifest(params, targetNames):
+    """Write the panel of normals manifest with the build parameters.
+
+    Args:
+        params (ParamManager):  Parameters for breakmer analysis.
+        targetNames (list):     List of target names in the database.
+    Returns:
+        None
+    """
+
+    manifest = {'kmer_size': params.get_kmer_size(),
+                'min_samples': int(params.get_param('pon_min_samples')),
+                'samples': get_bam_list(params),
+                'targets': sorted(targetNames)}
+    f = open(os.path.join(params.get_param('pon_dir'), MANIFEST_FN), 'w')
+    json.dump(manifest, f, indent=2, sort_keys=True)
+    f.close()
+
+
+def read_manifest(ponDir):
+    """Return the panel of normals manifest dictionary or None if it does not exist."""
+    manifestFn = os.path.join(ponDir, MANIFEST_FN)
+    if not os.path.isfile(manifestFn):
+        return None
+    return json.load(open(manifestFn, 'r'))
+
+
+def build_targets(targetList):
+    """Count the sample-only kmers of each target in each normal sample and write
+    the panel of normals database arrays for the targets.
+
+    Args:
+        targetList (list):  A list of TargetManager objects.
+    Returns:
+        aggregateResults (dict): Empty contig and discordant read result lists, as for analyze_targets.
+    """
+
+    if len(targetList) == 0:
+        return {'contigs': [], 'discreads': []}
+    params = targetList[0].params
+    bamFns = get_bam_list(params)
+    kmerLen = params.get_kmer_size()
+    minSamples = int(params.get_param('pon_min_samples'))
+    for targetRegion in targetList:
+        utils.log('breakmer.processor.pon', 'info', 'Building panel of normals kmers for %s from %d samples' % (targetRegion.name, len(bamFns)))
+        targetRegion.set_ref_data()
+        kmerSampleCounts = {}
+        sampleKmerSets = {}
+        for sampleIdx, bamFn in enumerate(bamFns):
+            sampleKmers = frozenset(targetRegion.get_sample_only_kmers(bamFn, sampleIdx))
+            if len(sampleKmers) > 0 and sampleKmers in sampleKmerSets and os.path.realpath(sampleKmerSets[sampleKmers]) != os.path.realpath(bamFn):
+                utils.log('breakmer.processor.pon', 'warning', 'Normal samples %s and %s have the same %d sample-only kmers for %s, check that they are different samples.' % (sampleKmerSets[sampleKmers], bamFn, len(sampleKmers), targetRegion.name))
+            sampleKmerSets.setdefault(sampleKmers, bamFn)
+            for kmer in sampleKmers:
+                kmerSampleCounts[kmer] = kmerSampleCounts.get(kmer, 0) + 1
+        nkmers = write_target_pon(params.get_param('pon_dir'), targetRegion.name, kmerSampleCounts, kmerLen, minSamples)
+        utils.log('breakmer.processor.pon', 'info', 'Wrote %d panel of normals kmers for %s, %d kmers found in at least one sample' % (nkmers, targetRegion.name, len(kmerSampleCounts)))
+    return {'contigs': [], 'discreads': []}
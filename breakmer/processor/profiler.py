@@ -0,0 +1,191 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""profiler.py module
+
+This module profiles the analysis of selected targets inside the worker processes.
+The targets are set with the run options --profile_targets (comma separated target
+names or 'all') or --profile_slowest N, in which case all the targets are profiled
+and only the profiles of the N slowest targets are kept.
+
+For each profiled target the files are written to <targets_dir>/<target>/profile/:
+    <target>.pstats             cProfile statistics, readable with the pstats module.
+    <target>.profile.txt        Functions with the highest cumulative time.
+    <target>.allocations.txt    Largest allocation sites from tracemalloc with --profile_memory.
+                                The most numerous live object types are listed instead when the
+                                tracemalloc module is not available (python 2).
+
+The kept profiles are merged into <output_dir>/<analysis_name>_profile.pstats with a
+summary in <output_dir>/<analysis_name>_profile.txt.
+
+Only the thread running the target analysis is profiled, the contigs realigned and
+called in the contig_threads thread pool are not included when contig_threads > 1.
+"""
+
+import os
+import gc
+import sys
+import time
+import shutil
+import pstats
+import cProfile
+import breakmer.utils as utils
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+TOP_N = 50  # Number of functions and allocation sites written to the summaries.
+
+
+def get_target_profiler(targetRegion):
+    """Return a TargetProfiler for a target if it is selected for profiling.
+
+    Args:
+        targetRegion (TargetManager):   Target to analyze.
+    Returns:
+        TargetProfiler object or None if the target is not profiled.
+    """
+
+    params = targetRegion.params
+    if targetRegion.fnc != 'run':
+        return None
+    selected = params.get_param('profile_targets')
+    if not params.get_param('profile_slowest'):  # All the targets are profiled to find the slowest.
+        if not selected:
+            return None
+        if selected != 'all' and targetRegion.name not in selected.split(','):
+            return None
+    targetRegion.add_path('profile', os.path.join(targetRegion.paths['base'], 'profile'))
+    return TargetProfiler(targetRegion.name, targetRegion.paths['profile'], params.get_param('profile_memory'))
+
+
+class TargetProfiler:
+    """Class to profile the analysis of a target.
+
+    Attributes:
+        name (str):         Target name.
+        profileDir (str):   Path to the target profile directory.
+        memory (boolean):   Record the memory allocations.
+        profile (Profile):  cProfile Profile object.
+        startTime (float):  Wall time when the profiling started.
+    """
+
+    def __init__(self, name, profileDir, memory):
+        self.loggingName = 'breakmer.processor.profiler'
+        self.name = name
+        self.profileDir = profileDir
+        self.memory = memory
+        self.profile = cProfile.Profile()
+        self.startTime = None
+
+    def start(self):
+        """Start profiling."""
+        utils.log(self.loggingName, 'info', 'Profiling target %s, writing profiles to %s' % (self.name, self.profileDir))
+        if self.memory and tracemalloc is not None:
+            tracemalloc.start()
+        self.startTime = time.time()
+        self.profile.enable()
+
+    def stop(self):
+        """Stop profiling and write the profile files.
+
+        Args:
+            None
+        Returns:
+            record (dict):  Target name, profiled wall time, profile directory and pstats file name.
+        """
+
+        self.profile.disable()
+        wallTime = time.time() - self.startTime
+        pstatsFn = os.path.join(self.profileDir, self.name + '.pstats')
+        self.profile.dump_stats(pstatsFn)
+        write_summary(pstats.Stats(pstatsFn), os.path.join(self.profileDir, self.name + '.profile.txt'))
+        if self.memory:
+            self.write_allocations(os.path.join(self.profileDir, self.name + '.allocations.txt'))
+        utils.log(self.loggingName, 'info', 'Profiled target %s in %f seconds, profile written to %s' % (self.name, wallTime, pstatsFn))
+        return {'target': self.name, 'wall': wallTime, 'profile_dir': self.profileDir, 'pstats': pstatsFn}
+
+    def write_allocations(self, fn):
+        """Write the largest allocation sites recorded by tracemalloc or, if tracemalloc is
+        not available, the most numerous live object types.
+
+        Args:
+            fn (str):   Path to the output file.
+        Returns:
+            None
+        """
+
+        f = open(fn, 'w')
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            f.write('# tracemalloc current %d bytes, peak %d bytes\n' % (current, peak))
+            f.write('\t'.join(['size_bytes', 'count', 'location']) + '\n')
+            for stat in snapshot.statistics('lineno')[0:TOP_N]:
+                frame = stat.traceback[0]
+                f.write('\t'.join([str(stat.size), str(stat.count), '%s:%d' % (frame.filename, frame.lineno)]) + '\n')
+        else:
+            typeCounts = {}
+            typeSizes = {}
+            for obj in gc.get_objects():
+                typeName = type(obj).__name__
+                typeCounts[typeName] = typeCounts.get(typeName, 0) + 1
+                typeSizes[typeName] = typeSizes.get(typeName, 0) + sys.getsizeof(obj, 0)
+            f.write('# tracemalloc is not available, live objects tracked by gc at the end of the target analysis\n')
+            f.write('\t'.join(['shallow_size_bytes', 'count', 'type']) + '\n')
+            for typeName in sorted(typeCounts, key=lambda x: typeCounts[x], reverse=True)[0:TOP_N]:
+                f.write('\t'.join([str(typeSizes[typeName]), str(typeCounts[typeName]), typeName]) + '\n')
+        f.close()
+
+
+def write_summary(stats, fn):
+    """Write the functions with the highest cumulative time of a pstats.Stats object to a file."""
+    f = open(fn, 'w')
+    stats.stream = f
+    stats.sort_stats('cumulative').print_stats(TOP_N)
+    f.close()
+
+
+def merge_profiles(params, profileRecords):
+    """Keep the profiles of the selected targets and merge them into a single profile.
+    With the profile_slowest parameter the profile directories of all but the slowest
+    targets are removed.
+
+    Args:
+        params (ParamManager):  Parameters for breakmer analysis.
+        profileRecords (list):  List of the records returned by TargetProfiler.stop.
+    Returns:
+        None
+    """
+
+    loggingName = 'breakmer.processor.profiler'
+    if len(profileRecords) == 0:
+        return
+    profileRecords = sorted(profileRecords, key=lambda x: x['wall'], reverse=True)
+    nslowest = params.get_param('profile_slowest')
+    if nslowest:
+        keepTargets = set(params.get_param('profile_targets').split(',')) if params.get_param('profile_targets') else set()
+        keep = []
+        for i, record in enumerate(profileRecords):
+            if i < int(nslowest) or 'all' in keepTargets or record['target'] in keepTargets:
+                keep.append(record)
+            else:
+                shutil.rmtree(record['profile_dir'])
+        utils.log(loggingName, 'info', 'Kept the profiles of %d targets: %s' % (len(keep), ','.join([x['target'] for x in keep])))
+        profileRecords = keep
+
+    mergedFn = os.path.join(params.paths['output'], params.get_param('analysis_name') + '_profile.pstats')
+    stats = pstats.Stats(profileRecords[0]['pstats'])
+    for record in profileRecords[1:]:
+        stats.add(record['pstats'])
+    stats.dump_stats(mergedFn)
+    write_summary(stats, mergedFn.replace('.pstats', '.txt'))
+    utils.log(loggingName, 'info', 'Merged %d target profiles into %s' % (len(profileRecords), mergedFn))
@@ -0,0 +1,372 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""server.py module
+
+This module runs BreaKmer as a long-lived service, breakmer.py serve, that analyzes
+sample jobs with the state loaded once for all the samples: the configuration, the
+target definitions, the checked binaries, the panel of normals and genome filter
+checks, the blat server, the reference kmers of all the targets, loaded before the
+processor pool is created so that the processors share them, and the processor pool.
+
+A sample job is a JSON object with the sample bam file and optional parameters:
+    {"bam": "/data/S1.bam",
+     "analysis_name": "S1",                 (default: bam file name without .bam)
+     "analysis_dir": "/results/S1",         (default: <analysis_dir>/jobs/<analysis_name>)
+     "overrides": {"normal_bam_file": "/data/N1.bam", "indel_sr_thresh": 3, "gene_list": "genes.txt"}}
+The overrides are set as parameters of the job, the insert size threshold is
+estimated from the sample bam file unless it is set in the overrides. They are
+checked when the job is submitted (params.check_overrides): a job with an unknown
+parameter, a value of the wrong type or a missing file is rejected.
+
+Jobs are submitted:
+    - to the UNIX socket set with --socket, one JSON request per line, each answered with one
+      JSON line. A job request is answered when it is queued, or when it completes if it sets
+      "wait": true. The other requests are {"command": "status"}, {"command": "status",
+      "job_id": <id>} and {"command": "shutdown"}, i.e.
+        echo '{"bam": "/data/S1.bam", "wait": true}' | nc -U breakmer.sock
+    - as <name>.json files in the spool directory set with --spool_dir, written to a
+      temporary name and renamed. The job files are moved to <spool_dir>/queued/ and,
+      with the job status and results, to <spool_dir>/done/ or <spool_dir>/failed/.
+
+The jobs are analyzed one at a time in submission order, each with all the processors.
+The server stops after the current job on a shutdown request or SIGTERM, the jobs left
+in <spool_dir>/queued/ are queued again when it restarts.
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import signal
+import threading
+import traceback
+import Queue
+import SocketServer
+import multiprocessing
+import breakmer.utils as utils
+import breakmer.params as params
+import breakmer.processor.analysis as analysis
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+SPOOL_DIRS = ('queued', 'done', 'failed')
+
+
+class JobError(Exception):
+    """Error raised for a sample job that cannot be analyzed."""
+    pass
+
+
+def analyze_targets(targetList):
+    """Analyze a list of targets in a processor of the pool. An exit of the target analysis
+    is raised as a JobError so that the processor stays in the pool and the job fails.
+    """
+
+    try:
+        return analysis.analyze_targets(targetList)
+    except SystemExit as e:
+        raise JobError('Target analysis exited with status %s' % e.code)
+
+
+def init_processor():
+    """Ignore the interrupt and termination signals sent to the process group in the
+    processors of the pool, the server closes the pool when it stops. A processor
+    killed while it waits for a task would leave the pool locked.
+    """
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def format_time(timestamp):
+    """Return a timestamp formatted for the job records."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+
+def write_json(fn, obj):
+    """Write an object to a JSON file, through a temporary file."""
+    tmpFn = fn + '.tmp'
+    f = open(tmpFn, 'w')
+    json.dump(obj, f, indent=2, sort_keys=True)
+    f.close()
+    os.rename(tmpFn, fn)
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """Answer the JSON requests of a socket connection, one per line."""
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('Request is not a JSON object.')
+                response = self.server.sampleServer.handle_request(request)
+            except ValueError as e:
+                response = {'status': 'rejected', 'error': str(e)}
+            self.wfile.write(json.dumps(response, sort_keys=True) + '\n')
+            self.wfile.flush()
+
+
+class SocketJobServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """UNIX socket server handling each connection in a thread."""
+    daemon_threads = True
+
+
+class SampleServer:
+    """Class to run the sample jobs with the state loaded by the serve function.
+
+    Attributes:
+        params (ParamManager):  Parameters of the server, the base of the job parameters.
+        loggingName (str):      Module name for logging file purposes.
+        pool (Pool):            Processor pool used by all the jobs, None if nprocs is 1.
+        jobs (dict):            Job records keyed by job id.
+        jobOrder (list):        Job ids in submission order.
+        jobEvents (dict):       Events set when the jobs complete, keyed by job id.
+        queue (Queue):          Queued job ids.
+        lock (Lock):            Lock for the job records.
+        stopEvent (Event):      Set to stop the server after the current job.
+        socketServer (SocketJobServer): Server of the socket, if set.
+        spoolDir (str):         Spool directory, if set.
+        njobs (int):            Number of jobs submitted, to number the job ids.
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self.loggingName = 'breakmer.processor.server'
+        self.pool = None
+        self.jobs = {}
+        self.jobOrder = []
+        self.jobEvents = {}
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.socketServer = None
+        self.spoolDir = None
+        self.njobs = 0
+
+    def serve(self):
+        """Start the blat server, the processor pool and the job intake, then run the jobs
+        until the server is stopped.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+
+        socketFn = self.params.get_param('serve_socket')
+        if not socketFn and not self.params.get_param('spool_dir'):
+            utils.log(self.loggingName, 'error', 'Neither a socket nor a spool directory is set to accept jobs (--socket, --spool_dir), exiting.')
+            print 'Set --socket or --spool_dir to accept jobs.'
+            sys.exit(1)
+
+        self.params.start_blat_server()
+        analysis.set_reference_state(self.params)
+        nprocs = int(self.params.get_param('nprocs'))
+        if nprocs > 1:  # Started before the intake threads, the processors are forked once for all the jobs.
+            self.pool = multiprocessing.Pool(nprocs, init_processor)
+
+        if socketFn:
+            socketFn = os.path.abspath(socketFn)
+            if os.path.exists(socketFn):
+                os.remove(socketFn)
+            self.socketServer = SocketJobServer(socketFn, RequestHandler)
+            self.socketServer.sampleServer = self
+            os.chmod(socketFn, 0600)
+            self.start_thread(self.socketServer.serve_forever)
+            utils.log(self.loggingName, 'info', 'Accepting jobs on socket %s' % socketFn)
+        if self.params.get_param('spool_dir'):
+            self.spoolDir = os.path.abspath(self.params.get_param('spool_dir'))
+            for spoolSubdir in SPOOL_DIRS:
+                if not os.path.exists(os.path.join(self.spoolDir, spoolSubdir)):
+                    os.makedirs(os.path.join(self.spoolDir, spoolSubdir))
+            for jobFn in sorted(glob.glob(os.path.join(self.spoolDir, 'queued', '*.json'))):  # Jobs left by a previous server.
+                self.submit_spool_job(jobFn)
+            self.start_thread(self.poll_spool)
+            utils.log(self.loggingName, 'info', 'Accepting jobs in spool directory %s' % self.spoolDir)
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stopEvent.set())
+        print 'Server ready for jobs!'
+        try:
+            while not self.stopEvent.is_set():
+                try:
+                    jobId = self.queue.get(timeout=1)
+                except Queue.Empty:
+                    continue
+                self.run_job(jobId)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+        print 'Server stopped!'
+
+    def start_thread(self, target):
+        """Start a daemon thread."""
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop the job intake, the processor pool and the blat server."""
+
+        self.stopEvent.set()
+        if self.socketServer is not None:
+            self.socketServer.shutdown()
+            self.socketServer.server_close()
+            os.remove(self.socketServer.server_address)
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        self.params.stop_blat_server()
+        utils.log(self.loggingName, 'info', 'Server stopped, %d jobs queued' % self.queue.qsize())
+
+    def handle_request(self, request):
+        """Return the response to a socket request.
+
+        Args:
+            request (dict): Job or command request.
+        Returns:
+            response (dict): Response to the request.
+        Raises:
+            ValueError if the request is not valid.
+        """
+
+        command = request.get('command', 'submit')
+        if command == 'submit':
+            jobId = self.submit(request, 'socket')
+            if request.get('wait'):
+                self.jobEvents[jobId].wait()
+            return self.get_record(jobId)
+        elif command == 'status':
+            if 'job_id' in request:
+                if request['job_id'] not in self.jobs:
+                    raise ValueError('Unknown job %s.' % request['job_id'])
+                return self.get_record(request['job_id'])
+            return {'status': 'stopping' if self.stopEvent.is_set() else 'running',
+                    'queued': self.queue.qsize(),
+                    'jobs': [self.get_record(jobId) for jobId in self.jobOrder]}
+        elif command == 'shutdown':
+            utils.log(self.loggingName, 'info', 'Shutdown requested')
+            self.stopEvent.set()
+            return {'status': 'stopping', 'queued': self.queue.qsize()}
+        raise ValueError('Unknown command %s.' % command)
+
+    def get_record(self, jobId):
+        """Return a copy of a job record."""
+        with self.lock:
+            return dict(self.jobs[jobId])
+
+    def submit(self, job, source, spoolFn=None):
+        """Check and queue a sample job.
+
+        Args:
+            job (dict):     Sample job.
+            source (str):   Job source, socket or spool.
+            spoolFn (str):  Path to the job file in the spool queued directory.
+        Returns:
+            jobId (str):    Id of the queued job.
+        Raises:
+            ValueError if the job is not valid.
+        """
+
+        if self.stopEvent.is_set():
+            raise ValueError('Server is stopping.')
+        if not job.get('bam'):
+            raise ValueError('Job does not set the sample bam file (bam).')
+        if not os.path.isfile(job['bam']):
+            raise ValueError('Sample bam file %s does not exist.' % job['bam'])
+        if not isinstance(job.get('overrides', {}), dict):
+            raise ValueError('Job overrides are not a JSON object.')
+        overrides = params.check_overrides(job.get('overrides', {}))
+        analysisName = job.get('analysis_name') or os.path.basename(job['bam']).split('.bam')[0]
+        with self.lock:
+            self.njobs += 1
+            jobId = '%s_%d' % (analysisName, self.njobs)
+            self.jobs[jobId] = {'job_id': jobId,
+                                'status': 'queued',
+                                'source': source,
+                                'bam': os.path.abspath(job['bam']),
+                                'analysis_name': analysisName,
+                                'analysis_dir': os.path.abspath(job.get('analysis_dir') or os.path.join(self.params.paths['analysis'], 'jobs', analysisName)),
+                                'overrides': overrides,
+                                'submitted': format_time(time.time())}
+            self.jobOrder.append(jobId)
+            self.jobEvents[jobId] = threading.Event()
+            if spoolFn:
+                self.jobs[jobId]['spool_file'] = spoolFn
+        utils.log(self.loggingName, 'info', 'Queued job %s from %s, sample bam %s' % (jobId, source, job['bam']))
+        self.queue.put(jobId)
+        return jobId
+
+    def poll_spool(self):
+        """Claim and submit the job files of the spool directory every poll_interval seconds."""
+
+        while not self.stopEvent.is_set():
+            for jobFn in sorted(glob.glob(os.path.join(self.spoolDir, '*.json'))):
+                queuedFn = os.path.join(self.spoolDir, 'queued', os.path.basename(jobFn))
+                try:
+                    os.rename(jobFn, queuedFn)
+                except OSError:  # Claimed by another server.
+                    continue
+                self.submit_spool_job(queuedFn)
+            self.stopEvent.wait(float(self.params.get_param('poll_interval')))
+
+    def submit_spool_job(self, jobFn):
+        """Submit a job file of the spool queued directory, move it to the failed directory if it is not valid."""
+
+        try:
+            job = json.load(open(jobFn, 'r'))
+            if not isinstance(job, dict):
+                raise ValueError('Job is not a JSON object.')
+            self.submit(job, 'spool', jobFn)
+        except ValueError as e:
+            utils.log(self.loggingName, 'error', 'Job file %s rejected: %s' % (jobFn, str(e)))
+            write_json(os.path.join(self.spoolDir, 'failed', os.path.basename(jobFn)), {'status': 'rejected', 'error': str(e), 'job_file': jobFn})
+            os.remove(jobFn)
+
+    def run_job(self, jobId):
+        """Analyze a sample job and record its status, outputs and run time.
+
+        Args:
+            jobId (str):    Id of the job to run.
+        Returns:
+            None
+        """
+
+        startTime = time.time()
+        with self.lock:
+            record = self.jobs[jobId]
+            record['status'] = 'running'
+            record['started'] = format_time(startTime)
+        utils.log(self.loggingName, 'info', 'Running job %s' % jobId)
+        results = {}
+        try:
+            jobParams = self.params.get_sample_params(record['analysis_name'], record['bam'], record['analysis_dir'], record['overrides'])
+            runTracker = analysis.RunTracker(jobParams)
+            aggResults = runTracker.analyze(self.pool, analyze_targets)
+            runTracker.write_results(aggResults, startTime, self.pool)
+            results = {'status': 'done',
+                       'output_dir': jobParams.paths['output'],
+                       'targets': len(runTracker.targetNames),
+                       'contig_calls': len(aggResults['contigs']),
+                       'discread_calls': len(aggResults['discreads'])}
+        except (Exception, SystemExit) as e:  # A failed job does not stop the server.
+            utils.log(self.loggingName, 'error', 'Job %s failed: %s\n%s' % (jobId, str(e), traceback.format_exc()))
+            results = {'status': 'failed', 'error': '%s: %s' % (type(e).__name__, str(e))}
+        results['finished'] = format_time(time.time())
+        results['wall_time'] = round(time.time() - startTime, 3)
+        with self.lock:
+            record.update(results)
+        utils.log(self.loggingName, 'info', 'Job %s %s in %.1f seconds' % (jobId, record['status'], record['wall_time']))
+        if record.get('spool_file'):
+            write_json(os.path.join(self.spoolDir, record['status'], os.path.basename(record['spool_file'])), self.get_record(jobId))
+            os.remove(record['spool_file'])
+        self.jobEvents[jobId].set()
@@ -0,0 +1,273 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""shard.py module
+
+This module splits the targets of an analysis into shards that are run separately,
+i.e. on several nodes sharing the analysis directory, with run --shard i/N, and
+merges the shard outputs with the merge function.
+
+The targets are assigned to the N shards by cost-balanced hashing: each target ranks
+the shards by the hash of the target name and the shard number (rendezvous hashing)
+and is assigned to the first shard of its ranking whose total cost stays within
+SHARD_LOAD_FACTOR times the mean shard cost, the cost of a target being the span of
+its intervals. The targets are assigned by decreasing cost, ties broken by name, and
+a target that fits in no shard goes to the shard with the lowest total cost. Every
+shard computes the same assignment from the same targets bed file and gene list, most
+targets keep their shard when targets are added to or removed from the panel, and the
+total cost of a shard is at most SHARD_LOAD_FACTOR times the mean or the cost of its
+largest target.
+
+Each shard writes the standard output files, the run statistics and its log file to
+<analysis_dir>/shards/shard_<i>_of_<N>/, followed by <analysis_name>_shard_manifest.json
+listing the targets of the shard and the number of output lines of each target. The
+merge function checks that the manifests of all the shards are present and that every
+target was analyzed by exactly one shard, then returns the output lines of all the
+targets in target name order, the order of an analysis run on a single node.
+"""
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import breakmer.utils as utils
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+MANIFEST_SUFFIX = '_shard_manifest.json'
+SHARD_LOAD_FACTOR = 1.1  # Maximum total cost of a shard relative to the mean shard cost.
+
+
+def parse_shard(shardStr):
+    """Return the shard number and the number of shards of a shard specification string.
+
+    Args:
+        shardStr (str):     Shard specification, i/N with 1 <= i <= N.
+    Returns:
+        Tuple with the shard number and the number of shards.
+    Raises:
+        ValueError if the specification is not valid.
+    """
+
+    try:
+        shardIdx, nshards = [int(x) for x in shardStr.split('/')]
+    except ValueError:
+        raise ValueError('Shard %s is not formatted as i/N.' % shardStr)
+    if nshards < 1 or shardIdx < 1 or shardIdx > nshards:
+        raise ValueError('Shard %s is not between 1/N and N/N.' % shardStr)
+    return shardIdx, nshards
+
+
+def get_shard_name(shardStr):
+    """Return the shard directory name, shard_<i>_of_<N>."""
+    return 'shard_%d_of_%d' % parse_shard(shardStr)
+
+
+def get_target_cost(params, targetName):
+    """Return the expected analysis cost of a target, the span of its intervals."""
+    intervals = params.get_target_intervals(targetName)
+    return max([x[2] for x in intervals]) - min([x[1] for x in intervals])
+
+
+def get_targets_key(targetNames):
+    """Return a key for a list of target names, to check that the shards analyzed the same targets."""
+    return hashlib.sha1(','.join(sorted(targetNames))).hexdigest()
+
+
+def get_shard_ranking(targetName, nshards):
+    """Return the shard indices ranked by the hash of the target name and the shard index."""
+    return sorted(range(nshards), key=lambda i: hashlib.sha1('%s:%d' % (targetName, i)).hexdigest())
+
+
+def assign_targets(params, nshards):
+    """Assign all the targets to the shards by cost-balanced hashing.
+
+    Args:
+        params (ParamManager):  Parameters for breakmer analysis.
+        nshards (int):          Number of shards.
+    Returns:
+        shards (list):  List of nshards lists of target names, sorted by name.
+    """
+
+    targetCosts = [(get_target_cost(params, targetName), targetName) for targetName in params.get_target_names()]
+    maxLoad = SHARD_LOAD_FACTOR * sum([x[0] for x in targetCosts]) / nshards
+    shards = [[] for i in range(nshards)]
+    loads = [0] * nshards
+    for cost, targetName in sorted(targetCosts, key=lambda x: (-x[0], x[1])):
+        ranking = get_shard_ranking(targetName, nshards)
+        fits = [i for i in ranking if loads[i] + cost <= maxLoad]
+        shardIdx = fits[0] if fits else min(ranking, key=lambda i: loads[i])
+        shards[shardIdx].append(targetName)
+        loads[shardIdx] += cost
+    return [sorted(shard) for shard in shards]
+
+
+def get_shard_targets(params):
+    """Return the sorted target names to analyze, all the targets or the targets of the
+    shard set with the shard parameter.
+
+    Args:
+        params (ParamManager):  Parameters for breakmer analysis.
+    Returns:
+        targetNames (list):     Sorted list of target names.
+    """
+
+    targetNames = sorted(params.get_target_names())
+    if not params.get_param('shard'):
+        return targetNames
+    shardIdx, nshards = parse_shard(params.get_param('shard'))
+    shardTargets = assign_targets(params, nshards)[shardIdx - 1]
+    utils.log('breakmer.processor.shard', 'info', 'Shard %d of %d: analyzing %d of %d targets, total target span %d bp' % (shardIdx, nshards, len(shardTargets), len(targetNames), sum([get_target_cost(params, x) for x in shardTargets])))
+    manifestFn = get_manifest_fn(params.paths['output'], params.get_param('analysis_name'))
+    if os.path.isfile(manifestFn):  # Remove the manifest of a previous run so the shard is not merged before it completes.
+        os.remove(manifestFn)
+    return shardTargets
+
+
+def get_manifest_fn(shardDir, analysisName):
+    """Return the path to the manifest file of a shard directory."""
+    return os.path.join(shardDir, analysisName + MANIFEST_SUFFIX)
+
+
+def write_manifest(params, targetNames, aggregateResults):
+    """Write the manifest of a completed shard, after its output files.
+
+    Args:
+        params (ParamManager):      Parameters for breakmer analysis.
+        targetNames (list):         Target names assigned to the shard.
+        aggregateResults (dict):    Aggregated results of the shard targets, with the number of contig
+                                    and discordant read output lines of each target in 'targets'.
+    Returns:
+        None
+    """
+
+    shardIdx, nshards = parse_shard(params.get_param('shard'))
+    headers = {}
+    for key in ('contigs', 'discreads'):
+        headers[key] = aggregateResults[key][0][0] if len(aggregateResults[key]) > 0 else None
+    manifest = {'analysis_name': params.get_param('analysis_name'),
+                'shard': shardIdx,
+                'nshards': nshards,
+                'targets_key': get_targets_key(params.get_target_names()),
+                'assigned_targets': sorted(targetNames),
+                'targets': [{'name': name, 'contigs': ncontigs, 'discreads': ndiscreads} for name, ncontigs, ndiscreads in aggregateResults.get('targets', [])],
+                'headers': headers,
+                'output_header': not params.get_param('no_output_header')}
+    manifestFn = get_manifest_fn(params.paths['output'], params.get_param('analysis_name'))
+    tmpFn = manifestFn + '.tmp'
+    f = open(tmpFn, 'w')
+    json.dump(manifest, f, indent=2, sort_keys=True)
+    f.close()
+    os.rename(tmpFn, manifestFn)
+    utils.log('breakmer.processor.shard', 'info', 'Wrote shard manifest %s' % manifestFn)
+
+
+def read_output_lines(fn, hasHeader, nlines):
+    """Return the output lines of a shard output file without the header.
+
+    Args:
+        fn (str):           Path to the output file.
+        hasHeader (boolean):    The file starts with a header line.
+        nlines (int):       Expected number of output lines.
+    Returns:
+        List of output lines or None if the file does not have the expected number of lines.
+    """
+
+    if nlines == 0:
+        return []
+    if not os.path.isfile(fn):
+        return None
+    lines = [line.rstrip('\n') for line in open(fn, 'r')]
+    if hasHeader:
+        lines = lines[1:]
+    if len(lines) != nlines:
+        return None
+    return lines
+
+
+def merge_shards(params):
+    """Check the shard manifests and return the output lines of all the shards.
+
+    Exits with an error if a shard is missing or incomplete, if a target was analyzed by
+    more than one shard or by none, or if the shards were run on different targets.
+
+    Args:
+        params (ParamManager):  Parameters for breakmer analysis.
+    Returns:
+        aggregateResults (dict):    Lists of (header, output line) tuples for the contig-based calls and
+                                    the discordant read clusters of all the targets, in target name order.
+    """
+
+    loggingName = 'breakmer.processor.shard'
+    analysisName = params.get_param('analysis_name')
+    manifestFns = sorted(glob.glob(os.path.join(params.paths['analysis'], 'shards', 'shard_*_of_*', analysisName + MANIFEST_SUFFIX)))
+    errors = []
+    manifests = []
+    for manifestFn in manifestFns:
+        manifest = json.load(open(manifestFn, 'r'))
+        manifest['dir'] = os.path.dirname(manifestFn)
+        manifests.append(manifest)
+    nshardsSet = set([manifest['nshards'] for manifest in manifests])
+    if len(manifests) == 0:
+        errors.append('No shard manifests found in %s' % os.path.join(params.paths['analysis'], 'shards'))
+    elif len(nshardsSet) > 1:
+        errors.append('Shard manifests from runs with different numbers of shards: %s' % ','.join([str(x) for x in sorted(nshardsSet)]))
+    else:
+        nshards = nshardsSet.pop()
+        missing = sorted(set(range(1, nshards + 1)) - set([manifest['shard'] for manifest in manifests]))
+        if missing:
+            errors.append('Missing or incomplete shards %s of %d' % (','.join([str(x) for x in missing]), nshards))
+
+    targetNames = sorted(params.get_target_names())
+    targetsKey = get_targets_key(targetNames)
+    targetShards = {}
+    for manifest in manifests:
+        if manifest['targets_key'] != targetsKey:
+            errors.append('Shard %d of %d was run on different targets' % (manifest['shard'], manifest['nshards']))
+        analyzed = [target['name'] for target in manifest['targets']]
+        if sorted(analyzed) != manifest['assigned_targets']:
+            errors.append('Shard %d of %d did not analyze all of its %d targets' % (manifest['shard'], manifest['nshards'], len(manifest['assigned_targets'])))
+        for targetName in analyzed:
+            targetShards.setdefault(targetName, []).append(manifest['shard'])
+    for targetName in targetNames:
+        if targetName not in targetShards:
+            errors.append('Target %s was not analyzed by any shard' % targetName)
+        elif len(targetShards[targetName]) > 1:
+            errors.append('Target %s was analyzed by shards %s' % (targetName, ','.join([str(x) for x in targetShards[targetName]])))
+    for targetName in sorted(set(targetShards) - set(targetNames)):
+        errors.append('Target %s analyzed by shard %s is not in the targets' % (targetName, targetShards[targetName][0]))
+
+    targetOutputs = {}
+    for manifest in manifests:
+        outputLines = {}
+        for key, suffix in (('contigs', '_svs.all.out'), ('discreads', '_discreads.out')):
+            outputFn = os.path.join(manifest['dir'], analysisName + suffix)
+            outputLines[key] = read_output_lines(outputFn, manifest['output_header'], sum([target[key] for target in manifest['targets']]))
+            if outputLines[key] is None:
+                errors.append('Output file %s of shard %d does not match its manifest' % (outputFn, manifest['shard']))
+                outputLines[key] = []
+        offsets = {'contigs': 0, 'discreads': 0}
+        for target in manifest['targets']:
+            targetOutputs[target['name']] = {}
+            for key in offsets:
+                lines = outputLines[key][offsets[key]:(offsets[key] + target[key])]
+                targetOutputs[target['name']][key] = [(manifest['headers'][key], line) for line in lines]
+                offsets[key] += target[key]
+
+    if errors:
+        for error in errors:
+            utils.log(loggingName, 'error', error)
+        utils.log(loggingName, 'error', 'Shard outputs not merged, exiting.')
+        print 'Shard outputs not merged:\n' + '\n'.join(errors)
+        sys.exit(1)
+
+    aggregateResults = {'contigs': [], 'discreads': []}
+    for targetName in targetNames:
+        for key in aggregateResults:
+            aggregateResults[key].extend(targetOutputs[targetName][key])
+    utils.log(loggingName, 'info', 'Merged the outputs of %d shards, %d targets, %d contig calls and %d discordant read clusters' % (len(manifests), len(targetNames), len(aggregateResults['contigs']), len(aggregateResults['discreads'])))
+    return aggregateResults
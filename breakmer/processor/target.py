@@ -5,15 +5,23 @@ import os
 import pysam
 import shutil
 import subprocess
+from multiprocessing.pool import ThreadPool
 import breakmer.utils as utils
 import breakmer.processor.bam_handler as bam_handler
+import breakmer.processor.adapter_trimmer as adapter_trimmer
+import breakmer.processor.pon as pon
+import breakmer.processor.genome_filter as genome_filter
 import breakmer.assembly.assembler as assembly
+import breakmer.assembly.dbg as dbgAssembly
 
 __author__ = "Ryan Abo"
 __copyright__ = "Copyright 2015, Ryan Abo"
 __email__ = "ryanabo@gmail.com"
 __license__ = "MIT"
 
+STAGE_PREFIXES = {'sv': '', 'norm': 'normal_'}  # Stage name prefixes for the sample types.
+REFERENCE_KMERS = {}  # Reference kmers of the targets loaded before the processors are forked, keyed by the reference files and kmer size.
+
 
 def load_kmers(fns, kmers):
     """Iterate through the kmer flat files and store them in the kmers dictionary.
@@ -56,11 +64,13 @@ class Variation:
         results (list):
         discReadClusters (dict):
         discReadFormatted (list):
+        stageTracker (StageTracker):    Records the timing and counts of the kmer and assembly stages.
     """
 
-    def __init__(self, params):
+    def __init__(self, params, stageTracker):
         self.loggingName = 'breakmer.processor.target'
         self.params = params
+        self.stageTracker = stageTracker
         self.var_reads = {}
         self.cleaned_read_recs = None
         self.kmer_clusters = []
@@ -125,16 +135,17 @@ class Variation:
 
         self.results.append(result)
 
-    def set_var_reads(self, sampleType, bamFile, chrom, start, end, regionBuffer):
+    def set_var_reads(self, sampleType, bamFile, chrom, start, end, regionBuffer, reads=None):
         """
 
         Args:
             sampleType ():
-            bamFile ():
+            bamFile ():         Bam file path or open pysam bam file object.
             chrom ():
             start ():
             end ():
             regionBuffer ():
+            reads (iterable):   Reads of the region to use instead of the reads fetched from the bam file.
         Returns:
             None
         Raises:
@@ -142,7 +153,7 @@ class Variation:
         """
 
         # Get VariantReadTracker object from bam_handler module and extract reads.
-        self.var_reads[sampleType] = bam_handler.get_variant_reads(bamFile, chrom, start - regionBuffer, end - regionBuffer, self.params.get_param('insertsize_thresh'))
+        self.var_reads[sampleType] = bam_handler.get_variant_reads(bamFile, chrom, start - regionBuffer, end - regionBuffer, self.params.get_param('insertsize_thresh'), reads)
         # Iterate through reads that are not perfectly aligned and store necessary information for downstream analysis.
         # Store the reads with softclipped sequences that are high quality in VariantReadTracker.sv dictionary.
         self.var_reads[sampleType].check_clippings(self.params.get_kmer_size(), start, end)
@@ -150,12 +161,15 @@ class Variation:
         # Write the bam, fastq, and fasta files with the extracted reads.
         svBam = None
         if sampleType == 'sv':
-            svBam = pysam.Samfile(self.files['sv_bam'], 'wb', template=pysam.Samfile(bamFile, 'rb'))
-        readsFq = open(self.files['%s_fq' % sampleType], 'w')
+            svBam = pysam.Samfile(self.files['sv_bam'], 'wb', template=pysam.Samfile(bamFile, 'rb') if isinstance(bamFile, basestring) else bamFile)
+        readsFq = None
+        if self.params.get_param('adapter_trimmer') != 'internal':  # The internal trimmer cleans the reads in memory.
+            readsFq = open(self.files['%s_fq' % sampleType], 'w')
         scFa = open(self.files['%s_sc_unmapped_fa' % sampleType], 'w')
         # Write all the stored sequences into files.
         self.var_reads[sampleType].write_seqs(scFa, readsFq, svBam, self.params.get_kmer_size())
-        readsFq.close()
+        if readsFq:
+            readsFq.close()
         scFa.close()
 
         # Close the bam file, sort and index.
@@ -188,6 +202,8 @@ class Variation:
         self.files['%s_fq' % sampleType] = os.path.join(dataPath, name + '_%s_reads.fastq' % sampleType)
         # Store softclipped sequences in a fasta file <data_path>/<target_name>_<type>_sc_seqs.fa
         self.files['%s_sc_unmapped_fa' % sampleType] = os.path.join(dataPath, name + '_%s_sc_seqs.fa' % sampleType)
+        # Store cutadapt cleaned reads in <data_path>/<target_name>_<type>_reads_cleaned.fastq
+        self.files['%s_cleaned_fq' % sampleType] = os.path.join(dataPath, name + '_%s_reads_cleaned.fastq' % sampleType)
 
         if sampleType == 'sv':
             # Store variant reads in bam formatted file <data_path>/<target_name>_sv_reads.bam
@@ -215,27 +231,44 @@ class Variation:
                               cleaning is complete.
         """
 
-        cutadapt = self.params.get_param('cutadapt')  # Cutadapt binary
-        cutadaptConfigFn = self.params.get_param('cutadapt_config_file')
-        utils.log(self.loggingName, 'info', 'Cleaning reads using %s with configuration file %s' % (cutadapt, cutadaptConfigFn))
-        self.files['%s_cleaned_fq' % sampleType] = os.path.join(dataPath, name + '_%s_reads_cleaned.fastq' % sampleType)
-        utils.log(self.loggingName, 'info', 'Writing clean reads to %s' % self.files['%s_cleaned_fq' % sampleType])
-        output, errors = utils.run_cutadapt(cutadapt, cutadaptConfigFn, self.files['%s_fq' % sampleType], self.files['%s_cleaned_fq' % sampleType], self.loggingName)
-
         self.setup_cleaned_reads(sampleType)
-        self.files['%s_cleaned_fq' % sampleType], self.cleaned_read_recs[sampleType] = utils.get_fastq_reads(self.files['%s_cleaned_fq' % sampleType], self.get_sv_reads(sampleType))
+        if self.params.get_param('adapter_trimmer') == 'internal':
+            # Trim the reads stored in the VariantReadTracker in-process and only write the kept reads for kmer counting.
+            self.files['%s_cleaned_fq' % sampleType] = os.path.join(dataPath, name + '_%s_reads_cleaned_filtered.fastq' % sampleType)
+            utils.log(self.loggingName, 'info', 'Cleaning reads in-process with configuration file %s, writing clean reads to %s' % (self.params.get_param('cutadapt_config_file'), self.files['%s_cleaned_fq' % sampleType]))
+            self.cleaned_read_recs[sampleType] = adapter_trimmer.trim_sv_reads(self.var_reads[sampleType], adapter_trimmer.get_trimmer(self.params.get_param('cutadapt_config_file')), self.params.get_kmer_size(), self.files['%s_cleaned_fq' % sampleType])
+        else:
+            if self.params.get_param('adapter_trimmer') != 'cutadapt_batch':  # Batch mode cleaned reads are already written.
+                cutadapt = self.params.get_param('cutadapt')  # Cutadapt binary
+                cutadaptConfigFn = self.params.get_param('cutadapt_config_file')
+                utils.log(self.loggingName, 'info', 'Cleaning reads using %s with configuration file %s' % (cutadapt, cutadaptConfigFn))
+                utils.log(self.loggingName, 'info', 'Writing clean reads to %s' % self.files['%s_cleaned_fq' % sampleType])
+                output, errors = utils.run_cutadapt(cutadapt, cutadaptConfigFn, self.files['%s_fq' % sampleType], self.files['%s_cleaned_fq' % sampleType], self.loggingName)
+            self.files['%s_cleaned_fq' % sampleType], self.cleaned_read_recs[sampleType] = utils.get_fastq_reads(self.files['%s_cleaned_fq' % sampleType], self.get_sv_reads(sampleType))
         self.clear_sv_reads(sampleType)
         check = self.continue_analysis_check(sampleType)
         utils.log(self.loggingName, 'info', 'Clean reads exist %s' % check)
         return check
 
-    def set_reference_kmers(self, targetRefFns):
-        """Set the reference sequence kmers"""
+    def set_reference_kmers(self, targetRefFns, keep=False):
+        """Set the reference sequence kmers. The kmers loaded with keep set are kept in the
+        process: a run with a samples manifest and the serve function load the kmers of all
+        the targets before the processors are forked, so that every processor finds them
+        whichever targets it is given, without a copy per processor.
+        """
+
+        refKey = (tuple([(fn, os.path.getmtime(fn)) for fn in targetRefFns]), self.params.get_kmer_size())
+        if refKey in REFERENCE_KMERS:
+            utils.log(self.loggingName, 'info', 'Using loaded kmers for reference sequences %s' % ','.join(targetRefFns))
+            self.kmers['ref'] = REFERENCE_KMERS[refKey]
+            return
 
         self.kmers['ref'] = {}
         for i in range(len(targetRefFns)):
             utils.log(self.loggingName, 'info', 'Indexing kmers for reference sequence %s' % targetRefFns[i])
             self.get_kmers(targetRefFns[i], self.kmers['ref'])
+        if keep:
+            REFERENCE_KMERS[refKey] = self.kmers['ref']
 
     def set_sample_kmers(self):
         """Set the sample kmers
@@ -247,6 +280,16 @@ class Variation:
         self.get_kmers(self.files['sv_cleaned_fq'], self.kmers['case'])
         self.get_kmers(self.files['sv_sc_unmapped_fa'], self.kmers['case_sc'])
 
+    def set_normal_kmers(self):
+        """Set the normal sample kmers
+        """
+
+        utils.log(self.loggingName, 'info', 'Indexing kmers for normal sequence %s' % self.files['norm_cleaned_fq'])
+        self.stageTracker.start('normal_kmer_counting')
+        self.kmers['norm'] = {}
+        self.get_kmers(self.files['norm_cleaned_fq'], self.kmers['norm'])
+        self.stageTracker.stop('normal_kmer_counting', normal_kmers=len(self.kmers['norm']))
+
     def get_kmers(self, seqFn, kmerDict):
         """Generic function to run jellyfish on a set of sequences
         """
@@ -254,26 +297,54 @@ class Variation:
         jellyfish = self.params.get_param('jellyfish')
         kmer_size = self.params.get_kmer_size()
         # Load the kmers into the kmer dictionary based on keyStr value.
-        load_kmers(utils.run_jellyfish(seqFn, jellyfish, kmer_size), kmerDict)
+        load_kmers(utils.run_jellyfish(seqFn, jellyfish, kmer_size, self.params.get_param('jellyfish_version')), kmerDict)
 
-    def compare_kmers(self, kmerPath, name, readLen, targetRefFns):
-        """
+    def get_sample_only_kmers(self, targetRefFns):
+        """Return the kmers in the cleaned sample reads and the softclipped sequences
+        that are not in the target reference sequence. The reference kmers are only
+        counted if they are not already set.
         """
 
         # Set the reference sequence kmers.
-        self.set_reference_kmers(targetRefFns)
+        if not self.kmers.get('ref'):
+            self.set_reference_kmers(targetRefFns)
 
         # Set sample kmers.
         self.set_sample_kmers()
         # Merge the kmers from the cleaned sample sequences and the unmapped and softclipped sequences.
         scKmers = set(self.kmers['case'].keys()) & set(self.kmers['case_sc'].keys())
         # Take the difference from the reference kmers.
-        sampleOnlyKmers = list(scKmers.difference(set(self.kmers['ref'].keys())))
+        return list(scKmers.difference(set(self.kmers['ref'].keys())))
+
+    def compare_kmers(self, kmerPath, name, readLen, targetRefFns, normTask=None):
+        """
+        """
+
+        self.stageTracker.start('kmer_counting')
+        sampleOnlyKmers = self.get_sample_only_kmers(targetRefFns)
+        self.stageTracker.stop('kmer_counting', sample_kmers=len(self.kmers['case']), reference_kmers=len(self.kmers['ref']))
+
+        self.stageTracker.start('kmer_subtraction')  # Includes the wait for the normal sample kmers counted in the background.
         # Add normal sample kmers if available.
         if self.params.get_param('normal_bam_file'):
-            normKmers = {}
-            self.get_kmers(self.files['norm_cleaned_fq'], normKmers)
-            sampleOnlyKmers = list(set(sampleOnlyKmers).difference(set(normKmers.keys())))
+            if normTask is None:
+                self.set_normal_kmers()
+            else:
+                normTask.get()  # Wait for the normal sample kmers counted in the background.
+            sampleOnlyKmers = list(set(sampleOnlyKmers).difference(set(self.kmers['norm'].keys())))
+        # Remove the kmers in the panel of normals if available.
+        if self.params.get_param('pon_dir'):
+            sampleOnlyKmers = pon.subtract_kmers(sampleOnlyKmers, self.params.get_param('pon_dir'), name, self.params.get_kmer_size(), int(self.params.get_param('pon_min_samples')))
+        # Flag the kmers present elsewhere in the genome if the genome kmer filter is used, they are kept
+        # for the assembly as the kmers on the partner side of a translocation junction are genome kmers.
+        if self.params.get_param('genome_kmer_filter'):
+            genomeKmers = genome_filter.check_kmers(sampleOnlyKmers, genome_filter.get_filter_fn(self.params), self.params.get_kmer_size())
+            self.files['genome_kmers'] = os.path.join(kmerPath, name + "_genome_kmers.out")
+            genome_kmer_fout = open(self.files['genome_kmers'], 'w')
+            for mer in genomeKmers:
+                genome_kmer_fout.write("\t".join([mer, str(self.kmers['case'][mer])]) + "\n")
+            genome_kmer_fout.close()
+            utils.log(self.loggingName, 'info', '%d of %d sample-only kmers found in the genome kmer filter, written to %s' % (len(genomeKmers), len(sampleOnlyKmers), self.files['genome_kmers']))
 
         # Write case only kmers out to file.
         self.files['sample_kmers'] = os.path.join(kmerPath, name + "_sample_kmers.out")
@@ -284,17 +355,26 @@ class Variation:
             sample_kmer_fout.write("\t".join([str(x) for x in [mer, str(self.kmers['case'][mer])]]) + "\n")
             self.kmers['case_only'][mer] = self.kmers['case'][mer]
         sample_kmer_fout.close()
+        self.stageTracker.stop('kmer_subtraction', sample_only_kmers=len(self.kmers['case_only']))
 
         # Clean out data structures.
         self.kmers['ref'] = {}
         self.kmers['case'] = {}
         self.kmers['case_sc'] = {}
+        self.kmers['norm'] = {}
 
         utils.log(self.loggingName, 'info', 'Writing %d sample-only kmers to file %s' % (len(self.kmers['case_only']), self.files['sample_kmers']))
         self.files['kmer_clusters'] = os.path.join(kmerPath, name + "_sample_kmers_merged.out")
         utils.log(self.loggingName, 'info', 'Writing kmer clusters to file %s' % self.files['kmer_clusters'])
 
-        self.kmers['clusters'] = assembly.init_assembly(self.kmers['case_only'], self.cleaned_read_recs['sv'], self.params.get_kmer_size(), self.params.get_sr_thresh('min'), readLen)
+        assembleFnc = assembly.init_assembly
+        assembleOptions = {}
+        if self.params.get_param('assembly_engine') == 'dbg':
+            assembleFnc = dbgAssembly.init_assembly
+            assembleOptions = {'minCount': int(self.params.get_param('dbg_min_kmer_count') or 2), 'maxCoverageRatio': float(self.params.get_param('dbg_max_coverage_ratio') or 4.0)}
+        self.stageTracker.start('assembly')
+        self.kmers['clusters'] = assembleFnc(self.kmers['case_only'], self.cleaned_read_recs['sv'], self.params.get_kmer_size(), self.params.get_sr_thresh('min'), readLen, **assembleOptions)
+        self.stageTracker.stop('assembly', contigs=len(self.kmers['clusters']))
         self.clear_cleaned_reads()
         self.kmers['case_only'] = {}
 
@@ -389,6 +469,9 @@ class TargetManager(object):
         read_len (int):             Length of a single read.
         variation (Variation):      Stores data for variants identified within the target.
         regionBuffer (int):         Base pairs to add or subtract from the target region end and start locations.
+        normTask (BackgroundTask):  Thread processing the normal sample reads, None if not running.
+        renderJobs (list):          RenderJob objects to generate the pileup images after the calls are made.
+        stageTracker (StageTracker): Records the timing, resource use and counts of the analysis stages.
     """
 
     def __init__(self, name, params):
@@ -401,8 +484,11 @@ class TargetManager(object):
         self.paths = {}
         self.files = {}
         self.readLen = int(params.get_param('readLen'))
-        self.variation = Variation(params)
+        self.stageTracker = utils.StageTracker(name)
+        self.variation = Variation(params, self.stageTracker)
         self.regionBuffer = 200
+        self.normTask = None
+        self.renderJobs = []
         self.setup()
 
     @property
@@ -460,11 +546,12 @@ class TargetManager(object):
             <target name>/
         '''
         self.add_path('ref_data', os.path.join(self.params.paths['ref_data'], self.name))
-        if self.params.fncCmd == 'run':
+        if self.params.fncCmd in ('run', 'build_pon'):
             self.add_path('base', os.path.join(self.params.paths['targets'], self.name))
             self.add_path('data', os.path.join(self.paths['base'], 'data'))
             self.add_path('contigs', os.path.join(self.paths['base'], 'contigs'))
             self.add_path('kmers', os.path.join(self.paths['base'], 'kmers'))
+        if self.params.fncCmd == 'run':
             self.add_path('output', os.path.join(self.params.paths['output'], self.name))
 
         '''
@@ -511,6 +598,7 @@ class TargetManager(object):
             None
         """
 
+        self.stageTracker.start('set_ref_data')
         # Write reference fasta file if needed.
         for i in range(len(self.files['target_ref_fn'])):
             fn = self.files['target_ref_fn'][i]
@@ -530,6 +618,7 @@ class TargetManager(object):
                 output, errors = p.communicate()
                 if errors != '':
                     utils.log(self.loggingName, 'debug', 'Failed to make blast db files using reference file %s' % self.files['target_ref_fn'][0])
+        self.stageTracker.stop('set_ref_data')
 
     def find_sv_reads(self):
         """Entry function to extract sequence reads from sample or normal bam file.
@@ -539,6 +628,9 @@ class TargetManager(object):
         1. Extract bam reads
         2. Clean reads
 
+        The normal sample reads, if input, are extracted, cleaned and their kmers counted
+        in a background thread while the sample reads are processed.
+
         Args:
             None
         Returns:
@@ -547,33 +639,112 @@ class TargetManager(object):
                                 and True when there are.
         """
 
+        if self.params.get_param('normal_bam_file'):
+            self.start_normal_task(True)
+        self.extract_bam_reads('sv')
+        return self.clean_sv_reads()
+
+    def extract_reads(self):
+        """Extract the reads from the sample bam file and the normal bam file, if input.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+
         self.extract_bam_reads('sv')  # Extract variant reads.
         if self.params.get_param('normal_bam_file'):  # Extract reads from normal sample, if input.
             self.extract_bam_reads('norm')
-            self.clean_reads('norm')
+
+    def clean_sv_reads(self):
+        """Clean the extracted normal sample reads, if input, and the sample reads.
+
+        Args:
+            None
+        Returns:
+            check (boolean):    False when there are no reads left after cleaning and True when there are.
+        """
+
+        if self.params.get_param('normal_bam_file') and self.normTask is None:
+            self.start_normal_task(False)
         check = True
         if not self.clean_reads('sv'):  # Check if there are any reads left to analyze after cleaning.
+            if self.normTask is not None:  # Let the normal sample processing finish before moving on.
+                self.normTask.get()
+                self.normTask = None
             shutil.rmtree(self.paths['output'])  # Remove the output directory since there is nothing to analyze
             check = False
         return check
 
-    def extract_bam_reads(self, sampleType):
+    def start_normal_task(self, extract):
+        """Start processing the normal sample reads in a background thread.
+
+        Args:
+            extract (boolean):  Extract the normal sample reads before cleaning them.
+        Returns:
+            None
+        """
+
+        self.variation.setup_cleaned_reads('norm')  # Create the cleaned reads dictionary before the threads share it.
+        self.normTask = utils.BackgroundTask(self.process_normal_reads, extract)
+        self.normTask.start()
+
+    def process_normal_reads(self, extract):
+        """Extract, if set, and clean the normal sample reads and count their kmers.
+
+        Args:
+            extract (boolean):  Extract the normal sample reads before cleaning them.
+        Returns:
+            None
+        """
+
+        if extract:
+            self.extract_bam_reads('norm')
+        self.clean_reads('norm')
+        self.variation.set_normal_kmers()
+
+    def get_read_files(self):
+        """Return the extracted read fastq files and the cleaned fastq files to write for
+        each sample type.
+
+        Args:
+            None
+        Returns:
+            readFiles (list):   List of tuples (extracted reads fastq, cleaned reads fastq).
+        """
+
+        readFiles = []
+        for sampleType in ('sv', 'norm'):
+            if '%s_fq' % sampleType in self.variation.files:
+                readFiles.append((self.variation.files['%s_fq' % sampleType], self.variation.files['%s_cleaned_fq' % sampleType]))
+        return readFiles
+
+    def extract_bam_reads(self, sampleType, bamFile=None, reads=None):
         """Wrapper for Variation extract_bam_reads function.
 
         Args:
             sampleType (str): Indicates a tumor ('sv') or normal ('norm') sample being processed.
+            bamFile (str):    Bam file to extract the reads from instead of the sample or normal bam file parameter,
+                              a path or an open pysam bam file object.
+            reads (iterable): Reads of the target region to use instead of the reads fetched from the bam file.
         Return:
             None
         """
 
         # Create the file paths for the files that will be created from the read extraction.
         self.variation.setup_read_extraction_files(sampleType, self.paths['data'], self.name)
-        bamType = 'sample'
-        if sampleType == 'norm':
-            bamType = 'normal'
-        bamFile = self.params.get_param('%s_bam_file' % bamType)
+        if bamFile is None:
+            bamType = 'sample'
+            if sampleType == 'norm':
+                bamType = 'normal'
+            bamFile = self.params.get_param('%s_bam_file' % bamType)
         utils.log(self.loggingName, 'info', 'Extracting bam reads from %s to %s' % (bamFile, self.variation.files['%s_fq' % sampleType]))
-        self.variation.set_var_reads(sampleType, bamFile, self.chrom, self.start, self.end, self.regionBuffer)
+        stage = STAGE_PREFIXES[sampleType] + 'extract_reads'
+        self.stageTracker.start(stage)
+        self.variation.set_var_reads(sampleType, bamFile, self.chrom, self.start, self.end, self.regionBuffer, reads)
+        varReads = self.variation.get_var_reads(sampleType)
+        self.stageTracker.stop(stage, sv_reads=len(varReads.sv), unmapped_reads=len(varReads.unmapped))
 
     def clean_reads(self, sampleType):
         """Wrapper for Variation clean_reads function.
@@ -585,7 +756,42 @@ class TargetManager(object):
                              cleaning is complete.
         """
 
-        return self.variation.clean_reads(self.paths['data'], self.name, sampleType)
+        stage = STAGE_PREFIXES[sampleType] + 'clean_reads'
+        self.stageTracker.start(stage)
+        check = self.variation.clean_reads(self.paths['data'], self.name, sampleType)
+        self.stageTracker.stop(stage, cleaned_reads=len(self.variation.cleaned_read_recs[sampleType]))
+        return check
+
+    def get_sample_only_kmers(self, bamFile, sampleIdx):
+        """Extract and clean the reads from a bam file and return the sample only kmers.
+        This is used to build the panel of normals database.
+
+        The reads, cleaned reads and kmer dumps of each sample are written to their own
+        <data>/pon_sample_<index> directory, removed once the kmers are counted, so that
+        the jellyfish dump of a sample is not reused for the next samples.
+
+        Args:
+            bamFile (str):              Path to the bam file.
+            sampleIdx (int):            Index of the sample in the panel of normals bam list.
+        Returns:
+            sampleOnlyKmers (list):     List of the kmers not in the target reference sequence.
+        """
+
+        dataPath = self.paths['data']
+        sampleDataPath = os.path.join(dataPath, 'pon_sample_%d' % sampleIdx)
+        if os.path.exists(sampleDataPath):  # Remove the files of a previous build.
+            shutil.rmtree(sampleDataPath)
+        self.add_path('data', sampleDataPath)
+        try:
+            self.extract_bam_reads('sv', bamFile)
+            if not self.clean_reads('sv'):
+                return []
+            sampleOnlyKmers = self.variation.get_sample_only_kmers(self.files['target_ref_fn'])
+            self.clear_cleaned_reads()
+            return sampleOnlyKmers
+        finally:
+            self.paths['data'] = dataPath
+            shutil.rmtree(sampleDataPath, ignore_errors=True)
 
     def compare_kmers(self):
         """Obtain the sample only kmers and initiate assembly of reads with these kmers.
@@ -596,7 +802,8 @@ class TargetManager(object):
             None
         """
 
-        self.variation.compare_kmers(self.paths['kmers'], self.name, self.readLen, self.files['target_ref_fn'])
+        self.variation.compare_kmers(self.paths['kmers'], self.name, self.readLen, self.files['target_ref_fn'], self.normTask)
+        self.normTask = None
 
     def resolve_sv(self):
         """Perform operations on the contig object that was generated from the split reads in the target.
@@ -607,33 +814,72 @@ class TargetManager(object):
             None
         """
 
-        iter = 1
         contigs = self.variation.kmers['clusters']
         utils.log(self.loggingName, 'info', 'Resolving structural variants from %d kmer clusters' % len(contigs))
-        for contig in contigs:
-            contigId = self.name + '_contig' + str(iter)
+        for iter, contig in enumerate(contigs):
+            contigId = self.name + '_contig' + str(iter + 1)
             utils.log(self.loggingName, 'info', 'Assessing contig %s, %s' % (contigId, contig.seq))
             contig.set_meta_information(contigId, self.params, self.values, self.paths['contigs'], self.variation.files['kmer_clusters'], self.variation)
-            contig.query_ref(self.files['target_ref_fn'])
-            contig.make_calls()
+
+        # Realignment and calling wait mostly on external tools, run the contigs in a thread pool.
+        nthreads = min(int(self.params.get_param('contig_threads') or 1), len(contigs))
+        if nthreads > 1:
+            utils.log(self.loggingName, 'info', 'Resolving %d contigs with %d threads' % (len(contigs), nthreads))
+            pool = ThreadPool(nthreads)
+            pool.map(self.call_contig_svs, contigs)
+            pool.close()
+            pool.join()
+        else:
+            map(self.call_contig_svs, contigs)
+
+        # Results are written and stored in contig order.
+        self.stageTracker.start('output')
+        for contig in contigs:
             if contig.svEventResult:
-                contig.filter_calls()
-                contig.annotate_calls()
-                contig.output_calls(self.paths['output'], self.variation.files['sv_bam_sorted'])
+                renderJob = contig.output_calls(self.paths['output'], self.variation.files['sv_bam_sorted'])
+                if renderJob is not None:
+                    self.renderJobs.append(renderJob)
                 self.add_result(contig.svEventResult)
             else:
-                utils.log(self.loggingName, 'info', '%s has no structural variant result.' % contigId)
-            iter += 1
+                utils.log(self.loggingName, 'info', '%s has no structural variant result.' % contig.get_id())
+        self.stageTracker.stop('output', render_jobs=len(self.renderJobs))
+        self.stageTracker.start('discread_clustering')
         self.variation.cluster_discreads(self.name, self.chrom)  # Cluster discordant reads.
+        self.stageTracker.stop('discread_clustering', discread_clusters=len(self.variation.discReadFormatted))
+
+    def call_contig_svs(self, contig):
+        """Realign a contig and call, filter, and annotate its structural variants.
+        This is run in a thread for each contig of the target.
+
+        Args:
+            contig (Contig): Contig object with the meta information set.
+        Returns:
+            None
+        """
+
+        self.stageTracker.start('realignment')
+        contig.query_ref(self.files['target_ref_fn'])
+        self.stageTracker.stop('realignment', contigs=1, **contig.realignment.get_align_counts())
+        self.stageTracker.start('calling')
+        contig.make_calls()
+        if contig.svEventResult:
+            contig.filter_calls()
+        self.stageTracker.stop('calling', sv_calls=int(bool(contig.svEventResult)))
+        if contig.svEventResult:
+            self.stageTracker.start('annotation')
+            contig.annotate_calls()
+            self.stageTracker.stop('annotation')
 
     def complete_analysis(self):
         """
         """
 
+        self.stageTracker.start('output')
         if len(self.variation.results) > 0 or len(self.variation.discReadFormatted) > 0:
             self.variation.write_results(self.paths['output'], self.name)
         else:
             shutil.rmtree(self.paths['output'])
+        self.stageTracker.stop('output')
 
     def get_target_intervals(self):
         """Return the list of tuples defining intervals for this target
@@ -676,6 +922,13 @@ class TargetManager(object):
         return self.variation.results
 
     def get_formatted_output(self):
-        """ """
+        """Return the formatted output strings and the pileup image jobs of the target."""
+
+        formattedResultsDict = self.variation.get_formatted_output()
+        formattedResultsDict['render'] = self.renderJobs
+        return formattedResultsDict
+
+    def get_stage_records(self):
+        """Return the timing, resource use and count records of the analysis stages of the target."""
 
-        return self.variation.get_formatted_output()
+        return self.stageTracker.get_records()
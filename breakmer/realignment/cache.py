@@ -0,0 +1,191 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""cache.py module
+
+This module stores realignment results on disk so that identical contig sequences
+(recurrent events and artefacts in a cohort) are only realigned once. Each entry is
+keyed by a SHA-1 of the contig sequence and the alignment fingerprint (aligner program,
+aligner binary, reference and alignment options) and contains the aligner output
+records with the query name field removed. Entries are written as
+<realign_cache_dir>/<key[:2]>/<key>.json.
+
+Hits update the modification time of the entry and the least recently used entries are
+removed when the cache grows beyond the realign_cache_size parameter (MB).
+"""
+
+import os
+import json
+import hashlib
+import threading
+import breakmer.utils as utils
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+CACHES = {}  # RealignCache objects keyed by cache directory, one per process.
+QNAME_FIELDS = {'blat': 9, 'blast': 0, 'kmer': 9}  # Index of the query name field in the result records.
+
+
+def get_cache(params):
+    """Return the realignment cache for the realign_cache_dir parameter or None if it is not set."""
+    cacheDir = params.get_param('realign_cache_dir')
+    if not cacheDir:
+        return None
+    cacheDir = os.path.abspath(cacheDir)
+    if cacheDir not in CACHES:
+        CACHES[cacheDir] = RealignCache(cacheDir, int(params.get_param('realign_cache_size') or 1024))
+    return CACHES[cacheDir]
+
+
+def log_stats(loggingName):
+    """Log the hit and miss counts of the realignment caches used in this process."""
+    for cache in CACHES.values():
+        utils.log(loggingName, 'info', 'Realignment cache %s: %d hits, %d misses, %d entries written, %d entries evicted' % (cache.cacheDir, cache.stats['hit'], cache.stats['miss'], cache.stats['write'], cache.stats['evict']))
+
+
+class RealignCache:
+    """Class to store and retrieve realignment result records on disk.
+
+    Attributes:
+        cacheDir (str):     Path to the cache directory.
+        maxSize (int):      Maximum size of the cache in bytes.
+        size (int):         Current size estimate of the cache in bytes.
+        stats (dict):       Hit, miss, write and evict counts.
+        lock (Lock):        Lock for the counters, contigs can be realigned in threads.
+    """
+
+    def __init__(self, cacheDir, maxSizeMb):
+        self.loggingName = 'breakmer.realignment.cache'
+        self.cacheDir = cacheDir
+        self.maxSize = maxSizeMb * 1024 * 1024
+        self.stats = {'hit': 0, 'miss': 0, 'write': 0, 'evict': 0}
+        self.lock = threading.Lock()
+        if not os.path.exists(self.cacheDir):
+            try:
+                os.makedirs(self.cacheDir)
+            except OSError:  # Created by another process.
+                pass
+        self.size = sum([os.path.getsize(fn) for fn, mtime in self.get_entries()])
+
+    def get_key(self, seq, fingerprint):
+        """Return the cache key for a contig sequence and an alignment fingerprint string."""
+        return hashlib.sha1(fingerprint + '\n' + seq.upper()).hexdigest()
+
+    def get_entry_fn(self, key):
+        """Return the path to the cache entry file for a key."""
+        return os.path.join(self.cacheDir, key[0:2], key + '.json')
+
+    def get_entries(self):
+        """Return a list of tuples with the entry file name and modification time for all the cache entries."""
+        entries = []
+        for root, dirs, files in os.walk(self.cacheDir):
+            for fn in files:
+                if not fn.endswith('.json'):
+                    continue
+                entryFn = os.path.join(root, fn)
+                try:
+                    entries.append((entryFn, os.path.getmtime(entryFn)))
+                except OSError:  # Evicted by another process.
+                    continue
+        return entries
+
+    def increment(self, stat, value=1):
+        """Increment a counter."""
+        self.lock.acquire()
+        try:
+            self.stats[stat] += value
+        finally:
+            self.lock.release()
+
+    def get(self, key, queryName):
+        """Return the cached result records for a key.
+
+        Args:
+            key (str):          Cache key.
+            queryName (str):    Query name to set in the returned records.
+        Returns:
+            List of result lines or None if the key is not in the cache.
+        """
+
+        entryFn = self.get_entry_fn(key)
+        try:
+            entry = json.load(open(entryFn, 'r'))
+            os.utime(entryFn, None)  # Mark the entry as recently used.
+        except (IOError, OSError, ValueError):
+            self.increment('miss')
+            utils.log(self.loggingName, 'debug', 'Realignment cache miss for key %s', key)
+            return None
+        self.increment('hit')
+        utils.log(self.loggingName, 'debug', 'Realignment cache hit for key %s, %d records', key, len(entry['records']))
+        qnameIdx = QNAME_FIELDS[entry['program']]
+        lines = []
+        for record in entry['records']:
+            record = list(record)
+            record[qnameIdx] = queryName
+            lines.append('\t'.join(record) + '\n')
+        return lines
+
+    def put(self, key, program, resultFn):
+        """Store the records of an aligner result file in the cache. Comment lines are not stored.
+
+        Args:
+            key (str):          Cache key.
+            program (str):      Aligner program (blat, blast or kmer).
+            resultFn (str):     Path to the aligner result file.
+        Returns:
+            None
+        """
+
+        qnameIdx = QNAME_FIELDS[program]
+        records = []
+        for line in open(resultFn, 'r'):
+            if line.find('#') > -1 or line.strip() == '':
+                continue
+            record = line.rstrip('\n').split('\t')
+            record[qnameIdx] = ''
+            records.append(record)
+        entryFn = self.get_entry_fn(key)
+        if not os.path.exists(os.path.dirname(entryFn)):
+            try:
+                os.makedirs(os.path.dirname(entryFn))
+            except OSError:
+                pass
+        tmpFn = '%s.%d.%d.tmp' % (entryFn, os.getpid(), threading.current_thread().ident)
+        f = open(tmpFn, 'w')
+        json.dump({'program': program, 'records': records}, f)
+        f.close()
+        os.rename(tmpFn, entryFn)
+        self.increment('write')
+        self.lock.acquire()
+        try:
+            self.size += os.path.getsize(entryFn)
+            if self.size > self.maxSize:
+                self.evict()
+        finally:
+            self.lock.release()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is below 90% of the maximum size."""
+        entries = sorted(self.get_entries(), key=lambda x: x[1])
+        sizes = []
+        for entryFn, mtime in entries:
+            try:
+                sizes.append(os.path.getsize(entryFn))
+            except OSError:
+                sizes.append(0)
+        self.size = sum(sizes)
+        nevicted = 0
+        for (entryFn, mtime), entrySize in zip(entries, sizes):
+            if self.size <= 0.9 * self.maxSize:
+                break
+            try:
+                os.remove(entryFn)
+            except OSError:  # Evicted by another process.
+                pass
+            self.size -= entrySize
+            nevicted += 1
+        self.stats['evict'] += nevicted
+        utils.log(self.loggingName, 'info', 'Evicted %d realignment cache entries, cache size %d bytes' % (nevicted, self.size))
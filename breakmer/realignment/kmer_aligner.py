@@ -0,0 +1,311 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""kmer_aligner.py module
+
+This module aligns contig sequences to a target reference sequence in-process,
+as an alternative to running blat on the few kilobase target sequence for each
+contig. The target sequence kmers (seeds) are indexed once per target. Seed hits
+on the same diagonal are merged and extended without gaps into high-scoring segment
+pairs (HSPs), which are chained into gapped alignments. The alignments are written
+as PSL records, the same format as the blat -noHead output, so that they are parsed
+by blat_result.BlatResult.
+"""
+
+import math
+from Bio import SeqIO
+import breakmer.utils as utils
+
+__author__ = "Ryan Abo"
+__copyright__ = "Copyright 2015, Ryan Abo"
+__email__ = "ryanabo@gmail.com"
+__license__ = "MIT"
+
+TARGET_INDEXES = {}  # TargetIndex objects keyed by the target reference fasta file.
+COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'N': 'N'}
+
+
+def reverse_complement(seq):
+    """Return the reverse complement of an upper case sequence."""
+    return ''.join([COMPLEMENT.get(base, 'N') for base in reversed(seq)])
+
+
+def get_target_index(refFn, seedLen=11):
+    """Return the TargetIndex for a target reference fasta file, building it the first time."""
+    if (refFn, seedLen) not in TARGET_INDEXES:
+        TARGET_INDEXES[(refFn, seedLen)] = TargetIndex(refFn, seedLen)
+    return TARGET_INDEXES[(refFn, seedLen)]
+
+
+def align_fasta(refFn, queryFn, resultFn, minScore=20):
+    """Align the sequences in a fasta file to a target reference sequence and
+    write the PSL records to a result file.
+
+    Args:
+        refFn (str):        Path to the target reference fasta file.
+        queryFn (str):      Path to the query fasta file.
+        resultFn (str):     Path to the result file.
+        minScore (int):     Minimum PSL score of the alignments to write.
+    Returns:
+        nrecords (int):     Number of records written.
+    """
+
+    targetIndex = get_target_index(refFn)
+    records = []
+    for record in SeqIO.parse(open(queryFn, 'rU'), 'fasta'):
+        records.extend(targetIndex.align(record.id, str(record.seq), minScore))
+    resultFile = open(resultFn, 'w')
+    for record in records:
+        resultFile.write('\t'.join([str(x) for x in record]) + '\n')
+    resultFile.close()
+    utils.log('breakmer.realignment.kmer_aligner', 'debug', 'Wrote %d alignment records to %s', len(records), resultFn)
+    return len(records)
+
+
+class HSP:
+    """Ungapped aligned segment of the query and target sequences.
+
+    Attributes:
+        qStart (int):   Query start position (0-based).
+        qEnd (int):     Query end position (exclusive).
+        diag (int):     Diagonal, the target position minus the query position.
+        score (int):    Number of matching bases minus the number of mismatching bases.
+    """
+
+    def __init__(self, qStart, qEnd, diag):
+        self.qStart = qStart
+        self.qEnd = qEnd
+        self.diag = diag
+        self.score = 0
+
+    def tstart(self):
+        return self.qStart + self.diag
+
+    def tend(self):
+        return self.qEnd + self.diag
+
+
+class TargetIndex:
+    """Seed index of a target reference sequence.
+
+    Attributes:
+        name (str):     Target sequence name.
+        seq (str):      Target sequence, lower case bases are soft-masked repeats.
+        upperSeq (str): Upper case target sequence.
+        seedLen (int):  Seed length.
+        seeds (dict):   Dictionary with the seed sequences as keys and lists of the target positions as values.
+    """
+
+    def __init__(self, refFn, seedLen):
+        record = SeqIO.read(open(refFn, 'rU'), 'fasta')
+        self.name = record.id
+        self.seq = str(record.seq)
+        self.upperSeq = self.seq.upper()
+        self.seedLen = seedLen
+        self.seeds = {}
+        for i in range(len(self.upperSeq) - seedLen + 1):
+            seed = self.upperSeq[i:(i + seedLen)]
+            if seed.find('N') == -1:
+                self.seeds.setdefault(seed, []).append(i)
+
+    def find_hsps(self, query):
+        """Find the seed hits of a query sequence, merge them by diagonal and extend them
+        without gaps.
+
+        Args:
+            query (str):    Upper case query sequence.
+        Returns:
+            List of HSP objects.
+        """
+
+        hits = {}
+        for i in range(len(query) - self.seedLen + 1):
+            for tpos in self.seeds.get(query[i:(i + self.seedLen)], []):
+                hits.setdefault(tpos - i, []).append(i)
+
+        hsps = []
+        for diag in sorted(hits):
+            segments = []
+            for qpos in hits[diag]:
+                if len(segments) > 0 and qpos <= segments[-1].qEnd:
+                    segments[-1].qEnd = qpos + self.seedLen
+                else:
+                    segments.append(HSP(qpos, qpos + self.seedLen, diag))
+            for segment in segments:
+                self.extend(segment, query)
+            # Merge the segments on the same diagonal that overlap after the extension.
+            merged = []
+            for segment in sorted(segments, key=lambda x: x.qStart):
+                if len(merged) > 0 and segment.qStart <= merged[-1].qEnd:
+                    merged[-1].qEnd = max(merged[-1].qEnd, segment.qEnd)
+                else:
+                    merged.append(segment)
+            for segment in merged:
+                segment.score = self.score_segment(query, segment.qStart, segment.qEnd, diag)
+                hsps.append(segment)
+        return hsps
+
+    def extend(self, hsp, query, xdrop=8):
+        """Extend an HSP in both directions without gaps, to the highest scoring position
+        before the score drops by more than xdrop.
+        """
+        for direction in (1, -1):
+            score = 0
+            bestScore = 0
+            bestLen = 0
+            qpos = hsp.qEnd if direction == 1 else (hsp.qStart - 1)
+            n = 0
+            while qpos >= 0 and qpos < len(query) and (qpos + hsp.diag) >= 0 and (qpos + hsp.diag) < len(self.upperSeq):
+                n += 1
+                if query[qpos] == self.upperSeq[qpos + hsp.diag] and query[qpos] != 'N':
+                    score += 1
+                else:
+                    score -= 2
+                if score > bestScore:
+                    bestScore = score
+                    bestLen = n
+                elif score < (bestScore - xdrop):
+                    break
+                qpos += direction
+            if direction == 1:
+                hsp.qEnd += bestLen
+            else:
+                hsp.qStart -= bestLen
+
+    def score_segment(self, query, qStart, qEnd, diag):
+        """Return the number of matches minus the number of mismatches in an ungapped segment."""
+        score = 0
+        for qpos in range(qStart, qEnd):
+            if query[qpos] == self.upperSeq[qpos + diag]:
+                score += 1
+            else:
+                score -= 1
+        return score
+
+    def chain(self, hsps):
+        """Chain collinear HSPs into gapped alignments. The best scoring chain is selected
+        and the procedure is repeated with the remaining HSPs.
+
+        Args:
+            hsps (list):    List of HSP objects.
+        Returns:
+            List of chains, each a list of HSP objects ordered by query position.
+        """
+
+        chains = []
+        remaining = sorted(hsps, key=lambda x: (x.qStart, x.tstart()))
+        while len(remaining) > 0:
+            scores = []
+            prevIdx = []
+            for j, hspj in enumerate(remaining):
+                bestScore = hspj.score
+                bestPrev = None
+                for i in range(j):
+                    hspi = remaining[i]
+                    if hspi.qStart >= hspj.qStart or hspi.tstart() >= hspj.tstart() or hspi.qEnd >= hspj.qEnd or hspi.tend() >= hspj.tend():
+                        continue
+                    overlap = max(0, hspi.qEnd - hspj.qStart, hspi.tend() - hspj.tstart())
+                    qgap = max(0, hspj.qStart + overlap - hspi.qEnd)
+                    tgap = max(0, hspj.tstart() + overlap - hspi.tend())
+                    score = scores[i] + hspj.score - overlap - self.gap_cost(qgap) - self.gap_cost(tgap)
+                    if score > bestScore:
+                        bestScore = score
+                        bestPrev = i
+                scores.append(bestScore)
+                prevIdx.append(bestPrev)
+            idx = max(range(len(remaining)), key=lambda x: (scores[x], -x))
+            chainIdx = []
+            while idx is not None:
+                chainIdx.insert(0, idx)
+                idx = prevIdx[idx]
+            chains.append([remaining[x] for x in chainIdx])
+            remaining = [hsp for i, hsp in enumerate(remaining) if i not in set(chainIdx)]
+        return chains
+
+    def gap_cost(self, gapLen):
+        """Return the chaining penalty for a gap, increasing with the log of the gap length."""
+        if gapLen <= 0:
+            return 0
+        return 1 + int(math.log(gapLen, 2))
+
+    def make_record(self, chain, queryName, query, strand, minScore):
+        """Create the PSL record for a chain of HSPs.
+
+        Args:
+            chain (list):       List of HSP objects ordered by query position.
+            queryName (str):    Query sequence name.
+            query (str):        Upper case query sequence on the aligned strand.
+            strand (str):       Query strand, + or -.
+            minScore (int):     Minimum PSL score.
+        Returns:
+            List of the 21 PSL values or None if the score is below minScore.
+        """
+
+        blocks = []  # Tuples of query start, target start, block size
+        for hsp in chain:
+            qStart, tStart, size = hsp.qStart, hsp.tstart(), hsp.qEnd - hsp.qStart
+            if len(blocks) > 0:
+                overlap = max(0, blocks[-1][0] + blocks[-1][2] - qStart, blocks[-1][1] + blocks[-1][2] - tStart)
+                qStart, tStart, size = qStart + overlap, tStart + overlap, size - overlap
+                if size <= 0:
+                    continue
+            blocks.append((qStart, tStart, size))
+
+        matches, mismatches, repmatches, ncount = 0, 0, 0, 0
+        for qStart, tStart, size in blocks:
+            for i in range(size):
+                qBase = query[qStart + i]
+                tBase = self.seq[tStart + i]
+                if qBase == 'N' or tBase in 'Nn':
+                    ncount += 1
+                elif qBase != tBase.upper():
+                    mismatches += 1
+                elif tBase.islower():
+                    repmatches += 1
+                else:
+                    matches += 1
+        qNumInsert, qBaseInsert, tNumInsert, tBaseInsert = 0, 0, 0, 0
+        for prev, block in zip(blocks[:-1], blocks[1:]):
+            qgap = block[0] - (prev[0] + prev[2])
+            tgap = block[1] - (prev[1] + prev[2])
+            if qgap > 0:
+                qNumInsert += 1
+                qBaseInsert += qgap
+            if tgap > 0:
+                tNumInsert += 1
+                tBaseInsert += tgap
+
+        # The blat pslScore.
+        score = matches + (repmatches >> 1) - mismatches - qNumInsert - tNumInsert
+        if score < minScore:
+            return None
+        qSize = len(query)
+        qStart = blocks[0][0]
+        qEnd = blocks[-1][0] + blocks[-1][2]
+        if strand == '-':  # Query coordinates are on the forward strand, the block starts on the reverse strand.
+            qStart, qEnd = qSize - qEnd, qSize - qStart
+        return [matches, mismatches, repmatches, ncount, qNumInsert, qBaseInsert, tNumInsert, tBaseInsert, strand,
+                queryName, qSize, qStart, qEnd, self.name, len(self.seq), blocks[0][1], blocks[-1][1] + blocks[-1][2], len(blocks),
+                ''.join(['%d,' % x[2] for x in blocks]), ''.join(['%d,' % x[0] for x in blocks]), ''.join(['%d,' % x[1] for x in blocks])]
+
+    def align(self, queryName, querySeq, minScore=20):
+        """Align a query sequence on both strands to the target sequence.
+
+        Args:
+            queryName (str):    Query sequence name.
+            querySeq (str):     Query sequence.
+            minScore (int):     Minimum PSL score of the alignments.
+        Returns:
+            List of PSL records.
+        """
+
+        records = []
+        for strand in ('+', '-'):
+            query = querySeq.upper()
+            if strand == '-':
+                query = reverse_complement(query)
+            for chain in self.chain(self.find_hsps(query)):
+                record = self.make_record(chain, queryName, query, strand, minScore)
+                if record is not None:
+                    records.append(record)
+        return records
@@ -4,6 +4,8 @@
 import os
 import subprocess
 import breakmer.realignment.blat_result as blat_result
+import breakmer.realignment.cache as realign_cache
+import breakmer.realignment.kmer_aligner as kmer_aligner
 import breakmer.utils as utils
 
 __author__ = "Ryan Abo"
@@ -11,6 +13,12 @@ __copyright__ = "Copyright 2015, Ryan Abo"
 __email__ = "ryanabo@gmail.com"
 __license__ = "MIT"
 
+# Aligner options by program and scope, also part of the realignment cache fingerprint.
+ALIGN_OPTIONS = {'blast': {'target': "-task 'blastn-short' -evalue 0.01 -outfmt '7 qseqid sseqid pident qlen length mismatch gapopen qstart qend sstart send evalue bitscore gaps sstrand qseq sseq'"},
+                 'blat': {'target': '-t=dna -q=dna -out=psl -minScore=20 -stepSize=10 -minMatch=2 -repeats=lower -noHead',
+                          'genome': '-t=dna -q=dna -out=psl -minScore=20 -nohead'},
+                 'kmer': {'target': 'seedLen=11 minScore=20'}}
+
 
 class AlignParams:
     """
@@ -22,6 +30,7 @@ class AlignParams:
         self.binary = {'target': None, 'genome': None}
         self.binaryParams = {'target': None, 'genome': None}
         self.ref = {'target': None, 'genome': None}
+        self.fingerprint = {'target': None, 'genome': None}
         self.set_values(params, targetRefFns)
 
     def set_values(self, params, targetRefFns):
@@ -29,7 +38,11 @@ class AlignParams:
         """
         self.binary['target'] = params.get_param('blat')
         blast = params.get_param('blast')
-        if blast is not None:
+        targetAligner = params.get_param('target_aligner')
+        if targetAligner == 'kmer':  # In-process aligner writing blat psl records.
+            self.program['target'] = 'kmer'
+            self.binary['target'] = None
+        elif blast is not None and targetAligner in (None, 'blast'):
             self.program['target'] = 'blast'
             self.binary['target'] = blast
             self.extension['target'] = 'txt'
@@ -40,6 +53,18 @@ class AlignParams:
         # Use the forward sequence for blatting targeted sequences
         self.ref['target'] = targetRefFns[0]
         self.ref['genome'] = params.get_param('reference_fasta_dir')
+        self.set_fingerprints(params)
+
+    def set_fingerprints(self, params):
+        """Set the strings identifying the aligner, reference and options for each scope,
+        used to key the realignment cache.
+        """
+        for scope in ('target', 'genome'):
+            binaryKey = utils.get_binary_key(self.binary[scope])
+            refKey = utils.get_binary_key(self.ref[scope])
+            if scope == 'genome':
+                refKey = '%s|%s' % (self.ref[scope], utils.get_binary_key(params.get_param('reference_fasta')))
+            self.fingerprint[scope] = '|'.join([str(x) for x in (self.program[scope], scope, binaryKey, refKey, ALIGN_OPTIONS[self.program[scope]][scope])])
 
     def get_values(self, type):
         return (self.program[type], self.extension[type], self.binary[type], self.binaryParams[type], self.ref[type])
@@ -52,6 +77,7 @@ class RealignManager:
     def __init__(self, params, targetRefFns):
         self.realignment = None
         self.alignParams = AlignParams(params, targetRefFns)
+        self.cache = realign_cache.get_cache(params)
 
     def realign(self, contig):
         """
@@ -59,15 +85,21 @@ class RealignManager:
         if not contig.has_fa_fn():
             return
 
-        self.realignment = Realignment(contig)
-        if not self.realignment.align(self.alignParams.get_values('target'), 'target'):
+        self.realignment = Realignment(contig, self.cache)
+        if not self.realignment.align(self.alignParams.get_values('target'), 'target', self.alignParams.fingerprint['target']):
             return
         if not self.realignment.target_aligned():
-            self.realignment.align(self.alignParams.get_values('genome'), 'genome')
+            self.realignment.align(self.alignParams.get_values('genome'), 'genome', self.alignParams.fingerprint['genome'])
         else:
             if self.realignment.targetHit and self.alignParams.get_values('target')[0] == 'blast':
                 self.realignment.check_record_merge()
 
+    def get_align_counts(self):
+        """Return a dictionary with the number of aligner runs and cached alignments used for the contig."""
+        if self.realignment is None:
+            return {'aligner_runs': 0, 'cached_alignments': 0}
+        return dict(self.realignment.alignCounts)
+
     def get_result_fn(self):
         resultFn = None
         if self.realignment.has_results():
@@ -96,16 +128,18 @@ class RealignManager:
 class Realignment:
     """
     """
-    def __init__(self, contig):
+    def __init__(self, contig, cache=None):
         self.loggingName = 'breakmer.realignment.realigner'
+        self.cache = cache
         self.scope = None
         self.results = None
         self.targetHit = False
         self.resultFn = None
         self.alignParams = None
         self.contig = contig
+        self.alignCounts = {'aligner_runs': 0, 'cached_alignments': 0}
 
-    def align(self, alignParams, scope):
+    def align(self, alignParams, scope, fingerprint=None):
         """
         """
         self.alignParams = alignParams
@@ -113,18 +147,40 @@ class Realignment:
         self.scope = scope
 
         self.resultFn = os.path.join(self.contig.get_path(), '%s_res.%s.%s' % (alignProgram, scope, alignExt))
+        cacheKey = None
+        if self.cache is not None and fingerprint is not None:
+            # Use the cached records for the same contig sequence, aligner and reference.
+            cacheKey = self.cache.get_key(self.get_query_seq(), fingerprint)
+            cachedLines = self.cache.get(cacheKey, self.contig.meta.id)
+            if cachedLines is not None:
+                utils.log(self.loggingName, 'info', 'Using cached %s realignment results, storing results in %s' % (alignProgram, self.resultFn))
+                resultFile = open(self.resultFn, 'w')
+                resultFile.writelines(cachedLines)
+                resultFile.close()
+                self.alignCounts['cached_alignments'] += 1
+                self.results = AlignResults(alignProgram, scope, self.resultFn, self.contig, alignRef)
+                return True
         utils.log(self.loggingName, 'info', 'Running realignment with %s, storing results in %s' % (alignProgram, self.resultFn))
+        self.alignCounts['aligner_runs'] += 1
+
+        if alignProgram == 'kmer':
+            kmer_aligner.align_fasta(alignRef, self.contig.meta.fa_fn, self.resultFn)
+            if cacheKey is not None:
+                self.cache.put(cacheKey, alignProgram, self.resultFn)
+            self.results = AlignResults('blat', scope, self.resultFn, self.contig, alignRef)
+            return True
 
         cmd = ''
+        options = ALIGN_OPTIONS[alignProgram].get(scope)
         if alignProgram == 'blast':
-            cmd = "%s -task 'blastn-short' -db %s -query %s -evalue 0.01 -out %s -outfmt '7 qseqid sseqid pident qlen length mismatch gapopen qstart qend sstart send evalue bitscore gaps sstrand qseq sseq'" % (alignBinary, alignRef, self.contig.meta.fa_fn, self.resultFn)
+            cmd = "%s -db %s -query %s -out %s %s" % (alignBinary, alignRef, self.contig.meta.fa_fn, self.resultFn, options)
         elif alignProgram == 'blat':
             if scope == 'genome':
                 # all blat server
-                cmd = '%s -t=dna -q=dna -out=psl -minScore=20 -nohead %s %d %s %s %s' % (alignBinary, binaryParams['hostname'], binaryParams['port'], alignRef, self.contig.meta.fa_fn, self.resultFn)
+                cmd = '%s %s %s %d %s %s %s' % (alignBinary, options, binaryParams['hostname'], binaryParams['port'], alignRef, self.contig.meta.fa_fn, self.resultFn)
             elif scope == 'target':
                 # target
-                cmd = '%s -t=dna -q=dna -out=psl -minScore=20 -stepSize=10 -minMatch=2 -repeats=lower -noHead %s %s %s' % (alignBinary, alignRef, self.contig.meta.fa_fn, self.resultFn)
+                cmd = '%s %s %s %s %s' % (alignBinary, options, alignRef, self.contig.meta.fa_fn, self.resultFn)
 
         utils.log(self.loggingName, 'info', 'Realignment system command %s' % cmd)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
@@ -136,9 +192,15 @@ class Realignment:
         if not os.path.isfile(self.resultFn):
             return False
         else:
+            if cacheKey is not None and p.returncode == 0:
+                self.cache.put(cacheKey, alignProgram, self.resultFn)
             self.results = AlignResults(alignProgram, scope, self.resultFn, self.contig, alignRef)
             return True
 
+    def get_query_seq(self):
+        """Return the contig sequence in the fasta file used for realignment."""
+        return ''.join([line.strip() for line in open(self.contig.meta.fa_fn, 'r') if not line.startswith('>')])
+
     def get_result_fn(self):
         """ """
         if self.results is not None:
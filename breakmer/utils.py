@@ -7,6 +7,12 @@ import glob
 import logging
 import time
 import math
+import json
+import gzip
+import atexit
+import threading
+import resource
+import multiprocessing
 from Bio import SeqIO
 import subprocess
 from pysam import *
@@ -16,6 +22,9 @@ __copyright__ = "Copyright 2015, Ryan Abo"
 __email__ = "ryanabo@gmail.com"
 __license__ = "MIT"
 
+LOG_LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING, 'error': logging.ERROR}
+LOG_LISTENER = None  # LogListener thread writing the log records, started in the main process by setup_logger.
+
 
 def which(program):
     """Determine the full path to a binary if it is in the system path for execution.
@@ -151,24 +160,120 @@ def run_cutadapt(cutadapt, cutadapt_config_f, input_fn, output_fn, logging_src):
     return output, errors
 
 
-def log(name, level, msg):
+def check_version(version, minVersion):
+    """Check if a dotted version string is at least the minimum version.
+
+    Args:
+        version (str):      Version string (e.g., 1.18).
+        minVersion (tuple): Minimum version as a tuple of integers (e.g., (1, 15)).
+    Returns:
+        boolean:            True if the version is at least minVersion, False if lower or not parseable.
+    """
+
+    try:
+        versionValues = tuple([int(x) for x in str(version).split('.')[0:len(minVersion)]])
+    except ValueError:
+        return False
+    return versionValues >= minVersion
+
+
+def run_batch_cutadapt(fqFns, cutadapt, cutadapt_config_f, batch_fn, cores, cutadapt_version, logging_src):
+    """Run cutadapt once on the reads from many fastq files.
+
+    The reads from each input fastq file are written to a single fastq file with the
+    index of the input file tagged to the front of the read name (@<index>|<read name>).
+    Cutadapt is run on the single file and the cleaned reads are demultiplexed
+    by the tag into the output fastq files, with the tag removed.
+
+    Args:
+        fqFns (list):           List of tuples containing the input fastq file and the output
+                                cleaned fastq file.
+        cutadapt (str):         Path to the cutadapt binary.
+        cutadapt_config_f (str): Path to the cutadapt configuration file.
+        batch_fn (str):         Path to the tagged fastq file to write, the cleaned reads are
+                                written to <batch_fn>_cleaned.fastq.
+        cores (int):            Number of cores for cutadapt to use (requires cutadapt >= 1.15).
+        cutadapt_version (str): Cutadapt version.
+        logging_src (str):      Logger name.
+    Returns:
+        None
+    Raises:
+        RuntimeError if cutadapt fails.
+    """
+
+    batch_fq = open(batch_fn, 'w')
+    for i, fqFns_i in enumerate(fqFns):
+        for header, seq, qual in FastqFile(fqFns_i[0]):
+            batch_fq.write('@%d|%s\n%s\n+\n%s\n' % (i, header[1:], seq, qual))
+    batch_fq.close()
+
+    cutadapt_parameters = stringify(cutadapt_config_f)
+    if cores > 1:
+        if check_version(cutadapt_version, (1, 15)):
+            cutadapt_parameters = '-j %d %s' % (cores, cutadapt_parameters)
+        else:
+            log(logging_src, 'info', 'Cutadapt version %s does not support multiple cores, running on a single core.' % cutadapt_version)
+    cleaned_batch_fn = batch_fn.split('.fastq')[0] + '_cleaned.fastq'
+    cmd = '%s %s %s %s > %s' % (sys.executable, cutadapt, cutadapt_parameters, batch_fn, cleaned_batch_fn)
+    log(logging_src, 'info', 'Cutadapt batch system command %s' % cmd)
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    output, errors = p.communicate()
+    log(logging_src, 'debug', 'Cutadapt output %s' % output)
+    log(logging_src, 'debug', 'Cutadapt errors %s' % errors)
+    if p.returncode != 0:
+        log(logging_src, 'error', 'Cutadapt batch run on %s failed with return code %d: %s' % (batch_fn, p.returncode, errors.strip()))
+        raise RuntimeError('Cutadapt batch run on %s failed with return code %d' % (batch_fn, p.returncode))
+
+    # Demultiplex the cleaned reads by the tag, writing each record as it is read. Cutadapt keeps
+    # the order of the reads, so the reads of a file are contiguous and one file is open at a time.
+    started = set()
+    nreads = 0
+    tag, fq_out = None, None
+    for header, seq, qual in FastqFile(cleaned_batch_fn):
+        readTag, header = header[1:].split('|', 1)
+        if readTag != tag:
+            if fq_out is not None:
+                fq_out.close()
+            tag = readTag
+            fq_out = open(fqFns[int(tag)][1], 'a' if tag in started else 'w')
+            started.add(tag)
+        fq_out.write('@%s\n%s\n+\n%s\n' % (header, seq, qual))
+        nreads += 1
+    if fq_out is not None:
+        fq_out.close()
+    for i, fqFns_i in enumerate(fqFns):
+        if str(i) not in started:  # No reads left after cleaning.
+            open(fqFns_i[1], 'w').close()
+    log(logging_src, 'info', 'Demultiplexed %d cleaned reads from %s into %d files' % (nreads, cleaned_batch_fn, len(fqFns)))
+    os.remove(batch_fn)
+    os.remove(cleaned_batch_fn)
+
+
+def log(name, level, msg, *args):
     """Write log message to the appropriate level.
 
+    The message is only formatted with the arguments if the level is enabled for
+    the logger, pass the values as arguments instead of formatting the message in
+    frequently called code.
+
     Args:
         name (str):  The logger name, typically the module name.
         level (str): The level of debugging classification.
-        msg (str):   The message to log.
+        msg (str):   The message to log, optionally with % formatting placeholders.
+        args:        Values for the message placeholders.
     Returns:
         None
     """
 
-    logger = logging.getLogger(name)
-    if level == 'info':
-        logger.info(msg)
-    elif level == 'debug':
-        logger.debug(msg)
-    elif level == 'error':
-        logger.error(msg)
+    logging.getLogger(name).log(LOG_LEVELS[level], msg, *args)
+
+
+def log_enabled(name, level):
+    """Return True if messages of a level are written for a logger. Use this to skip
+    building expensive log message values, i.e. joined read ids, in loops.
+    """
+
+    return logging.getLogger(name).isEnabledFor(LOG_LEVELS[level])
 
 
 def stringify(fn):
@@ -231,14 +336,123 @@ def test_cutadapt(fqFn, cutadaptBinary, cutadaptConfigFn):
         return (fqCleanFn, returnCode)
 
 
-def test_jellyfish(jfish_bin, fa_fn, analysis_dir):
+def get_binary_key(binaryPath):
+    """Create a key string that identifies a specific installed binary file.
+
+    The key is composed of the absolute path, the modification time and the size
+    of the file so that any re-installation or upgrade of the binary changes the key.
+
+    Args:
+        binaryPath (str):   The path to the binary file.
+    Returns:
+        key (str):          String formatted <path>|<mtime>|<size>, None if the file does not exist.
+    Raises:
+        None
+    """
+
+    if not binaryPath or not os.path.exists(binaryPath):
+        return None
+    fullPath = os.path.realpath(os.path.abspath(binaryPath))
+    fileStat = os.stat(fullPath)
+    return '%s|%d|%d' % (fullPath, int(fileStat.st_mtime), fileStat.st_size)
+
+
+def load_binary_cache(cacheFn):
+    """Load the cached binary check results from a json file.
+
+    Args:
+        cacheFn (str):  The path to the cache file.
+    Returns:
+        cache (dict):   The cached values, empty if the file does not exist or cannot be parsed.
+    Raises:
+        None
+    """
+
+    cache = {}
+    if os.path.isfile(cacheFn):
+        try:
+            cache = json.load(open(cacheFn, 'r'))
+        except ValueError:
+            cache = {}
+    return cache
+
+
+def write_binary_cache(cacheFn, cache):
+    """Write the binary check results to a json file. The file is written to
+    a temporary file and then moved into place so that concurrent runs never
+    read a partially written cache.
+
+    Args:
+        cacheFn (str):  The path to the cache file.
+        cache (dict):   The values to store.
+    Returns:
+        None
+    Raises:
+        None
     """
+
+    tmpFn = '%s.%d.tmp' % (cacheFn, os.getpid())
+    try:
+        tmpFile = open(tmpFn, 'w')
+        json.dump(cache, tmpFile, indent=2, sort_keys=True)
+        tmpFile.close()
+        os.rename(tmpFn, cacheFn)
+    except (IOError, OSError):
+        log('breakmer.utils', 'debug', 'Unable to write binary check cache file %s' % cacheFn)
+
+
+def get_jellyfish_version(jfish_bin):
+    """Determine the major version of the jellyfish binary.
+
+    Args:
+        jfish_bin (str):        The path to the jellyfish binary.
+    Returns:
+        jfish_version (int):    The major version number (e.g., 1 or 2).
+    Raises:
+        None
     """
 
     cmd = '%s --version' % jfish_bin
     p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
     output, errors = p.communicate()
-    jfish_version = int(output.split()[1].split('.')[0])
+    return int(output.split()[1].split('.')[0])
+
+
+def get_cutadapt_version(cutadaptBinary):
+    """Determine the version string of the cutadapt binary.
+
+    Args:
+        cutadaptBinary (str):   The path to the cutadapt binary.
+    Returns:
+        version (str):          The version string reported by cutadapt --version.
+    Raises:
+        None
+    """
+
+    cmd = '%s %s --version' % (sys.executable, cutadaptBinary)
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    output, errors = p.communicate()
+    return (output.strip() or errors.strip()).split('\n')[-1]
+
+
+def test_jellyfish(jfish_bin, fa_fn, analysis_dir, jfish_version=None):
+    """Test the jellyfish binary by counting and dumping the 15-mers of a small
+    sequence file.
+
+    The count and dump files are written to the analysis directory. Jellyfish
+    versions before 2 write the counts to <count file>_0.
+
+    Args:
+        jfish_bin (str):        The full path to the jellyfish binary.
+        fa_fn (str):            The full path to the fasta or fastq file to count.
+        analysis_dir (str):     Directory to write the test files to.
+        jfish_version (int):    Jellyfish major version, determined from the binary if None.
+    Returns:
+        A tuple with the name of the step that failed, or "Jellyfish", and the return code.
+    """
+
+    if jfish_version is None:
+        jfish_version = get_jellyfish_version(jfish_bin)
 
     kmer_size = 15
     count_fn = os.path.join(analysis_dir, "test_jellyfish_counts")
@@ -346,26 +560,44 @@ def check_intervals(breakpts, query_region):
     return in_values, span_values
 
 
-def setup_logger(logFnPath, name):
+def setup_logger(logFnPath, name, level='INFO', moduleLevels=None):
     """Creates the logger object and associated text file to use throughout
     the analysis.
     It first creates a log.txt file in the specified analyis directory as the
     FileHandler. The console handler is then formatted to report the time,
     name of the source, level of the message and the message.
+
+    The logger sends the records to a queue that is read by a LogListener thread
+    in the main process, which writes them to the file and console handlers. The
+    pool worker processes inherit the queue handler so that only the main process
+    writes to the log file.
+
     Args:
         log_fn_path: Absolute path for the directory that will contain the
         log file.
         name: The name of the package to initially setup the logger object.
+        level: Log level name for the package logger (DEBUG, INFO or ERROR).
+        moduleLevels: Comma separated module log levels overriding the package level,
+        i.e. assembly=DEBUG,breakmer.caller.sv_caller=DEBUG. Module names are relative to the
+        package name if they do not start with it.
     Returns:
         Nothing is returned.
     """
 
+    global LOG_LISTENER
+
     outputPath = os.path.abspath(logFnPath)
     if not os.path.exists(outputPath):
         os.makedirs(outputPath)
 
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(get_log_level(level))
+    if moduleLevels:
+        for moduleLevel in moduleLevels.split(','):
+            moduleName, moduleLevelName = moduleLevel.split('=')
+            if moduleName != name and not moduleName.startswith(name + '.'):
+                moduleName = name + '.' + moduleName
+            logging.getLogger(moduleName).setLevel(get_log_level(moduleLevelName))
 
     # FileHandler
     fileHandle = logging.FileHandler(os.path.join(outputPath, 'log.txt'), mode='w')
@@ -378,8 +610,88 @@ def setup_logger(logFnPath, name):
     fileHandle.setFormatter(formatter)
     consoleHandle.setFormatter(formatter)
 
-    logger.addHandler(fileHandle)
-    logger.addHandler(consoleHandle)
+    logQueue = multiprocessing.Queue()
+    LOG_LISTENER = LogListener(logQueue, [fileHandle, consoleHandle])
+    LOG_LISTENER.start()
+    atexit.register(stop_logger)
+    logger.addHandler(QueueHandler(logQueue))
+
+
+def get_log_level(levelName):
+    """Return the logging level value for a level name (DEBUG, INFO or ERROR)."""
+    if levelName.lower() not in LOG_LEVELS:
+        raise ValueError('Log level %s is not one of %s' % (levelName, ', '.join(sorted([x.upper() for x in LOG_LEVELS]))))
+    return LOG_LEVELS[levelName.lower()]
+
+
+def stop_logger():
+    """Write the remaining queued log records and stop the log listener thread.
+    This is only done in the process that started the listener.
+    """
+
+    global LOG_LISTENER
+
+    if LOG_LISTENER is not None and LOG_LISTENER.pid == os.getpid():
+        LOG_LISTENER.stop()
+        LOG_LISTENER = None
+
+
+class QueueHandler(logging.Handler):
+    """Logging handler that puts the records in a multiprocessing queue. The message
+    is formatted with its arguments and the exception information is converted to
+    text before the record is queued, so that only strings are pickled.
+
+    Attributes:
+        queue (Queue):  multiprocessing Queue read by the LogListener.
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class LogListener(threading.Thread):
+    """Thread in the main process that writes the queued log records to the handlers.
+
+    Attributes:
+        queue (Queue):      multiprocessing Queue with the log records, None stops the thread.
+        handlers (list):    Logging handlers writing the records.
+        pid (int):          Process id of the process that started the listener.
+    """
+
+    def __init__(self, queue, handlers):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.handlers = handlers
+        self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        """Queue the stop value and wait for the queued records to be written."""
+        self.queue.put(None)
+        self.join()
+        for handler in self.handlers:
+            handler.flush()
 
 
 # def check_repeat_regions(coords, repeat_locs):
@@ -415,52 +727,50 @@ def get_marker_fn(fn):
     return os.path.join(os.path.split(fn)[0], "." + os.path.basename(fn))
 
 
-def run_jellyfish(fa_fn, jellyfish, kmer_size):
+def run_jellyfish(fa_fn, jellyfish, kmer_size, jfish_version=None):
     """
     """
 
-    logger = logging.getLogger('root')
+    loggingName = 'breakmer.utils'
     file_path = os.path.split(fa_fn)[0]
     file_base = os.path.basename(fa_fn)
     dump_fn = os.path.join(file_path, file_base + "_" + str(kmer_size) + "mers_dump")
     dump_marker_fn = get_marker_fn(dump_fn)
     if not os.path.isfile(dump_marker_fn):
         if not os.path.exists(fa_fn):
-            logger.info('%s does not exist.' % fa_fn)
+            log(loggingName, 'info', '%s does not exist.', fa_fn)
             dump_fn = None
             return dump_fn
-        cmd = '%s --version' % jellyfish
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        output, errors = p.communicate()
-        jfish_version = int(output.split()[1].split('.')[0])
-        logger.info('Using jellyfish version %d' % jfish_version)
+        if jfish_version is None:  # Version was not resolved by the binary check.
+            jfish_version = get_jellyfish_version(jellyfish)
+        log(loggingName, 'info', 'Using jellyfish version %d', jfish_version)
 
         count_fn = os.path.join(file_path, file_base + "_" + str(kmer_size) + "mers_counts")
-        logger.info('Running %s on file %s to determine kmers' % (jellyfish, fa_fn))
+        log(loggingName, 'info', 'Running %s on file %s to determine kmers', jellyfish, fa_fn)
         cmd = '%s count -m %d -s %d -t %d -o %s %s' % (jellyfish, kmer_size, 100000000, 8, count_fn, fa_fn)
-        logger.info('Jellyfish counts system command %s' % cmd)
+        log(loggingName, 'debug', 'Jellyfish counts system command %s', cmd)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
         output, errors = p.communicate()
-        logger.info('Jellyfish count output %s' % output)
-        logger.info('Jellyfish count errors %s' % errors)
+        log(loggingName, 'debug', 'Jellyfish count output %s', output)
+        log(loggingName, 'debug', 'Jellyfish count errors %s', errors)
 
         if jfish_version < 2:
             count_fn += '_0'
         cmd = '%s dump -c -o %s %s' % (jellyfish, dump_fn, count_fn)
-        logger.info('Jellyfish dump system command %s' % cmd)
+        log(loggingName, 'debug', 'Jellyfish dump system command %s', cmd)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
         output, errors = p.communicate()
-        logger.info('Jellyfish dump output %s' % output)
-        logger.info('Jellyfish dump errors %s' % errors)
+        log(loggingName, 'debug', 'Jellyfish dump output %s', output)
+        log(loggingName, 'debug', 'Jellyfish dump errors %s', errors)
         cmd = 'touch %s' % dump_marker_fn
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
         output, errors = p.communicate()
-        logger.info('Completed jellyfish dump %s, touching marker file %s' % (dump_fn, dump_marker_fn))
+        log(loggingName, 'info', 'Completed jellyfish dump %s, touching marker file %s', dump_fn, dump_marker_fn)
         count_fns = glob.glob(os.path.join(file_path, "*mers_counts*"))
         for cf in count_fns:
             os.remove(cf)
     else:
-        logger.info('Jellfish already run and kmers already generated for target.')
+        log(loggingName, 'debug', 'Jellfish already run and kmers already generated for target.')
     return dump_fn
 
 
@@ -516,6 +826,43 @@ def setup_ref_data(setup_params):
                 os.remove(os.path.join(gene_ref_path, name + '_start_end_refseq.fa'))
 
 
+def check_cleaned_read(cleaned_seq, old_seq, sc_seqs):
+    """Determine if a cleaned read should be kept based on whether the softclipped
+    sequences survived the cleaning.
+
+    The read is not kept if a softclipped sequence was trimmed off or if the
+    cleaned sequence is the read with only the clipped portion removed.
+
+    Args:
+        cleaned_seq (str):  The cleaned read sequence.
+        old_seq (str):      The read sequence before cleaning.
+        sc_seqs (dict):     Dictionary containing the 'clipped' sequences of the read, None for unmapped reads.
+    Returns:
+        add (boolean):      True if the read should be kept.
+    """
+
+    add = True
+    if str(cleaned_seq) != str(old_seq) and sc_seqs:
+        sc_clips = sc_seqs['clipped']
+        idx = old_seq.find(cleaned_seq)
+        trimmed_seq = ''
+        if idx == 0:
+            trimmed_seq = old_seq[len(cleaned_seq):len(old_seq)]
+        else:
+            trimmed_seq = old_seq[0:idx]
+        sc_lens = 0
+        for sc_seq in sc_clips:
+            sc_lens += len(sc_seq)
+            if trimmed_seq.find(sc_seq) > -1:
+                add = False
+        if len(cleaned_seq) == (len(old_seq) - sc_lens):
+            for sc_seq in sc_clips:
+                if cleaned_seq.find(sc_seq) == -1:
+                    # Don't add, just trimmed clipped portion.
+                    add = False
+    return add
+
+
 def get_fastq_reads(fn, sv_reads):
     """
     """
@@ -532,27 +879,7 @@ def get_fastq_reads(fn, sv_reads):
         qname = "_".join(qname_split[0:len(qname_split) - 1])
         if qname in sv_reads:
             oseq, sc_seqs, clip_coords, indel_meta = sv_reads[qname]
-            cleaned_seq = seq
-            old_seq = oseq.seq
-            add = True
-            if str(cleaned_seq) != str(old_seq) and sc_seqs:
-                sc_clips = sc_seqs['clipped']
-                idx = old_seq.find(cleaned_seq)
-                trimmed_seq = ''
-                if idx == 0:
-                    trimmed_seq = old_seq[len(cleaned_seq):len(old_seq)]
-                else:
-                    trimmed_seq = old_seq[0:idx]
-                sc_lens = 0
-                for sc_seq in sc_clips:
-                    sc_lens += len(sc_seq)
-                    if trimmed_seq.find(sc_seq) > -1:
-                        add = False
-                if len(cleaned_seq) == (len(old_seq) - sc_lens):
-                    for sc_seq in sc_clips:
-                        if cleaned_seq.find(sc_seq) == -1:
-                            # Don't add, just trimmed clipped portion.
-                            add = False
+            add = check_cleaned_read(seq, oseq.seq, sc_seqs)
         if add:
             filt_fq.write(header + "\n" + seq + "\n+\n" + qual + "\n")
             fr = fq_read(header, seq, qual, indel_meta)
@@ -655,80 +982,6 @@ def extract_refseq_fa(gene_coords, ref_path, ref_fa, direction, target_fa_fn):
     return target_fa_fn
 
 
-def seq_trim(qual_str, min_qual):
-    """
-    """
-
-    counter = 0
-    while ord(qual_str[counter]) - 33 < min_qual:
-        counter += 1
-        if counter == len(qual_str):
-            break
-    return counter
-
-
-def get_seq_readname(read):
-    """
-    """
-
-    end = '1'
-    if read.is_read2:
-        end = '2'
-    return read.qname + "/" + end
-
-
-def trim_coords(qual_str, min_qual):
-    """
-    """
-
-    q = []
-    coords = [0, len(qual_str)]
-    start = seq_trim(qual_str, min_qual)
-    if start == len(qual_str):
-        return (0, 0, 0)
-    else:
-        end = len(qual_str) - seq_trim(qual_str[::-1], min_qual)
-        lngth = end - start
-        return (start, end, lngth)
-
-
-def trim_qual(read, min_qual, min_len):
-    """
-    """
-
-    qual_str = read.qual
-    q = []
-    coords = [0, len(qual_str)]
-    start = seq_trim(qual_str, min_qual)
-    if start == len(qual_str):
-        return None
-    else:
-        end = len(qual_str) - seq_trim(qual_str[::-1], min_qual)
-        lngth = end - start
-        if lngth < min_len:
-            return None
-        nseq = read.seq[start:end]
-        nqual = qual_str[start:end]
-        read.seq = nseq
-        read.qual = nqual
-        return read
-
-
-def fq_line(read, indel_only, min_len, trim=True):
-    """
-    """
-
-    add_val = '0'
-    if indel_only:
-        add_val = '1'
-    lineout = None
-    if trim:
-        read = trim_qual(read, 5, min_len)
-    if read:
-        lineout = "@" + get_seq_readname(read) + "_" + add_val + "\n" + read.seq + "\n+\n" + read.qual + "\n"
-    return lineout
-
-
 def get_overlap_index_nomm(a, b):
     """
     """
@@ -820,34 +1073,245 @@ class fq_read:
         self.indel_only = indel_only
 
 
-class FastqFile(object):
+def open_fastq(fn):
+    """Open a fastq file for reading, gzip compressed files are detected by the
+    file extension or the gzip magic number.
+
+    Args:
+        fn (str):   Path to the fastq file.
+    Returns:
+        File object opened in binary mode.
     """
+
+    fqFile = open(fn, 'rb')
+    if fn.endswith('.gz') or fqFile.read(2) == '\x1f\x8b':
+        fqFile.close()
+        return gzip.open(fn, 'rb')
+    fqFile.seek(0)
+    return fqFile
+
+
+class FastqFile(object):
+    """Iterate over the records in a fastq file, returning a tuple (header, seq, qual)
+    for each record.
+
+    The file is read in large chunks into a buffer and the records are sliced out
+    of the buffer through a memoryview, so there is no per-line file reading. The header
+    line is returned as is (without the newline), no particular read name format is assumed.
+    Plain text and gzip compressed files are supported.
+
+    Args:
+        f (str or file):    Path to the fastq file or an open file object.
+        bufferSize (int):   Number of bytes to read in each chunk.
+    Raises:
+        ValueError when a record is not properly formatted.
     """
-    def __init__(self, f):
-        if isinstance(f, str):
-            f = open(f)
-            self._f = f
+
+    def __init__(self, f, bufferSize=4194304):
+        if isinstance(f, basestring):
+            f = open_fastq(f)
+        self._f = f
+        self.bufferSize = bufferSize
+        self._records = self.parse()
 
     def __iter__(self):
         return self
 
     def next(self):
-        header, seq, qual_header, qual = [self._f.next() for _ in range(4)]
-        header = header.strip()
-        inst, lane, tile, x, y_end = header.split(':')
-        seq = seq.strip()
-        qual = qual.strip()
-        bc = None
-        y = y_end
-        if y.find('/') > -1:
-            y, end = y.split('/')
-        if y.find('#') > -1:
-            y, bc = y.split('#')
-        header_dict = {'inst': inst,
-                       'lane': int(lane),
-                       'tile': int(tile),
-                       'x': int(x),
-                       'y': int(y),
-                       'end': end,
-                       'bc': bc}
-        return (header, seq, qual)
+        return self._records.next()
+
+    def parse(self):
+        """Generator for the fastq records.
+
+        Args:
+            None
+        Returns:
+            Tuple of (header, seq, qual) strings.
+        """
+
+        buf = bytearray()
+        eof = False
+        while not eof:
+            chunk = self._f.read(self.bufferSize)
+            if not chunk:
+                eof = True
+                if len(buf) > 0 and buf[-1] != ord('\n'):
+                    buf.extend('\n')  # Allow the last record to be missing the final newline.
+            buf.extend(chunk)
+            view = memoryview(buf)
+            pos = 0
+            while True:
+                # Locate the four line ends of the next record.
+                lineEnds = []
+                lineStart = pos
+                for i in range(4):
+                    lineEnd = buf.find('\n', lineStart)
+                    if lineEnd == -1:
+                        break
+                    lineEnds.append(lineEnd)
+                    lineStart = lineEnd + 1
+                if len(lineEnds) < 4:
+                    break
+                header = view[pos:lineEnds[0]].tobytes().rstrip()
+                seq = view[(lineEnds[0] + 1):lineEnds[1]].tobytes().rstrip()
+                qual = view[(lineEnds[2] + 1):lineEnds[3]].tobytes().rstrip()
+                if header[0:1] != '@' or buf[lineEnds[1] + 1] != ord('+'):
+                    raise ValueError('Improperly formatted fastq record %s in %s' % (header, getattr(self._f, 'name', self._f)))
+                yield (header, seq, qual)
+                pos = lineEnds[3] + 1
+            del view  # Release the buffer before it is resized.
+            del buf[0:pos]
+        if len(buf.strip()) > 0:
+            raise ValueError('Truncated fastq record at the end of %s' % getattr(self._f, 'name', self._f))
+        self._f.close()
+
+
+class BackgroundTask(threading.Thread):
+    """Run a function in a background thread. The function return value or
+    exception is passed back to the caller by get().
+
+    Attributes:
+        fnc (function):     Function to run.
+        args (tuple):       Arguments passed to the function.
+        result:             Value returned by the function.
+        error (tuple):      Exception information if the function raised an exception.
+    """
+
+    def __init__(self, fnc, *args):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fnc = fnc
+        self.args = args
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.fnc(*self.args)
+        except Exception:
+            self.error = sys.exc_info()
+
+    def get(self):
+        """Wait for the function to complete and return its value, re-raising any
+        exception from the background thread.
+
+        Args:
+            None
+        Returns:
+            The function return value.
+        """
+
+        self.join()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.result
+
+
+def format_seconds(value):
+    """Return a time in seconds formatted for a tab delimited output file, NA if it is not known."""
+    return 'NA' if value is None else '%.3f' % value
+
+
+class StageTracker(object):
+    """Record the wall time, CPU time, process peak memory and item counts of the
+    analysis stages of a target.
+
+    Stages can be run more than once and from several threads at the same time
+    (contigs are realigned in a thread pool, the normal sample reads are processed
+    in a background thread), the wall times and counts of each run are summed.
+    CPU times are process-wide, the CPU time of the process (cpu) and of the
+    finished child processes such as jellyfish, cutadapt and blat (child_cpu)
+    are only the CPU times of the stage if no other stage ran at the same time,
+    they are None for a stage with a run that overlapped another run.
+    The process peak memory (process_max_rss_kb) is the resident set size
+    high-water mark of the process when the stage stopped, including the
+    memory used by the earlier targets analyzed in the same process, not the
+    memory used by the stage.
+
+    Attributes:
+        name (str):     Target name.
+        stages (dict):  Stage records keyed by stage name.
+        order (list):   Stage names in the order they were first started.
+        running (dict): Start values and overlap flag lists keyed by stage name and thread id.
+        lock (Lock):    Lock for the stage records.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.order = []
+        self.running = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        """Drop the lock when the target is sent to a worker process."""
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get_usage(self):
+        """Return a tuple with the wall time, process CPU time, child process CPU time and peak RSS."""
+        selfUsage = resource.getrusage(resource.RUSAGE_SELF)
+        childUsage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return (time.time(), selfUsage.ru_utime + selfUsage.ru_stime, childUsage.ru_utime + childUsage.ru_stime, selfUsage.ru_maxrss)
+
+    def start(self, stage):
+        """Start timing a stage in the current thread."""
+        self.lock.acquire()
+        try:
+            if stage not in self.stages:
+                self.stages[stage] = {'runs': 0, 'wall': 0.0, 'cpu': 0.0, 'child_cpu': 0.0, 'process_max_rss_kb': 0, 'counts': {}}
+                self.order.append(stage)
+            overlap = len(self.running) > 0
+            for runValues in self.running.values():  # The running stages overlap the new one.
+                runValues[1] = True
+            self.running[(stage, threading.current_thread().ident)] = [self.get_usage(), overlap]
+        finally:
+            self.lock.release()
+
+    def stop(self, stage, **counts):
+        """Stop timing a stage in the current thread and add the item counts to the stage record.
+
+        Args:
+            stage (str):    Stage name.
+            counts (dict):  Item counts processed in the stage, i.e. reads=100.
+        Returns:
+            None
+        """
+
+        stopValues = self.get_usage()
+        self.lock.acquire()
+        try:
+            runValues = self.running.pop((stage, threading.current_thread().ident), None)
+            if runValues is None:
+                return
+            startValues, overlap = runValues
+            record = self.stages[stage]
+            record['runs'] += 1
+            record['wall'] += stopValues[0] - startValues[0]
+            if overlap or record['cpu'] is None:
+                record['cpu'], record['child_cpu'] = None, None
+            else:
+                record['cpu'] += stopValues[1] - startValues[1]
+                record['child_cpu'] += stopValues[2] - startValues[2]
+            record['process_max_rss_kb'] = max(record['process_max_rss_kb'], stopValues[3])
+            for key in counts:
+                record['counts'][key] = record['counts'].get(key, 0) + counts[key]
+        finally:
+            self.lock.release()
+
+    def get_records(self):
+        """Return a list of dictionaries with the target name, stage name, worker process id and values of each stage, in stage order."""
+        records = []
+        for stage in self.order:
+            record = dict(self.stages[stage])
+            record['counts'] = dict(record['counts'])
+            record['target'] = self.name
+            record['stage'] = stage
+            record['pid'] = os.getpid()
+            records.append(record)
+        return records
@@ -17,6 +17,7 @@ setup(name='BreaKmer',
       py_modules=['BreaKmer'],
       install_requires=[
         'pysam >= 0.6',
-        'biopython >= 1.62'
+        'biopython >= 1.62',
+        'numpy >= 1.7'
       ]  
       )